@@ -86,15 +86,9 @@ def overlap(X, window_size, window_step):
 
     valid = len(a) - ws
     nw = int((valid) // ss)
-    out = np.ndarray((nw,ws),dtype = a.dtype)
-
-    for i in range(nw):
-        # "slide" the window along the samples
-        start = i * ss
-        stop = start + ws
-        out[i] = a[start : stop]
-
-    return out
+    # "slide" the window along the samples: a strided view, copied once
+    out = np.lib.stride_tricks.as_strided(a, shape=(nw, ws), strides=(ss * a.strides[0], a.strides[0]))
+    return out.copy()
 
 
 def stft(X, fftsize=128, step=65, mean_normalize=True, real=False,
@@ -0,0 +1,156 @@
+'''
+batch_prefetcher.py
+
+batches loaded ahead on a thread pool while the training thread works on the current one,
+no tensorflow needed (feed_dict training, sampling, scripts)
+
+    with BatchPrefetcher(store.tiles, row_batches, depth=4, n_threads=2) as batches:
+        for batch in batches:                       # in row_batches order
+            sess.run(..., feed_dict={real_data: batch})
+            print(batches.last_wait)                # secs this step waited for its batch
+    print(batches.stats())
+
+load(spec) is called for every spec of specs (e.g. the rows of a batch) on n_threads threads, at
+most depth batches are being loaded or waiting to be taken at any time (a batch is only submitted once
+one of depth slots is free, get() frees the slot of the batch it hands out). an exception raised by load()
+(or by specs itself) is raised again in the thread taking that batch, which also stops the loading.
+close() (or leaving the with block) stops loading and joins the threads, get() raises StopIteration after it.
+
+a training thread that waits on the queue (last_wait, stats()) is input bound, more threads or
+depth help; waits near 0 mean loading is hidden behind the training step.
+
+'''
+
+import time
+import threading
+import queue
+from multiprocessing.pool import ThreadPool
+
+_done = object()        #end of specs
+
+
+class _Failed(object):
+    #an exception of the feeding thread, raised again by get()
+    def __init__(self, error):
+        self.error = error
+
+    def ready(self):
+        return True
+
+    def get(self):
+        raise self.error
+
+
+class BatchPrefetcher(object):
+    def __init__(self, load, specs, depth=2, n_threads=2):
+        if depth < 1:
+            raise ValueError("depth must be >= 1, got {depth}".format(depth=depth))
+        self.load = load
+        self.waits = []
+        self.last_wait = 0.0
+        self._queue = queue.Queue(maxsize=depth)
+        self._slots = threading.Semaphore(depth)   #batches submitted and not taken yet
+        self._stop = threading.Event()
+        self._pool = ThreadPool(n_threads)
+        self._feeder = threading.Thread(target=self._feed, args=(iter(specs),), name="batch_prefetcher")
+        self._feeder.daemon = True
+        self._feeder.start()
+        self._finished = False
+        self._closed = False
+
+    def _acquire(self):
+        #waits for a free slot, gives up once close() is called
+        while not self._stop.is_set():
+            if self._slots.acquire(timeout=0.1):
+                return True
+        return False
+
+    def _put(self, item):
+        #blocks while the queue is full, gives up once close() is called
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _feed(self, specs):
+        try:
+            for spec in specs:
+                if not self._acquire() or not self._put(self._pool.apply_async(self.load, (spec,))):
+                    return
+        except Exception as e:
+            self._put(_Failed(e))
+            return
+        self._put(_done)
+
+    def get(self):
+        #the next batch, waits for it if it is not loaded yet. StopIteration after the last one, and once closed
+        if self._finished or self._closed:
+            raise StopIteration
+        start = time.time()
+        item = None
+        while item is None:
+            try:
+                item = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._closed:        #close() from another thread, nothing more will come
+                    self._finished = True
+                    raise StopIteration
+        if item is _done:
+            self._finished = True
+            raise StopIteration
+        try:
+            while not item.ready():
+                item.wait(0.1)
+                if self._closed and not item.ready():
+                    self._finished = True
+                    raise StopIteration
+            batch = item.get()
+        except StopIteration:
+            raise
+        except Exception:
+            self._finished = True
+            self.close()
+            raise
+        finally:
+            if not isinstance(item, _Failed):
+                self._slots.release()
+        self.last_wait = time.time() - start
+        self.waits.append(self.last_wait)
+        return batch
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.get()
+
+    def stats(self):
+        #wait of the training thread on the queue so far (secs)
+        n = len(self.waits)
+        total = sum(self.waits)
+        return {"batches": n, "total_wait": total, "mean_wait": total / n if n else 0.0,
+                "max_wait": max(self.waits) if n else 0.0}
+
+    def close(self):
+        #stops loading, joins the feeding thread and the pool (batches not taken yet are dropped)
+        if self._closed:
+            return
+        self._closed = True
+        self._stop.set()
+        while True:     #unblock a feeder waiting on a full queue
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        self._feeder.join()
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
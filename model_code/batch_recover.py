@@ -0,0 +1,175 @@
+'''
+batch_recover.py
+
+generated tiles (.npy) turned into wavs by a pool of processes, one tile file per job
+
+    python batch_recover.py ./test sample_99.npy sample_199.npy --n_workers 8
+    python batch_recover.py ./test --out_dir ./test_wav --freq_frontend mel --freq_bins 256
+
+a directory stands for every .npy in it. <name>.npy becomes <out_dir>/<name>.wav (default: next
+to the npy), a file holding a batch of n tiles [n, h, w, c] becomes <name>_0.wav ... <name>_n-1.wav.
+a wav newer than its npy is up to date and skipped (--force makes them all again); wavs are
+written aside and renamed, so a killed run leaves no half written wav behind and the next run
+resumes where it stopped.
+
+a tile with 2 channels (a tile of the store, [h, w, 2]) is recovered from --channel (default 1, the ensemble).
+
+<name>.phase.npy next to <name>.npy holds the phase of its tiles ([n,] frames, fft_size//2, radians or
+uint8, e.g. tile_store phases() of the tiles the model was fed). such tiles are a single istft plus
+--phase_iter griffin-lim iterations (default 0) instead of --n_iter iterations from zero phase.
+
+'''
+
+import os
+import sys
+import time
+import argparse
+from glob import glob
+from multiprocessing import Pool
+import numpy as np
+import preprocess as pr
+import fft_backend as fftb
+
+
+phase_suffix = ".phase.npy"
+
+
+def tile_files(paths):
+    #.npy files of paths (files, or directories standing for the .npy files in them), sorted, no duplicates
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(npy for npy in glob(os.path.join(path, "*.npy")) if not npy.endswith(phase_suffix))
+        elif path.endswith(".npy"):
+            files.append(path)
+        else:
+            raise ValueError("{path} is neither a directory nor a .npy file".format(path=path))
+    return sorted(set(files))
+
+def phase_file(npy):
+    #the phase next to npy, None if it has none
+    path = npy[:-len(".npy")] + phase_suffix
+    return path if os.path.exists(path) else None
+
+def wav_path(npy, out_dir=None, k=None):
+    stem = os.path.splitext(os.path.basename(npy))[0]
+    if k is not None:
+        stem = "{stem}_{k}".format(stem=stem, k=k)
+    return os.path.join(out_dir if out_dir is not None else os.path.dirname(npy), stem + ".wav")
+
+def split_tiles(array, channel=1):
+    #(h, w), (h, w, c) or (n, h, w, c) --> list of (h, w) tiles
+    if array.ndim == 2:
+        return [array]
+    if array.ndim == 3:
+        return [array[:, :, channel if array.shape[2] > 1 else 0]]
+    if array.ndim == 4:
+        return [tile for first in array for tile in split_tiles(first, channel)]
+    raise ValueError("expected a tile (h, w[, c]) or a batch of them (n, h, w, c), got shape {shape}".format(shape=array.shape))
+
+def n_tiles(npy):
+    #tiles of a npy file, read from its header only
+    shape = np.load(npy, mmap_mode="r").shape
+    return shape[0] if len(shape) == 4 else 1
+
+def outputs(npy, out_dir=None):
+    #wavs npy turns into
+    n = n_tiles(npy)
+    if n == 1:
+        return [wav_path(npy, out_dir)]
+    return [wav_path(npy, out_dir, k) for k in range(n)]
+
+def is_up_to_date(npy, wavs):
+    npy_mtime = max(os.path.getmtime(path) for path in (npy, phase_file(npy)) if path is not None)
+    return all(os.path.exists(wav) and os.path.getmtime(wav) >= npy_mtime for wav in wavs)
+
+
+def init_worker(backend):
+    #one fft thread per process, the pool is the parallelism
+    fftb.set_backend(backend, workers=1)
+
+def recover_file(job):
+    #job: (npy, wavs, frontend, channel, rate, dtype, n_iter, phase_iter) --> (npy, secs, error message or None)
+    npy, wavs, frontend, channel, rate, dtype, n_iter, phase_iter = job
+    start = time.time()
+    try:
+        tiles = split_tiles(np.load(npy), channel)
+        phases = [None] * len(tiles)
+        if phase_file(npy) is not None:
+            phases = np.load(phase_file(npy)).reshape((len(tiles), tiles[0].shape[0], -1))
+            n_iter = phase_iter
+        for tile, phase, wav in zip(tiles, phases, wavs):
+            pr.recover_audio(wav + ".part", tile, frontend=frontend, rate=rate, dtype=dtype, n_iter=n_iter, verbose=False,
+                             phase=phase)
+            os.replace(wav + ".part", wav)
+    except Exception as e:
+        return npy, time.time() - start, "{kind}: {e}".format(kind=type(e).__name__, e=e)
+    return npy, time.time() - start, None
+
+def recover_all(paths, out_dir=None, frontend=None, channel=1, rate=44100, dtype="float32", n_iter=10, phase_iter=0,
+                n_workers=None, backend="numpy", force=False):
+    #recovers every tile file of paths whose wavs are missing or older than it
+    #--> list of (npy, error message) of the files that failed
+    if out_dir is not None and not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    files = tile_files(paths)
+    jobs = []
+    for npy in files:
+        wavs = outputs(npy, out_dir)
+        if force or not is_up_to_date(npy, wavs):
+            jobs.append((npy, wavs, frontend, channel, rate, dtype, n_iter, phase_iter))
+    print("{n} tile files, {skipped} up to date, {todo} to recover".format(n=len(files), skipped=len(files)-len(jobs), todo=len(jobs)))
+    if not jobs:
+        return []
+
+    n_workers = min(n_workers or fftb.default_workers(), len(jobs))
+    if n_workers <= 1:
+        init_worker(backend)
+        done = map(recover_file, jobs)
+        pool = None
+    else:
+        pool = Pool(n_workers, initializer=init_worker, initargs=(backend,))
+        done = pool.imap_unordered(recover_file, jobs)
+    failed = []
+    start = time.time()
+    try:
+        for count, (npy, secs, error) in enumerate(done, 1):
+            elapsed = time.time() - start
+            eta = elapsed / count * (len(jobs) - count)
+            status = "failed, " + error if error is not None else "{secs:.1f}s".format(secs=secs)
+            print("[{count}/{total}] {npy} {status} (elapsed {elapsed:.0f}s, eta {eta:.0f}s)".format(
+                count=count, total=len(jobs), npy=npy, status=status, elapsed=elapsed, eta=eta))
+            sys.stdout.flush()
+            if error is not None:
+                failed.append((npy, error))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    print("{n} recovered in {secs:.0f}s with {workers} workers, {failed} failed".format(
+        n=len(jobs)-len(failed), secs=time.time()-start, workers=n_workers, failed=len(failed)))
+    return failed
+
+
+parser = argparse.ArgumentParser(description='generated .npy tiles --> wavs, in parallel')
+parser.add_argument('paths', nargs='+', help='.npy tile files, or directories of them')
+parser.add_argument('--out_dir', dest='out_dir', default=None, help='wavs are written here (default: next to each npy)')
+parser.add_argument('--n_workers', dest='n_workers', type=int, default=0, help='# of processes, 0: all cores')
+parser.add_argument('--n_iter', dest='n_iter', type=int, default=10, help='griffin-lim iterations per tile')
+parser.add_argument('--phase_iter', dest='phase_iter', type=int, default=0, help='griffin-lim iterations per tile with a .phase.npy')
+parser.add_argument('--rate', dest='rate', type=int, default=44100, help='sample rate of the wavs')
+parser.add_argument('--dtype', dest='dtype', default='float32', help='float32 or int16 wavs')
+parser.add_argument('--channel', dest='channel', type=int, default=1, help='channel recovered from 2 channel tiles')
+parser.add_argument('--freq_frontend', dest='freq_frontend', default='linear', help='linear, mel or logfreq frequency axis of the tiles')
+parser.add_argument('--freq_bins', dest='freq_bins', type=int, default=256, help='# of mel/logfreq bands of the tiles')
+parser.add_argument('--fft_backend', dest='fft_backend', default='numpy', help='numpy, scipy or fftw (one thread per worker)')
+parser.add_argument('--force', dest='force', action='store_true', help='recover up to date tiles again')
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    failed = recover_all(args.paths, out_dir=args.out_dir, frontend=pr.frontend_info(args.freq_frontend, args.freq_bins),
+                         channel=args.channel, rate=args.rate, dtype=args.dtype, n_iter=args.n_iter, phase_iter=args.phase_iter,
+                         n_workers=args.n_workers, backend=args.fft_backend, force=args.force)
+    for npy, error in failed:
+        print("{npy}: {error}".format(npy=npy, error=error))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,164 @@
+'''
+fft_backend.py
+
+FFT backends used by wav2spec.py (stft, invert_spectrogram and everything built on them)
+
+    numpy : np.fft, single threaded (default, always available)
+    scipy : scipy.fft with workers=N threads (scipy >= 1.4)
+    fftw  : pyFFTW builders, plans are made once per (kind, shape, dtype, n) and reused
+
+select one at runtime with
+    set_backend("scipy", workers=8)
+or let the benchmark pick the fastest one on this machine
+    use_fastest()               # python fft_backend.py prints the timings
+
+'''
+
+import os
+import time
+import numpy as np
+
+try:
+    import scipy.fft as scipy_fft
+except ImportError:             # scipy < 1.4
+    scipy_fft = None
+
+try:
+    import pyfftw
+    import pyfftw.builders
+except ImportError:
+    pyfftw = None
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+class NumpyBackend(object):
+    name = "numpy"
+
+    def rfft(self, x, n=None):
+        return np.fft.rfft(x, n=n, axis=-1)
+
+    def irfft(self, x, n=None):
+        return np.fft.irfft(x, n=n, axis=-1)
+
+    def fft(self, x, n=None):
+        return np.fft.fft(x, n=n, axis=-1)
+
+    def ifft(self, x, n=None):
+        return np.fft.ifft(x, n=n, axis=-1)
+
+
+class ScipyBackend(object):
+    name = "scipy"
+
+    def __init__(self, workers=None):
+        if scipy_fft is None:
+            raise ImportError("scipy.fft is not available (needs scipy >= 1.4)")
+        self.workers = workers or default_workers()
+
+    def rfft(self, x, n=None):
+        return scipy_fft.rfft(x, n=n, axis=-1, workers=self.workers)
+
+    def irfft(self, x, n=None):
+        return scipy_fft.irfft(x, n=n, axis=-1, workers=self.workers)
+
+    def fft(self, x, n=None):
+        return scipy_fft.fft(x, n=n, axis=-1, workers=self.workers)
+
+    def ifft(self, x, n=None):
+        return scipy_fft.ifft(x, n=n, axis=-1, workers=self.workers)
+
+
+class FFTWBackend(object):
+    name = "fftw"
+
+    def __init__(self, workers=None, planner_effort="FFTW_MEASURE"):
+        if pyfftw is None:
+            raise ImportError("pyfftw is not installed")
+        self.workers = workers or default_workers()
+        self.planner_effort = planner_effort
+        self._plans = {}
+
+    def _run(self, kind, x, n):
+        x = np.asarray(x)
+        key = (kind, x.shape, x.dtype.str, n)
+        plan = self._plans.get(key)
+        if plan is None:
+            # planning with FFTW_MEASURE overwrites the array, so plan on a scratch one
+            plan = getattr(pyfftw.builders, kind)(pyfftw.empty_aligned(x.shape, dtype=x.dtype),
+                                                  n=n, axis=-1, threads=self.workers,
+                                                  planner_effort=self.planner_effort)
+            self._plans[key] = plan
+        # the plan returns its own output buffer, which the next call overwrites
+        return plan(x).copy()
+
+    def rfft(self, x, n=None):
+        return self._run("rfft", x, n)
+
+    def irfft(self, x, n=None):
+        return self._run("irfft", x, n)
+
+    def fft(self, x, n=None):
+        return self._run("fft", x, n)
+
+    def ifft(self, x, n=None):
+        return self._run("ifft", x, n)
+
+
+backends = {"numpy": NumpyBackend, "scipy": ScipyBackend, "fftw": FFTWBackend}
+
+_backend = NumpyBackend()
+
+
+def available_backends():
+    names = ["numpy"]
+    if scipy_fft is not None:
+        names.append("scipy")
+    if pyfftw is not None:
+        names.append("fftw")
+    return names
+
+
+def set_backend(name="numpy", workers=None):
+    #workers is ignored by numpy
+    global _backend
+    if name not in backends:
+        raise ValueError("unknown fft backend {name}, choose from {names}".format(name=name, names=sorted(backends)))
+    _backend = NumpyBackend() if name == "numpy" else backends[name](workers=workers)
+    return _backend
+
+
+def get_backend():
+    return _backend
+
+
+def benchmark(fft_size=2048, n_frames=1376, dtype=np.float32, repeat=5, workers=None):
+    #seconds per rfft of a (n_frames, fft_size) batch, best of repeat, for every available backend
+    frames = np.random.RandomState(0).standard_normal((n_frames, fft_size)).astype(dtype)
+    timings = {}
+    for name in available_backends():
+        backend = NumpyBackend() if name == "numpy" else backends[name](workers=workers)
+        backend.rfft(frames)                # warm up (plans, thread pools)
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.time()
+            backend.rfft(frames)
+            best = min(best, time.time() - start)
+        timings[name] = best
+    return timings
+
+
+def use_fastest(fft_size=2048, n_frames=1376, dtype=np.float32, repeat=5, workers=None):
+    timings = benchmark(fft_size=fft_size, n_frames=n_frames, dtype=dtype, repeat=repeat, workers=workers)
+    fastest = min(timings, key=timings.get)
+    set_backend(fastest, workers=workers)
+    return fastest, timings
+
+
+if __name__ == "__main__":
+    fastest, timings = use_fastest()
+    for name in sorted(timings, key=timings.get):
+        print("{name:6s} {ms:8.2f} ms".format(name=name, ms=timings[name] * 1000))
+    print("fastest: {name}".format(name=fastest))
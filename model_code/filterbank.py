@@ -0,0 +1,131 @@
+'''
+filterbank.py
+
+triangular mel filterbanks for spectrograms (see specgram_misc/specgram_gen.py)
+
+    bank = mel_filterbank(nfilt=256, NFFT=2048, sample_rate=44100)   # (256, 1025) scipy.sparse matrix
+    mel_spec = apply_filterbank(bank, power_frames)                  # (..., 1025) --> (..., 256)
+
+and the frequency front ends of the tiles (see preprocess.freq_frontend): mel or log-frequency
+bands, each the mean magnitude under its filter, and their approximate inverse back to linear
+bins (the band means interpolated along the filters' slopes)
+
+    analysis, synthesis = frontend_banks("mel", 256, NFFT=2048, sample_rate=44100)
+    bands = apply_filterbank(analysis, magnitudes)                   # (..., 1024) --> (..., 256)
+    linear = apply_filterbank(synthesis, bands)[..., :1024]          # (..., 256) --> (..., 1024)
+
+a filter only covers the few bins between its neighbours' centers, so the bank is built
+band by band straight into a sparse (csr) matrix, no loop over filters and bins, and
+applied as a sparse matmul. banks are cached per (nfilt, NFFT, sample_rate, ...), building
+one again costs nothing.
+
+'''
+
+import numpy as np
+import scipy.sparse
+
+_bank_cache = {}
+
+
+def hz2mel(hz):
+    return 2595 * np.log10(1 + np.asarray(hz) / 700.)
+
+def mel2hz(mel):
+    return 700 * (10**(np.asarray(mel) / 2595.) - 1)
+
+
+def band_bins(bin_points):
+    #filter m rises from bin_points[m] to bin_points[m+1] and falls to bin_points[m+2]
+    # --> (row, column, weight) of every nonzero of the bank
+    left, center, right = bin_points[:-2], bin_points[1:-1], bin_points[2:]
+    counts = (right - left).astype(np.int64)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    cols = np.repeat(left, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    left, center, right = left[rows], center[rows], right[rows]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.where(cols < center, (cols - left) / (center - left), (right - cols) / (right - center))
+    return rows, cols.astype(np.int64), weights
+
+def fractional_band_bins(bin_points, n_bins):
+    #band_bins() with fractional (not floored) points: bins get the weight of where they fall on
+    #each triangle. a filter narrower than a bin (low mel/logfreq bands) gets its nearest bin, so
+    #no band is left empty
+    left, center, right = bin_points[:-2], bin_points[1:-1], bin_points[2:]
+    first = np.clip(np.floor(left).astype(np.int64) + 1, 0, n_bins)
+    counts = np.maximum(np.clip(np.ceil(right).astype(np.int64), 0, n_bins) - first, 0)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    cols = np.repeat(first, counts) + (np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts))
+    left, center, right = left[rows], center[rows], right[rows]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = np.where(cols < center, (cols - left) / (center - left), (right - cols) / (right - center))
+    keep = weights > 0
+    rows, cols, weights = rows[keep], cols[keep], weights[keep]
+    empty = np.setdiff1d(np.arange(len(bin_points) - 2), rows)
+    nearest = np.clip(np.round(bin_points[1:-1][empty]).astype(np.int64), 0, n_bins - 1)
+    return (np.concatenate((rows, empty)), np.concatenate((cols, nearest)),
+            np.concatenate((weights, np.ones(len(empty)))))
+
+def mel_filterbank(nfilt, NFFT, sample_rate, low_freq=0, high_freq=None, dtype=np.float64):
+    #(nfilt, NFFT//2+1) csr matrix, filters equally spaced in mel from low_freq to high_freq (default sample_rate/2)
+    #same weights as the filter by filter, bin by bin loop of specgram_gen.py
+    if high_freq is None:
+        high_freq = sample_rate / 2.
+    key = ("mel", nfilt, NFFT, sample_rate, low_freq, high_freq, np.dtype(dtype).str)
+    bank = _bank_cache.get(key)
+    if bank is None:
+        mel_points = np.linspace(hz2mel(low_freq), hz2mel(high_freq), nfilt + 2)  # Equally spaced in Mel scale
+        bin_points = np.floor((NFFT + 1) * mel2hz(mel_points) / sample_rate)
+        rows, cols, weights = band_bins(bin_points)
+        bank = scipy.sparse.csr_matrix((weights.astype(dtype), (rows, cols)), shape=(nfilt, NFFT // 2 + 1))
+        bank.eliminate_zeros()
+        _bank_cache[key] = bank
+    return bank
+
+
+def logfreq_points(nfilt, low_freq, high_freq):
+    #nfilt+2 points equally spaced in log frequency
+    return np.geomspace(low_freq, high_freq, nfilt + 2)
+
+def mel_points(nfilt, low_freq, high_freq):
+    return mel2hz(np.linspace(hz2mel(low_freq), hz2mel(high_freq), nfilt + 2))
+
+frontends = {"mel": (mel_points, 0.), "logfreq": (logfreq_points, 50.)}   #points, default low_freq
+
+def frontend_banks(kind, nfilt, NFFT, sample_rate, low_freq=None, high_freq=None, dtype=np.float32):
+    #(analysis, synthesis) csr matrices of a mel or logfreq front end, filters from low_freq
+    #(default 0Hz mel, 50Hz logfreq) to high_freq (default sample_rate/2)
+    #analysis (nfilt, NFFT//2+1): mean magnitude under each filter
+    #synthesis (NFFT//2+1, nfilt): every bin interpolated from the filters covering it, bins no
+    #filter covers (below a logfreq low_freq) come back as 0
+    if kind not in frontends:
+        raise ValueError("unknown frequency front end {kind}, choose from linear, {names}".format(
+            kind=kind, names=", ".join(sorted(frontends))))
+    points, default_low = frontends[kind]
+    if low_freq is None:
+        low_freq = default_low
+    if high_freq is None:
+        high_freq = sample_rate / 2.
+    key = (kind, nfilt, NFFT, sample_rate, low_freq, high_freq, np.dtype(dtype).str)
+    banks = _bank_cache.get(key)
+    if banks is None:
+        n_bins = NFFT // 2 + 1
+        bin_points = points(nfilt, low_freq, high_freq) * NFFT / float(sample_rate)
+        rows, cols, weights = fractional_band_bins(bin_points, n_bins)
+        triangles = scipy.sparse.csr_matrix((weights, (rows, cols)), shape=(nfilt, n_bins))
+        band_sums = np.asarray(triangles.sum(axis=1)).ravel()
+        bin_sums = np.asarray(triangles.sum(axis=0)).ravel()
+        analysis = scipy.sparse.diags(1. / band_sums).dot(triangles).tocsr()
+        synthesis = scipy.sparse.diags(1. / np.maximum(bin_sums, 1e-12)).dot(triangles.T).tocsr()
+        banks = (analysis.astype(dtype), synthesis.astype(dtype))
+        _bank_cache[key] = banks
+    return banks
+
+
+def apply_filterbank(bank, spec):
+    #spec (..., n_bins) --> (..., n_filters) through a sparse matmul. spec may have fewer bins than
+    #the bank (e.g. the one-sided spectrograms of wav2spec.py drop the nyquist bin)
+    n_bins = spec.shape[-1]
+    if n_bins < bank.shape[1]:
+        bank = bank[:, :n_bins]
+    flat = spec.reshape(-1, n_bins)
+    return np.ascontiguousarray(bank.dot(flat.T).T).reshape(spec.shape[:-1] + (bank.shape[0],))
@@ -1,11 +1,16 @@
 from __future__ import division
 import os
 import time
+import math
 from glob import glob
 import tensorflow as tf
 import numpy as np
 import preprocess as pr
+import tile_store
+import stitch
+from update_scheduler import UpdateScheduler
 import sys
+from contextlib import ExitStack
 
 from ops import *
 from utils import *
@@ -16,13 +21,27 @@ class pix2pix(object):
                  gf_dim=64, df_dim=64, L1_lambda=100, L2_lambda=0, GAN_lambda=1,
                  input_c_dim=1, output_c_dim=1, dataset_name='bolbbalgan4',
                  checkpoint_dir=None, sample_dir=None, test_dir=None, tagfile_path=None, 
-                 logdir=None, d_sche=None, g_sche=None, smoothe=1.0,):
+                 logdir=None, d_sche=None, g_sche=None, smoothe=1.0, image_shape=None, frontend=None,
+                 input_pipeline="tf.data", train_size=None, input_threads=4, prefetch_batches=2, fused_step=True,
+                 schedule="fixed", d_low=0.5, d_high=2.5):
         """
 
         Args:
             sess: TensorFlow session
             batch_size: The size of batch. Should be specified before training.
             output_size: (optional) The resolution in pixels of the images. [256]
+            image_shape: (optional) (frames, frequency bins) of the tiles, e.g. (1024, 256) for 256 mel bands. [(image_size, image_size)]
+            frontend: (optional) frequency front end of the tiles (tile_store.TileStore.frontend), for recover_audio
+            input_pipeline: (optional) tf.data: training batches come from a tf.data pipeline over the tile store,
+                            feed: from feed_dict only. real_data can always be fed (sampling, test). [tf.data]
+            train_size: (optional) # of tiles used per epoch by the tf.data pipeline [all]
+            input_threads, prefetch_batches: (optional) batches loaded in parallel / kept ready, by the tf.data pipeline
+                            or the feed path (batch_prefetcher.BatchPrefetcher) [4, 2]
+            fused_step: (optional) the losses of a step are fetched by the sess.run of the d/g updates themselves
+                        (2 forward passes a step) instead of 3 more .eval() after them (5 forward passes) [True]
+            d_sche, g_sche: (optional) d_sche d updates for every g_sche g updates (update_scheduler.UpdateScheduler) [1, 1]
+            schedule: (optional) fixed: the d_sche:g_sche updates only, adaptive: minus the d updates while d_loss < d_low
+                      and the g updates while d_loss > d_high [fixed]
             gf_dim: (optional) Dimension of gen filters in first conv layer. [64]
             df_dim: (optional) Dimension of discrim filters in first conv layer. [64]
             input_c_dim: (optional) Dimension of input image color. For grayscale input, set to 1. [3]
@@ -30,8 +49,9 @@ class pix2pix(object):
         """
         self.smoothe=smoothe
 
-        self.d_sche=d_sche
-        self.g_sche=g_sche
+        self.d_sche=d_sche or 1
+        self.g_sche=g_sche or 1
+        self.scheduler = UpdateScheduler(schedule, n_d=self.d_sche, n_g=self.g_sche, d_low=d_low, d_high=d_high)
 
         self.sess = sess
         self.is_grayscale = (input_c_dim == 1)
@@ -39,6 +59,8 @@ class pix2pix(object):
         self.image_size = image_size
         self.sample_size = sample_size
         self.output_size = output_size
+        self.image_shape = tuple(image_shape) if image_shape is not None else (image_size, image_size)
+        self.frontend = frontend
 
         self.gf_dim = gf_dim
         self.df_dim = df_dim
@@ -81,28 +103,69 @@ class pix2pix(object):
         self.checkpoint_dir=checkpoint_dir
         self.test_dir=test_dir
         self.logdir=logdir  
+        self.store=None         #tile_store of the dataset, opened by the tf.data pipeline or train()
+        self.input_pipeline=input_pipeline
+        self.train_size=train_size
+        self.input_threads=input_threads
+        self.prefetch_batches=prefetch_batches
+        self.fused_step=fused_step
 
         #those part shouldve been at main.py rather than here but im lazy so just go
         self.build_model()
 
 
+    def n_batches(self):
+        #batches of an epoch
+        return int(min(len(self.store), self.train_size or len(self.store))) // self.batch_size
+
+    def build_input_pipeline(self, shape):
+        #tf.data over the tile store: rows shuffled every epoch, loaded a batch at a time (TileStore.tiles(),
+        #memory mapped, dequantized/decompressed) by input_threads parallel calls, prefetch_batches kept ready.
+        #the next batch is copied into a local variable by self.load_batch once per step, so every sess.run
+        #of a step (d and g updates) sees the same batch. returns None without a tile store
+        self.store = tile_store.open_store("./{dataset}/tiles".format(dataset=self.dataset_name))
+        if self.store is None or self.n_batches() == 0:
+            return None
+        load = lambda rows: self.store.tiles(rows)
+        batches = tf.data.Dataset.range(len(self.store)) \
+                    .shuffle(len(self.store), reshuffle_each_iteration=True) \
+                    .take(self.n_batches() * self.batch_size) \
+                    .repeat() \
+                    .batch(self.batch_size) \
+                    .map(lambda rows: tf.py_func(load, [rows], tf.float32, stateful=False),
+                         num_parallel_calls=self.input_threads) \
+                    .prefetch(self.prefetch_batches)
+        self.input_iterator = batches.make_initializable_iterator()
+        next_batch = self.input_iterator.get_next()
+        next_batch.set_shape(shape)
+        # local: not saved with the checkpoints
+        batch = tf.Variable(tf.zeros(shape), trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES], name='input_tiles')
+        self.load_batch = tf.assign(batch, next_batch).op      # an op: nothing is fetched back
+        self.init_input = [self.input_iterator.initializer, batch.initializer]
+        return batch.read_value()
+
     def build_model(self):
-        self.real_data = tf.placeholder(tf.float32,
-                                        [self.batch_size, self.image_size, self.image_size,
-                                         self.input_c_dim + self.output_c_dim],
-                                        name='real_A_and_B_images')
+        shape = [self.batch_size, self.image_shape[0], self.image_shape[1], self.input_c_dim + self.output_c_dim]
+        input_batch = self.build_input_pipeline(shape) if self.input_pipeline == "tf.data" else None
+        if input_batch is None:
+            self.input_pipeline = "feed"
+            self.real_data = tf.placeholder(tf.float32, shape, name='real_A_and_B_images')
+        else:
+            self.real_data = tf.placeholder_with_default(input_batch, shape, name='real_A_and_B_images')
 
         self.real_A = self.real_data[:, :, :, :self.input_c_dim]
         self.real_B = self.real_data[:, :, :, self.input_c_dim:self.input_c_dim + self.output_c_dim]
 
-        self.fake_B = self.generator(self.real_A)
+        #False (fed) for inference: same graph and variables, batch norm on its moving averages, no dropout
+        self.is_training = tf.placeholder_with_default(True, [], name='is_training')
+        self.fake_B = self.generator(self.real_A, is_training=self.is_training)
 
         self.real_AB = tf.concat([self.real_A, self.real_B], 3)         # concats again with axis=3 which corresponds to axis 2 for preprocess.py (color channel)
         self.fake_AB = tf.concat([self.real_A, self.fake_B], 3)
         self.D, self.D_logits = self.discriminator(self.real_AB, reuse=False)
         self.D_, self.D_logits_ = self.discriminator(self.fake_AB, reuse=True)
 
-        self.fake_B_sample = self.sampler(self.real_A)
+        self.fake_B_sample = self.fake_B     #fetched with is_training False
 
         self.d_sum = tf.summary.histogram("d", self.D)
         self.d__sum = tf.summary.histogram("d_", self.D_)
@@ -117,7 +180,7 @@ class pix2pix(object):
         self.d_loss_real_sum = tf.summary.scalar("d_loss_real", self.d_loss_real)
         self.d_loss_fake_sum = tf.summary.scalar("d_loss_fake", self.d_loss_fake)
 
-        self.d_loss = (self.d_loss_real + self.d_loss_fake) / float(self.d_sche/self.g_sche)
+        self.d_loss = self.d_loss_real + self.d_loss_fake
 
         self.g_loss_sum = tf.summary.scalar("g_loss", self.g_loss)
         self.d_loss_sum = tf.summary.scalar("d_loss", self.d_loss)
@@ -132,9 +195,9 @@ class pix2pix(object):
 
     #treating same as rgb will be okay (since preprocess.py has to deat with dimensions on color channel) 
     def load_random_samples(self):
-        data = np.random.choice(glob('./{}/*.npy'.format(self.dataset_name)), self.batch_size)
-        sample = [load_npy(sample_file) for sample_file in data]
-        sample_images = np.array(sample).astype(np.float32)
+        if self.store is None: self.store = tile_store.load_store('./{}/tiles'.format(self.dataset_name))
+        self.sample_rows = np.random.choice(len(self.store), self.batch_size)     #sample_model() wants their phase too
+        sample_images = self.store.tiles(self.sample_rows)
         return sample_images
 
 
@@ -145,13 +208,13 @@ class pix2pix(object):
         ensemble_real=sample_images[:,:,:,self.input_c_dim:]
         ensemble_fake, d_loss, g_loss = self.sess.run(
             [self.fake_B_sample, self.d_loss, self.g_loss],
-            feed_dict={self.real_data: sample_images}
+            feed_dict={self.real_data: sample_images, self.is_training: False}
             )
 
         #not sure sampling occurs correctly
-        voice_only=np.reshape(voice_only,(1024,1024))
-        ensemble_real=np.reshape(ensemble_real, (1024,1024))
-        ensemble_fake=np.reshape(ensemble_fake,(1024,1024)) #np.reshape() returns array ndarray.resize() returns NONE 
+        voice_only=np.reshape(voice_only,self.image_shape)
+        ensemble_real=np.reshape(ensemble_real, self.image_shape)
+        ensemble_fake=np.reshape(ensemble_fake,self.image_shape) #np.reshape() returns array ndarray.resize() returns NONE 
         
         #if I wanted non-scaled specgram
         #concat=np.concatenate((voice_only, ensemble_real, ensemble_fake), axis=1)#resulting need to be 1024,3072
@@ -164,6 +227,10 @@ class pix2pix(object):
         # save ensemble_fake as nparray np.load("f.npy will load nparray")
         with open(sample_dir+"/fake_ensemble{a}.npy".format(a=idx), "wb") as f:
             np.save(f,ensemble_fake_scaled)
+        # stores with phase (main.py --save_phase): batch_recover.py turns it into a single istft
+        if self.store.phase_track is not None:
+            with open(sample_dir+"/fake_ensemble{a}.phase.npy".format(a=idx), "wb") as f:
+                np.save(f,self.store.phases(self.sample_rows))
         
         # write specgram (bot: voice, mid: ensemble_real, top: ensemble_fake)
         normalconcat=np.concatenate((voice_only, ensemble_real, ensemble_fake_scaled), axis=1)
@@ -194,50 +261,87 @@ class pix2pix(object):
         else:
             print(" [!] Load failed...")
 
+        #tiles are memory mapped from the shards of the tile store, opened once (no glob per epoch)
+        #tf.data: batches are loaded and prefetched inside the graph, nothing is fed
+        #feed: the next prefetch_batches batches are read (and decompressed) on input_threads threads while
+        #the current one trains (batch_prefetcher.py)
+        #input wait: secs the step waited for its batch, well above 0 means training is input bound
+        if self.store is None: self.store = tile_store.load_store("./{dataset}/tiles".format(dataset=self.dataset_name))
+        if self.input_pipeline == "tf.data":
+            self.sess.run(self.init_input)
         for epoch in range(args.epoch):
-            data = glob("./{dataset}/*.npy".format(dataset=self.dataset_name))
-            np.random.shuffle(data)
-            batch_idxs = min(len(data), args.train_size) // self.batch_size
-
-            for idx in range(0, batch_idxs):
-                batch_files = data[idx*self.batch_size:(idx+1)*self.batch_size]
-                batch = [load_npy(batch_file) for batch_file in batch_files]
-                #print("batch_file:\t{a}".format(a=batch[0].shape))
-                #print("batch:\t{b}".format(b=np.array(batch).shape))
-                batch_images = np.array(batch).astype(np.float32)
-
-                #for d_schedule in range(self.d_sche): --> Dloss dividened by d_sche
-                _, summary_str = self.sess.run([d_optim, self.d_sum],
-                                               feed_dict={ self.real_data: batch_images })
-                self.writer.add_summary(summary_str, counter)
-
-                #for g_schedule in range(self.g_sche):
-                _, summary_str = self.sess.run([g_optim, self.g_sum],
-                                               feed_dict={ self.real_data: batch_images })
-                self.writer.add_summary(summary_str, counter)
-
-
-                errD_fake = self.d_loss_fake.eval({self.real_data: batch_images})
-                errD_real = self.d_loss_real.eval({self.real_data: batch_images})
-                errG = self.g_loss.eval({self.real_data: batch_images})
-
-                counter += 1
-                print("Epoch: [%2d] [%4d/%4d] time: %4.4f, d_loss: %.8f, g_loss: %.8f" \
-                    % (epoch, idx, batch_idxs,
-                        time.time() - start_time, errD_fake+errD_real, errG))
+            batch_idxs = self.n_batches()
+            with ExitStack() as epoch_inputs:      #the feed prefetcher is closed however the epoch ends
+                if self.input_pipeline == "feed":
+                    data = np.random.permutation(len(self.store))
+                    batches = epoch_inputs.enter_context(self.store.batches(
+                        [data[idx*self.batch_size:(idx+1)*self.batch_size] for idx in range(batch_idxs)],
+                        depth=self.prefetch_batches, n_threads=self.input_threads))
+
+                for idx in range(0, batch_idxs):
+                    if self.input_pipeline == "tf.data":
+                        wait_start = time.time()
+                        self.sess.run(self.load_batch)
+                        input_wait = time.time() - wait_start
+                        feed = {}
+                    else:
+                        feed = {self.real_data: batches.get()}
+                        input_wait = batches.last_wait
+                    #print("batch:\t{b}".format(b=batch_images.shape))
+
+                    #updates of this step, all on the same batch (load_batch ran once above)
+                    #fused: the d losses come out of the d_optim run, g_loss out of the g_optim run, as computed for the
+                    #update (before it), 2 forward passes a step. the losses of a skipped update, or all of them without
+                    #fused_step, are evaluated again after the updates
+                    updates = self.scheduler.plan()
+                    errD_fake = errD_real = errG = None
+                    if "d" in updates:
+                        if self.fused_step:
+                            _, summary_str, errD_fake, errD_real = self.sess.run([d_optim, self.d_sum, self.d_loss_fake, self.d_loss_real],
+                                                                                 feed_dict=feed)
+                        else:
+                            _, summary_str = self.sess.run([d_optim, self.d_sum],
+                                                           feed_dict=feed)
+                        self.writer.add_summary(summary_str, counter)
+
+                    if "g" in updates:
+                        if self.fused_step:
+                            _, summary_str, errG = self.sess.run([g_optim, self.g_sum, self.g_loss],
+                                                                 feed_dict=feed)
+                        else:
+                            _, summary_str = self.sess.run([g_optim, self.g_sum],
+                                                           feed_dict=feed)
+                        self.writer.add_summary(summary_str, counter)
+
+                    if errD_fake is None:
+                        errD_fake = self.d_loss_fake.eval(feed)
+                        errD_real = self.d_loss_real.eval(feed)
+                    if errG is None:
+                        errG = self.g_loss.eval(feed)
+                    self.scheduler.observe(errD_fake+errD_real, errG)
+
+                    counter += 1
+                    print("Epoch: [%2d] [%4d/%4d] time: %4.4f, d_loss: %.8f, g_loss: %.8f, input wait: %.4f, %s" \
+                        % (epoch, idx, batch_idxs,
+                            time.time() - start_time, errD_fake+errD_real, errG, input_wait, self.scheduler.log_line()))
 
                 
-                #if np.mod(counter, 2) == 1:
-                if counter in range(40) and np.mod(counter,5) == 0:
-                    self.sample_model(self.sample_dir, epoch, idx)
-                    self.save(self.checkpoint_dir, counter)
+                    #if np.mod(counter, 2) == 1:
+                    if counter in range(40) and np.mod(counter,5) == 0:
+                        self.sample_model(self.sample_dir, epoch, idx)
+                        self.save(self.checkpoint_dir, counter)
+
+                    if np.mod(counter, 100) == 1:
+                        self.sample_model(self.sample_dir, epoch, idx)
+                        #sys.exit("sampling test")
 
-                if np.mod(counter, 100) == 1:
-                    self.sample_model(self.sample_dir, epoch, idx)
-                    #sys.exit("sampling test")
+                    if np.mod(counter, 500) == 2:
+                        self.save(self.checkpoint_dir, counter)
 
-                if np.mod(counter, 500) == 2:
-                    self.save(self.checkpoint_dir, counter)
+            if self.input_pipeline == "feed":
+                print("Epoch: [%2d] input wait: %.2fs total, %.4f mean, %.4f max" \
+                    % (epoch, batches.stats()["total_wait"], batches.stats()["mean_wait"], batches.stats()["max_wait"]))
+            print("Epoch: [%2d] %s" % (epoch, self.scheduler.summary()))
 
     def discriminator(self, image, y=None, reuse=False):
 
@@ -264,173 +368,94 @@ class pix2pix(object):
 
 
 
-    def generator(self, image, smoothe=1.0):
+    def level_sizes(self):
+        #(height, width) of the image and of the 8 levels below it, every stride 2 conv ('SAME')
+        #rounds up, so non-square and non power of 2 tiles work (1024x256 goes 512x128, ..., 4x1)
+        return [(int(math.ceil(self.image_shape[0]/2.**k)), int(math.ceil(self.image_shape[1]/2.**k))) for k in range(9)]
+
+    def generator(self, image, smoothe=1.0, is_training=True):
+        #the one u-net of the model, for training and inference (sampling, test). is_training (bool or bool tensor,
+        #see build_model) False: batch norm uses its moving averages and there is no dropout
         with tf.variable_scope("generator") as scope:
 
-            s = self.output_size
-            s2, s4, s8, s16, s32, s64, s128, s256 = int(s/2), int(s/4), int(s/8), int(s/16), int(s/32), int(s/64), int(s/128), int(s/256)
+            s, s2, s4, s8, s16, s32, s64, s128, s256 = self.level_sizes()
 
             # all the sizes are 4 times larger (2 x 2 --> 8 x 8)
             # image is (1024 x 1024 x input_c_dim)
             e1 = conv2d(image, self.gf_dim, name='g_e1_conv')
             # e1 is (512 x 512 x self.gf_dim)
-            e2 = self.g_bn_e2(conv2d(lrelu(e1), self.gf_dim*2, name='g_e2_conv'))
+            e2 = self.g_bn_e2(conv2d(lrelu(e1), self.gf_dim*2, name='g_e2_conv'), train=is_training)
             # e2 is (256 x 256 x self.gf_dim*2)
-            e3 = self.g_bn_e3(conv2d(lrelu(e2), self.gf_dim*4, name='g_e3_conv'))
+            e3 = self.g_bn_e3(conv2d(lrelu(e2), self.gf_dim*4, name='g_e3_conv'), train=is_training)
             # e3 is (128 x 128 x self.gf_dim*4)
-            e4 = self.g_bn_e4(conv2d(lrelu(e3), self.gf_dim*8, name='g_e4_conv'))
+            e4 = self.g_bn_e4(conv2d(lrelu(e3), self.gf_dim*8, name='g_e4_conv'), train=is_training)
             # e4 is (64 x 64 x self.gf_dim*8)
-            e5 = self.g_bn_e5(conv2d(lrelu(e4), self.gf_dim*8, name='g_e5_conv'))
+            e5 = self.g_bn_e5(conv2d(lrelu(e4), self.gf_dim*8, name='g_e5_conv'), train=is_training)
             # e5 is (32 x 32 x self.gf_dim*8)
-            e6 = self.g_bn_e6(conv2d(lrelu(e5), self.gf_dim*8, name='g_e6_conv'))
+            e6 = self.g_bn_e6(conv2d(lrelu(e5), self.gf_dim*8, name='g_e6_conv'), train=is_training)
             # e6 is (16 x 16 x self.gf_dim*8)
-            e7 = self.g_bn_e7(conv2d(lrelu(e6), self.gf_dim*8, name='g_e7_conv'))
+            e7 = self.g_bn_e7(conv2d(lrelu(e6), self.gf_dim*8, name='g_e7_conv'), train=is_training)
             # e7 is (8 x 8 x self.gf_dim*8)
-            e8 = self.g_bn_e8(conv2d(lrelu(e7), self.gf_dim*8, name='g_e8_conv'))
+            e8 = self.g_bn_e8(conv2d(lrelu(e7), self.gf_dim*8, name='g_e8_conv'), train=is_training)
             # e8 is (4 x 4 x self.gf_dim*8)
-            e9 = self.g_bn_e9(conv2d(lrelu(e8), self.gf_dim*8, name='g_e9_conv'))
+            e9 = self.g_bn_e9(conv2d(lrelu(e8), self.gf_dim*8, name='g_e9_conv'), train=is_training)
             # e9 is (2 x 2 x self.gf_dim*8)
 
             
             self.d0, self.d0_w, self.d0_b = deconv2d(tf.nn.relu(e9),
-                [self.batch_size, s256, s256, self.gf_dim*8], name='g_d0', with_w=True)
-            d0 = tf.nn.dropout(self.g_bn_d0(self.d0), 0.5)
+                [self.batch_size, s256[0], s256[1], self.gf_dim*8], name='g_d0', with_w=True)
+            d0 = dropout(self.g_bn_d0(self.d0, train=is_training), 0.5, train=is_training)
             d0 = tf.concat([d0, e8], 3)
             # d1 is (4 x 4 x self.gf_dim*8*2)
 
             self.d1, self.d1_w, self.d1_b = deconv2d(tf.nn.relu(e8),
-                [self.batch_size, s128, s128, self.gf_dim*8], name='g_d1', with_w=True)
-            d1 = tf.nn.dropout(self.g_bn_d1(self.d1), 0.5)
+                [self.batch_size, s128[0], s128[1], self.gf_dim*8], name='g_d1', with_w=True)
+            d1 = dropout(self.g_bn_d1(self.d1, train=is_training), 0.5, train=is_training)
             d1 = tf.concat([d1, e7], 3)
             # d1 is (8 x 8 x self.gf_dim*8*2)
 
             self.d2, self.d2_w, self.d2_b = deconv2d(tf.nn.relu(d1),
-                [self.batch_size, s64, s64, self.gf_dim*8], name='g_d2', with_w=True)
-            d2 = tf.nn.dropout(self.g_bn_d2(self.d2), 0.5)
+                [self.batch_size, s64[0], s64[1], self.gf_dim*8], name='g_d2', with_w=True)
+            d2 = dropout(self.g_bn_d2(self.d2, train=is_training), 0.5, train=is_training)
             d2 = tf.concat([d2, e6], 3)
             # d2 is (16 x 16 x self.gf_dim*8*2)
 
             self.d3, self.d3_w, self.d3_b = deconv2d(tf.nn.relu(d2),
-                [self.batch_size, s32, s32, self.gf_dim*8], name='g_d3', with_w=True)
-            d3 = tf.nn.dropout(self.g_bn_d3(self.d3), 0.5)
+                [self.batch_size, s32[0], s32[1], self.gf_dim*8], name='g_d3', with_w=True)
+            d3 = dropout(self.g_bn_d3(self.d3, train=is_training), 0.5, train=is_training)
             d3 = tf.concat([d3, e5], 3)
             # d3 is (32 x 32 x self.gf_dim*8*2)
 
             self.d4, self.d4_w, self.d4_b = deconv2d(tf.nn.relu(d3),
-                [self.batch_size, s16, s16, self.gf_dim*8], name='g_d4', with_w=True)
-            d4 = self.g_bn_d4(self.d4)
+                [self.batch_size, s16[0], s16[1], self.gf_dim*8], name='g_d4', with_w=True)
+            d4 = self.g_bn_d4(self.d4, train=is_training)
             d4 = tf.concat([d4, e4], 3)    #Unet structure: skip connection
             # d4 is (64 x 64 x self.gf_dim*8*2)
 
             self.d5, self.d5_w, self.d5_b = deconv2d(tf.nn.relu(d4),
-                [self.batch_size, s8, s8, self.gf_dim*4], name='g_d5', with_w=True)
-            d5 = self.g_bn_d5(self.d5)
+                [self.batch_size, s8[0], s8[1], self.gf_dim*4], name='g_d5', with_w=True)
+            d5 = self.g_bn_d5(self.d5, train=is_training)
             d5 = tf.concat([d5, e3], 3)
             # d5 is (128 x 128 x self.gf_dim*4*2)
 
             self.d6, self.d6_w, self.d6_b = deconv2d(tf.nn.relu(d5),
-                [self.batch_size, s4, s4, self.gf_dim*2], name='g_d6', with_w=True)
-            d6 = self.g_bn_d6(self.d6)
+                [self.batch_size, s4[0], s4[1], self.gf_dim*2], name='g_d6', with_w=True)
+            d6 = self.g_bn_d6(self.d6, train=is_training)
             d6 = tf.concat([d6, e2], 3)
             # d6 is (256 x 256 x self.gf_dim*2*2)
 
             self.d7, self.d7_w, self.d7_b = deconv2d(tf.nn.relu(d6),
-                [self.batch_size, s2, s2, self.gf_dim], name='g_d7', with_w=True)
-            d7 = self.g_bn_d7(self.d7)
+                [self.batch_size, s2[0], s2[1], self.gf_dim], name='g_d7', with_w=True)
+            d7 = self.g_bn_d7(self.d7, train=is_training)
             d7 = tf.concat([d7, e1], 3)
             # d7 is (512 x 512 x self.gf_dim*1*2)
 
             self.d8, self.d8_w, self.d8_b = deconv2d(tf.nn.relu(d7),
-                [self.batch_size, s, s, self.output_c_dim], name='g_d8', with_w=True)
+                [self.batch_size, s[0], s[1], self.output_c_dim], name='g_d8', with_w=True)
             # d8 is (1024 x 1024 x output_c_dim)
 
             return tf.nn.tanh(smoothe*self.d8)
 
-    def sampler(self, image, y=None):
-
-        with tf.variable_scope("generator") as scope:
-            scope.reuse_variables()
-
-            s = self.output_size
-            s2, s4, s8, s16, s32, s64, s128, s256 = int(s/2), int(s/4), int(s/8), int(s/16), int(s/32), int(s/64), int(s/128), int(s/256)
-
-            # all the sizes are 4 times larger (2 x 2 --> 8 x 8)
-            # image is (1024 x 1024 x input_c_dim)
-            e1 = conv2d(image, self.gf_dim, name='g_e1_conv')
-            # e1 is (512 x 512 x self.gf_dim)
-            e2 = self.g_bn_e2(conv2d(lrelu(e1), self.gf_dim*2, name='g_e2_conv'))
-            # e2 is (256 x 256 x self.gf_dim*2)
-            e3 = self.g_bn_e3(conv2d(lrelu(e2), self.gf_dim*4, name='g_e3_conv'))
-            # e3 is (128 x 128 x self.gf_dim*4)
-            e4 = self.g_bn_e4(conv2d(lrelu(e3), self.gf_dim*8, name='g_e4_conv'))
-            # e4 is (64 x 64 x self.gf_dim*8)
-            e5 = self.g_bn_e5(conv2d(lrelu(e4), self.gf_dim*8, name='g_e5_conv'))
-            # e5 is (32 x 32 x self.gf_dim*8)
-            e6 = self.g_bn_e6(conv2d(lrelu(e5), self.gf_dim*8, name='g_e6_conv'))
-            # e6 is (16 x 16 x self.gf_dim*8)
-            e7 = self.g_bn_e7(conv2d(lrelu(e6), self.gf_dim*8, name='g_e7_conv'))
-            # e7 is (8 x 8 x self.gf_dim*8)
-            e8 = self.g_bn_e8(conv2d(lrelu(e7), self.gf_dim*8, name='g_e8_conv'))
-            # e8 is (4 x 4 x self.gf_dim*8)
-            e9 = self.g_bn_e9(conv2d(lrelu(e8), self.gf_dim*8, name='g_e9_conv'))
-            # e9 is (2 x 2 x self.gf_dim*8)
-
-
-            self.d0, self.d0_w, self.d0_b = deconv2d(tf.nn.relu(e9),
-                [self.batch_size, s256, s256, self.gf_dim*8], name='g_d0', with_w=True)
-            d0 = tf.nn.dropout(self.g_bn_d0(self.d0), 0.5)
-            d0 = tf.concat([d0, e8], 3)
-            # d1 is (4 x 4 x self.gf_dim*8*2)
-
-            self.d1, self.d1_w, self.d1_b = deconv2d(tf.nn.relu(e8),
-                [self.batch_size, s128, s128, self.gf_dim*8], name='g_d1', with_w=True)
-            d1 = tf.nn.dropout(self.g_bn_d1(self.d1), 0.5)
-            d1 = tf.concat([d1, e7], 3)
-            # d1 is (8 x 8 x self.gf_dim*8*2)
-
-            self.d2, self.d2_w, self.d2_b = deconv2d(tf.nn.relu(d1),
-                [self.batch_size, s64, s64, self.gf_dim*8], name='g_d2', with_w=True)
-            d2 = tf.nn.dropout(self.g_bn_d2(self.d2), 0.5)
-            d2 = tf.concat([d2, e6], 3)
-            # d2 is (16 x 16 x self.gf_dim*8*2)
-
-            self.d3, self.d3_w, self.d3_b = deconv2d(tf.nn.relu(d2),
-                [self.batch_size, s32, s32, self.gf_dim*8], name='g_d3', with_w=True)
-            d3 = tf.nn.dropout(self.g_bn_d3(self.d3), 0.5)
-            d3 = tf.concat([d3, e5], 3)
-            # d3 is (32 x 32 x self.gf_dim*8*2)
-
-            self.d4, self.d4_w, self.d4_b = deconv2d(tf.nn.relu(d3),
-                [self.batch_size, s16, s16, self.gf_dim*8], name='g_d4', with_w=True)
-            d4 = self.g_bn_d4(self.d4)
-            d4 = tf.concat([d4, e4], 3)    #Unet structure: skip connection
-            # d4 is (64 x 64 x self.gf_dim*8*2)
-
-            self.d5, self.d5_w, self.d5_b = deconv2d(tf.nn.relu(d4),
-                [self.batch_size, s8, s8, self.gf_dim*4], name='g_d5', with_w=True)
-            d5 = self.g_bn_d5(self.d5)
-            d5 = tf.concat([d5, e3], 3)
-            # d5 is (128 x 128 x self.gf_dim*4*2)
-
-            self.d6, self.d6_w, self.d6_b = deconv2d(tf.nn.relu(d5),
-                [self.batch_size, s4, s4, self.gf_dim*2], name='g_d6', with_w=True)
-            d6 = self.g_bn_d6(self.d6)
-            d6 = tf.concat([d6, e2], 3)
-            # d6 is (256 x 256 x self.gf_dim*2*2)
-
-            self.d7, self.d7_w, self.d7_b = deconv2d(tf.nn.relu(d6),
-                [self.batch_size, s2, s2, self.gf_dim], name='g_d7', with_w=True)
-            d7 = self.g_bn_d7(self.d7)
-            d7 = tf.concat([d7, e1], 3)
-            # d7 is (512 x 512 x self.gf_dim*1*2)
-
-            self.d8, self.d8_w, self.d8_b = deconv2d(tf.nn.relu(d7),
-                [self.batch_size, s, s, self.output_c_dim], name='g_d8', with_w=True)
-            # d8 is (1024 x 1024 x output_c_dim)
-
-            return tf.nn.tanh(self.d8)
-
-
     def save(self, checkpoint_dir, step):
         model_name = "pix2pix{step}.model".format(step=step)
         self.saver.save(self.sess,
@@ -463,6 +488,13 @@ class pix2pix(object):
         init_op = tf.global_variables_initializer()
         self.sess.run(init_op)
 
+        #no checkpoint, no test: random weights would make noise wavs. checkpoint_dir is named after the flags
+        #(main.py model_tag), a run trained with other --numD/--numG/lambdas than given here is not found
+        if not self.load(self.checkpoint_dir):
+            sys.exit(" [!] Load failed, no checkpoint in {dir} (train with the same --numD/--numG/--*_lambda/--smoothe)".format(
+                dir=self.checkpoint_dir))
+        print(" [*] Load SUCCESS")
+
         sample_files = glob('{}/*.npy'.format(self.test_dir)) #glob.glob() provides extended support for unix filename like *.txt
 
         # sort testing input
@@ -472,29 +504,43 @@ class pix2pix(object):
         
         # load testing input
         print("Loading testing images ...")
-        sample = [load_npy(sample_file, is_test=True) for sample_file in sample_files]
+        sample = [load_npy(sample_file) for sample_file in sample_files]
         sample_images = np.array(sample).astype(np.float32)
-
-        sample_images = [sample_images[i:i+self.batch_size]
-                         for i in range(0, len(sample_images), self.batch_size)]
-        sample_images = np.array(sample_images)
         print(sample_images.shape)
 
         start_time = time.time()
-        if self.load(self.checkpoint_dir):
-            print(" [*] Load SUCCESS")
-        else:
-            print(" [!] Load failed...")
 
-        for i, sample_image in enumerate(sample_images):
-            idx = i+1
-            print("sampling image ", idx)
-            samples = self.sess.run(
-                self.fake_B_sample,
-                feed_dict={self.real_data: sample_image}
-            )
-            save_images(samples, [self.batch_size, 1],
-                        './{}/test_{:04d}.png'.format(args.test_dir, idx))
-            
-            recover_audio(pathandwavname='./{}/test_{:04d}.wav'.format(args.test_dir, idx), specgram=sample_image)
+        # test tiles are named song_no*10000+piece_no: the generated tiles of a song are stitched into
+        # one wav (stitch.render_song()) as they come out of the model, batch by batch
+        # offsets: start of every tile in its song from the window plan (generate_v_only_npyfile()), tiles of
+        # separate voice ranges keep their gap. tiles made before it was saved are taken as one range
+        ids = np.array(sorted(n))
+        tile_offsets = pr.load_tile_offsets(self.test_dir)
+        if tile_offsets is None or not all(tile_id in tile_offsets for tile_id in ids):
+            print(" [!] no tile_offsets.npz for all tiles in {dir}, songs with several voice ranges lose their gaps".format(
+                dir=self.test_dir))
+            test_hop = pr.st_size*2     # generate_v_only_npyfile() windows the test songs every st_size*2 secs
+            tile_offsets = dict((tile_id, (tile_id % 10000) * test_hop) for tile_id in ids.tolist())
+        for song_no in np.unique(ids // 10000):
+            song_rows = np.where(ids // 10000 == song_no)[0]
+            def generated(song_rows=song_rows):
+                for first in range(0, len(song_rows), self.batch_size):
+                    idx = song_rows[first]+1
+                    print("sampling image ", idx)
+                    batch = sample_images[song_rows[first:first+self.batch_size]]
+                    n_tiles = len(batch)
+                    if n_tiles < self.batch_size:      # the graph takes full batches only
+                        batch = np.concatenate((batch, np.zeros((self.batch_size-n_tiles,)+batch.shape[1:], dtype=batch.dtype)))
+                    samples = self.sess.run(
+                        self.fake_B_sample,
+                        feed_dict={self.real_data: batch, self.is_training: False}
+                    )
+                    save_images(samples, [self.batch_size, 1],
+                                './{}/test_{:04d}.png'.format(args.test_dir, idx))
+                    for generated_tile in samples[:n_tiles]:
+                        yield generated_tile
+            song_wav='./{}/test_song_{:03d}.wav'.format(args.test_dir, song_no)
+            stitch.render_song(song_wav, generated(), [tile_offsets[tile_id] for tile_id in ids[song_rows].tolist()],
+                               frontend=self.frontend)
+            print("{song} written".format(song=song_wav))
             #pr.write_specgram_img(specgram=sample_image, imgname='./{}/test_{:04d}.png'.format(args.test_dir, idx))
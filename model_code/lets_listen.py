@@ -1,15 +1,13 @@
-import preprocess as pr
-import numpy as np 
+import batch_recover as br
 
 #this code needs to be run at the same directory with target npyfiles
 # ./model_codes
+# (python batch_recover.py <dir or npy files> does the same for any tiles, see batch_recover.py)
 
 test = ["sample_99.npy", "sample_199.npy"]
 
-for npy_name in test:
-    tmp=np.load(npy_name)
-    gen=tmp.reshape((1024,1024))
-    #recover_audio("./{name}_voice.wav".format(npy_name),voice)
-    pr.recover_audio("./{name}_gen.wav".format(name=npy_name),gen)
+if __name__ == "__main__":      #the worker processes import this file again
+    #sample_99.npy --> ./sample_99.wav, skipped if that is newer than the npy
+    br.recover_all(test)
 
-print("jobs finished")
\ No newline at end of file
+    print("jobs finished")
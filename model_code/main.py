@@ -3,6 +3,8 @@ import os
 import scipy.misc
 import numpy as np
 import preprocess as pr
+import tile_store
+import fft_backend as fftb
 from fin_model import pix2pix
 import tensorflow as tf
 from glob import glob
@@ -43,16 +45,43 @@ parser.add_argument('--L2_lambda', dest='L2_lambda', type=float, default=0, help
 parser.add_argument('--GAN_lambda', dest='GAN_lambda', type=float, default=1, help='weight on GAN term in objective')
 
 #generator, discriminator schedule
-parser.add_argument('--numD', dest='d_sche', type=int, default=4, help='number of G optim')
-parser.add_argument('--numG', dest='g_sche', type=int, default=1, help='number of D optim')
+parser.add_argument('--numD', dest='d_sche', type=int, default=1, help='number of D optim for every numG G optim')
+parser.add_argument('--numG', dest='g_sche', type=int, default=1, help='number of G optim for every numD D optim')
+parser.add_argument('--schedule', dest='schedule', default='fixed', help='fixed (numD:numG) or adaptive (also skips D while d_loss < d_low, G while d_loss > d_high)')
+parser.add_argument('--d_low', dest='d_low', type=float, default=0.5, help='adaptive schedule: D updates skipped while d_loss is below')
+parser.add_argument('--d_high', dest='d_high', type=float, default=2.5, help='adaptive schedule: G updates skipped while d_loss is above')
 parser.add_argument('--smoothe', dest='smoothe', type=float, default=1, help='generator tanh smoothing')
 
+#preprocessing
+parser.add_argument('--fft_backend', dest='fft_backend', default='numpy', help='numpy, scipy, fftw or fastest (benchmarks the available ones)')
+parser.add_argument('--fft_workers', dest='fft_workers', type=int, default=0, help='fft threads for scipy/fftw, 0: all cores')
+parser.add_argument('--n_workers', dest='n_workers', type=int, default=1, help='# of processes building the dataset (one song each)')
+parser.add_argument('--tile_format', dest='tile_format', default='float32', help='float32, uint16 or uint8 (quantized) tile store')
+parser.add_argument('--tile_codec', dest='tile_codec', default='none', help='none, zlib or lzma (compressed tile store)')
+parser.add_argument('--tile_layout', dest='tile_layout', default='tiles', help='tiles, or virtual (range spectrograms stored, tiles cut when loaded)')
+parser.add_argument('--freq_frontend', dest='freq_frontend', default='linear', help='linear, mel or logfreq frequency axis of the tiles')
+parser.add_argument('--freq_bins', dest='freq_bins', type=int, default=256, help='# of mel/logfreq bands (tiles are 1024 x freq_bins)')
+parser.add_argument('--input_pipeline', dest='input_pipeline', default='tf.data', help='tf.data (batches loaded and prefetched in the graph) or feed (feed_dict)')
+parser.add_argument('--input_threads', dest='input_threads', type=int, default=4, help='# of batches loaded in parallel (tf.data pipeline / feed prefetch threads)')
+parser.add_argument('--prefetch_batches', dest='prefetch_batches', type=int, default=2, help='# of batches kept ready (tf.data pipeline / feed prefetch queue)')
+parser.add_argument('--fused_step', dest='fused_step', type=int, default=1, help='1: losses fetched with the d/g updates, 0: evaluated again after them (3 more forward passes)')
+parser.add_argument('--save_phase', dest='save_phase', default='none', help='none, voice or mix: stft phase of that track kept with the tiles')
+
 args = parser.parse_args()
 
+def schedule_tag(args):
+    #d/g schedule part of model_tag, named after what training actually does: before the update scheduler numD only
+    #scaled d_loss (the default 4 trained 1 d : 1 g update), so 1:1 fixed keeps their dg_sche_4_1 and finds their
+    #checkpoints. every other schedule gets a name no run from before can have
+    if args.schedule == 'fixed' and args.d_sche == args.g_sche == 1:
+        return "dg_sche_4_1"
+    return "dg_ratio_{dsche}_{gsche}{mode}".format(dsche=args.d_sche, gsche=args.g_sche,
+                                                   mode="" if args.schedule == 'fixed' else "_"+args.schedule)
+
 def main(_):
-    model_tag="g_{g}_l1_{l1}_l2_{l2}_dg_sche_{dsche}_{gsche}_smoothe_{sm}".format(g=args.GAN_lambda, 
+    model_tag="g_{g}_l1_{l1}_l2_{l2}_{sche}_smoothe_{sm}".format(g=args.GAN_lambda, 
                                                                 l1=args.L1_lambda, l2=args.L2_lambda, 
-                                                                dsche=args.d_sche, gsche=args.g_sche,
+                                                                sche=schedule_tag(args),
                                                                 sm=args.smoothe)
     #logdir
     new_logdir="logs_"+model_tag
@@ -72,13 +101,22 @@ def main(_):
     config = tf.ConfigProto()
     config.gpu_options.allow_growth = True
 
+    #fft backend for wav2spec (spectrograms and their inversion)
+    fft_workers = args.fft_workers if args.fft_workers > 0 else None
+    if args.fft_backend=='fastest':
+        fastest, timings = fftb.use_fastest(workers=fft_workers)
+        print("fft backend: {name} (benchmarked {timings})".format(name=fastest, timings=timings))
+    else: fftb.set_backend(args.fft_backend, workers=fft_workers)
+
     with tf.Session(config=config) as sess:
         if  args.phase=='train': 
-            npytrfiles=glob("./{dataset}/*.npy".format(dataset=args.dataset_name))
-            if len(npytrfiles)>0: pass
-            else: 
-                pr.generate_concat_npyfile( os.path.join(os.getcwd(),args.dataset_name), 
-                                    tagfilepath= os.path.join(args.dataset_name,args.train_tagfile_name) ) # ./dataset_name is the dir name for the dataset 
+            #incremental: only songs whose wavs/tags/parameters changed since the last run are (re)built
+            pr.generate_concat_npyfile( os.path.join(os.getcwd(),args.dataset_name), 
+                                    tagfilepath= os.path.join(args.dataset_name,args.train_tagfile_name),
+                                    n_workers=args.n_workers, tile_format=args.tile_format, tile_codec=args.tile_codec,
+                                    tile_layout=args.tile_layout, freq_frontend=args.freq_frontend, freq_bins=args.freq_bins,
+                                    save_phase=args.save_phase,
+                                    cache_dir=os.path.join(os.getcwd(),args.dataset_name,"prep_cache") ) # ./dataset_name is the dir name for the dataset 
             # verify data is not ill-processed 
             #print(len(npytrfiles))
             #testerfile=npytrfiles[10]
@@ -94,18 +132,27 @@ def main(_):
                                     tagfilepath= os.path.join(new_test_dir,args.test_tagfile_name) )
         else: exit("--phase argument is only train or test")
 
+        #tile shape and front end of the dataset come from its store (square fine_size tiles without one)
+        store = tile_store.open_store(os.path.join(args.dataset_name, "tiles"))
+        image_shape = store.tile_shape[:2] if store is not None else (args.fine_size, args.fine_size)
+        frontend = store.frontend if store is not None else pr.frontend_info(args.freq_frontend, args.freq_bins)
+        if store is not None: store.close()
+
         model = pix2pix(sess, image_size=args.fine_size, batch_size=args.batch_size,
                         output_size=args.fine_size, dataset_name=args.dataset_name,
                         checkpoint_dir=new_checkpoint_dir, sample_dir=new_sample_dir, 
                         test_dir=new_test_dir, logdir=new_logdir, d_sche=args.d_sche, g_sche=args.g_sche,
-                        smoothe=args.smoothe)
+                        smoothe=args.smoothe, image_shape=image_shape, frontend=frontend,
+                        input_pipeline=args.input_pipeline if args.phase == 'train' else 'feed', train_size=args.train_size,
+                        input_threads=args.input_threads, prefetch_batches=args.prefetch_batches, fused_step=bool(args.fused_step),
+                        schedule=args.schedule, d_low=args.d_low, d_high=args.d_high)
 
 
         if args.phase == 'train':
             print("\n\n")
             print("\ttrain")
             print("\tweigt g/l1/l2:{g}, {l1}, {l2}".format(g=args.GAN_lambda, l1=args.L1_lambda, l2=args.L2_lambda))
-            print("\tschedule d-g: {dsche},{gsche}".format(dsche=args.d_sche, gsche=args.g_sche))
+            print("\tschedule d-g: {dsche},{gsche} {mode}".format(dsche=args.d_sche, gsche=args.g_sche, mode=args.schedule))
             print("\ttanh smoothing {sm}".format(sm=args.smoothe))
             #print("\tpooling {pl}".format(pl=args.pool)) there is no pooling for enc/decoder
             print("\n\n")
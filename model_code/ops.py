@@ -15,7 +15,15 @@ class batch_norm(object):
             self.name = name
 
     def __call__(self, x, train=True):
-        return tf.contrib.layers.batch_norm(x, decay=self.momentum, updates_collections=None, epsilon=self.epsilon, scale=True, scope=self.name)
+        #train: bool or bool tensor, False normalizes with the moving averages (and leaves them as they are)
+        return tf.contrib.layers.batch_norm(x, decay=self.momentum, updates_collections=None, epsilon=self.epsilon, scale=True,
+                                            is_training=train, scope=self.name)
+
+def dropout(x, keep_prob, train=True):
+    #train: bool or bool tensor, False passes x through (no random mask is made)
+    if isinstance(train, bool):
+        return tf.nn.dropout(x, keep_prob) if train else x
+    return tf.cond(train, lambda: tf.nn.dropout(x, keep_prob), lambda: x)
 
 def binary_cross_entropy(preds, targets, name=None):
     """Computes binary cross entropy given `preds`.
@@ -0,0 +1,118 @@
+'''
+prep_cache.py
+
+incremental preprocessing cache for preprocess.generate_concat_npyfile()
+
+    <cache_dir>/manifest.json       which song got built from what (keys of every level, its tiles)
+    <cache_dir>/pcm/<key>.npy       decoded mono pcm of a tagged voice range (+ filter warm-up)
+    <cache_dir>/filtered/<key>.npy  bandpass filtered voice range
+    <cache_dir>/spec/<key>.npy      song-level magnitude spectrogram of the voice range
+    <cache_dir>/phase/<key>.npy     its phase (uint8, wav2spec.quantize_phase()), only when tiles keep their phase
+
+a key hashes the key of the level below plus the parameters of its own level
+(pcm: wav content hash and tag range, filtered: lowcut/highcut, spec/phase: fft_size/step_size),
+so e.g. changing st_size only cuts the tiles again and changing one song's tags only
+touches that song. the tiles themselves live in the tile_store, the manifest only lists
+the tile ids of every song and is written once the new store is in place; an interrupted
+build still finds every level it got to.
+
+'''
+
+import os
+import json
+import hashlib
+import numpy as np
+
+levels = ("pcm", "filtered", "spec", "phase")
+
+
+def make_key(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def file_hash(path, block_size=2**20):
+    sha = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class PrepCache(object):
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        for level in levels:
+            if not os.path.exists(os.path.join(cache_dir, level)):
+                os.makedirs(os.path.join(cache_dir, level))
+        self.manifest_path = os.path.join(cache_dir, "manifest.json")
+        self.manifest = {"songs": {}, "file_hashes": {}}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+    # ---------- levels ----------
+    def path(self, level, key):
+        return os.path.join(self.cache_dir, level, key + ".npy")
+
+    def load(self, level, key):
+        path = self.path(level, key)
+        if not os.path.exists(path):
+            return None
+        return np.load(path, mmap_mode="r")
+
+    def store(self, level, key, array):
+        #written aside and renamed, a killed build never leaves half a file behind
+        path = self.path(level, key)
+        with open(path + ".tmp", "wb") as f:
+            np.save(f, array)
+        os.replace(path + ".tmp", path)
+        return array
+
+    def fetch(self, level, key, compute):
+        #cached array of level/key, compute() and store it on a miss
+        cached = self.load(level, key)
+        if cached is not None:
+            return cached
+        return self.store(level, key, compute())
+
+    # ---------- manifest ----------
+    def hash_of(self, path):
+        #content hash of a wav, only recomputed when its size or mtime changed
+        stat = os.stat(path)
+        known = self.manifest["file_hashes"].get(path)
+        if known is not None and known[0] == stat.st_size and known[1] == stat.st_mtime:
+            return known[2]
+        sha = file_hash(path)
+        self.manifest["file_hashes"][path] = [stat.st_size, stat.st_mtime, sha]
+        return sha
+
+    def is_built(self, wav, keys, store):
+        #store: the current tile_store.TileStore (None if there is none)
+        entry = self.manifest["songs"].get(wav)
+        if store is None or entry is None or entry["keys"]["tiles"] != keys["tiles"]:
+            return False
+        return all(tile in store for tile in entry["tiles"])
+
+    def forget_song(self, wav):
+        self.manifest["songs"].pop(wav, None)
+
+    def record_song(self, wav, keys, tiles):
+        #call save() afterwards
+        self.manifest["songs"][wav] = {"keys": keys, "tiles": [int(tile) for tile in tiles]}
+
+    def save(self):
+        with open(self.manifest_path + ".tmp", "w") as f:
+            json.dump(self.manifest, f)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+
+    def prune(self):
+        #drops level files no song in the manifest refers to anymore
+        used = set()
+        for entry in self.manifest["songs"].values():
+            for track in ("v", "o"):
+                for range_keys in entry["keys"][track]:
+                    used.update((level, range_keys[level]) for level in levels if level in range_keys)
+        for level in levels:
+            for name in os.listdir(os.path.join(self.cache_dir, level)):
+                if (level, name[:-len(".npy")]) not in used:
+                    os.remove(os.path.join(self.cache_dir, level, name))
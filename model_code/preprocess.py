@@ -28,8 +28,15 @@ import numpy as np
 import matplotlib.pyplot as plt 
 plt.switch_backend('agg') #for running matplotlib remotely (no graphic device available)
 import wav2spec as w2s # for spectrogram conversion codes
+import prep_cache # incremental builds, see generate_concat_npyfile(cache_dir=)
+import tag_catalog # compiled tagfiles
+import tile_store # where the tiles go, see generate_concat_npyfile(store_dir=)
+import filterbank as fb # mel / logfreq front ends
+from wav_writer import WavWriter # int16/float32 wavs written chunk by chunk
 from scipy.io import wavfile
 import sys
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 # import separation as sep # for voice separation of the original song
                 #no need to do this. just prep voice separated files before.
 
@@ -38,6 +45,20 @@ import sys
 #windowing, step size for chopping the specgram.
 win_size=4
 st_size=0.5           #also float available
+spec_batch_size=16    #number of pieces turned into specgrams in one vectorized call (memory bound)
+real_spec=True        #float32 one-sided fft path of w2s.pretty_spectrogram (tolerance documented there)
+song_level=True       #one stft per tagged voice range, pieces are cut from it (see song_specgrams())
+n_workers=1           #songs processed in parallel (processes) by generate_concat_npyfile()
+filter_chunk_size=2**20   #samples bandpass filtered at a time (float32, state carried over chunks)
+filter_margin=0.5     #secs filtered before each tagged range to warm the filter up (dropped afterwards)
+shard_size=tile_store.default_shard_size   #tiles per shard file of the tile store
+tile_format="float32" #tile store format: float32, uint16 or uint8 (quantized over [-spec_thresh, 0], see tile_store.py)
+tile_codec="none"     #tile store compression: none, zlib or lzma (chunk per tile, see tile_store.py)
+tile_layout="tiles"   #tiles: every tile stored, virtual: range spectrograms stored, tiles cut at load time (song_level only)
+freq_frontend="linear"  #frequency axis of the tiles: linear (fft_size//2 fft bins), mel or logfreq (freq_bins bands)
+freq_bins=256         #bands of the mel/logfreq front ends, tiles become 1024 x freq_bins (see frontend_info())
+save_phase="none"     #none, voice or mix: stft phase of that track kept with every tile (uint8, see tile_store.py)
+                      #for a single istft in recover_audio(phase=) instead of griffin-lim from scratch
 
 songdir="monowav/files/directory/"      #beware this must contain "/"
 tagfilepath="where/exists/tagfile.txt"  
@@ -57,85 +78,216 @@ check_training_dir="where/specgram/jpg/are/stored/"     #for checking mode colla
 
 # gets list of tuples that has voice range with sec units
 def tag2range(wav_name,tagfilepath=tagfilepath):        #wavname contains .wav
-    #print("tagfilepath={inp}".format(inp=tagfilepath))
-    namelen=len(wav_name[:-4])#for wav_name contains .wav at the end
-    lines=[]
-    with open(tagfilepath) as tagfile:
-        lines+=tagfile.readlines()
-#        print(lines)
-#        print("         namelen=%s"%namelen)
-    voice_rangetuples_list=[]
-    for line in lines:
-        if line[:namelen]==wav_name[:-4]: 
-            dash_sep_list=line[namelen+1+4:].rstrip("\n").split(',')   # +1 for whitespace, +4 for ".wav" extension in tag line 
-#            print(dash_sep_list)
-            for dash_sep in dash_sep_list:              #["1-2", "4-5",]
-                a_range=list(dash_sep.split('-'))       #a_range-iter0=["1","2"]
-                for i in range(len(a_range)):
-                    a_range[i]=int(a_range[i])          #converting each elements into int
-                voice_rangetuples_list.append(tuple(a_range))       
-#    print("voice_rangetuples_list is")
-#    print(voice_rangetuples_list)
-    return voice_rangetuples_list
-
-
-def get_specgram(rate,filtered_wav):
+    #exact name lookup in the compiled tagfile (tag_catalog), the tagfile is only read again when it changes
+    return tag_catalog.load_catalog(tagfilepath).ranges_of(wav_name)
+
+
+def frontend_info(kind=freq_frontend, n_bins=freq_bins):
+    #frequency front end of a dataset, as it is recorded in its tile store header
+    #(tile_store.TileStore.frontend) for the model and recover_audio()
+    if kind=="linear": n_bins=w2s.fft_size//2
+    elif kind not in fb.frontends:
+        raise ValueError("unknown frequency front end {kind}, choose from linear, {names}".format(
+            kind=kind, names=", ".join(sorted(fb.frontends))))
+    return {"kind": kind, "n_bins": n_bins, "fft_size": w2s.fft_size}
+
+def frontend_bank(rate, frontend):
+    #analysis bank (magnitudes --> bands) of a front end at rate, None for linear
+    if frontend is None or frontend["kind"]=="linear": return None
+    return fb.frontend_banks(frontend["kind"], frontend["n_bins"], frontend["fft_size"], rate)[0]
+
+def to_linear_specgram(specgram, frontend, rate=44100, thresh=w2s.spec_thresh):
+    #log mel/logfreq tile (frames, bands) --> approximate log tile over the linear fft bins (frames, fft_size//2),
+    #what invert_pretty_spectrogram() wants. bands are interpolated back, fine detail within a band is lost
+    if frontend is None or frontend["kind"]=="linear": return specgram
+    synthesis=fb.frontend_banks(frontend["kind"], frontend["n_bins"], frontend["fft_size"], rate)[1]
+    linear=fb.apply_filterbank(synthesis, np.power(10., specgram, dtype=np.float32))[..., :frontend["fft_size"]//2]
+    return np.log10(np.maximum(linear, 10.**-thresh))
+
+def get_specgram(rate,filtered_wav,frontend=None):
     #wav obj must underwent bandpass filter
     #print("get_specgram")    
     specgram = w2s.pretty_spectrogram(filtered_wav.astype('float32'), fft_size = w2s.fft_size, 
-                                   step_size = w2s.step_size, log = True, thresh = w2s.spec_thresh)
+                                   step_size = w2s.step_size, log = True, thresh = w2s.spec_thresh, real = real_spec,
+                                   bank = frontend_bank(rate, frontend))
     row=len(specgram) #this corresponds to time
-    col=len(specgram[0])
+    col=w2s.fft_size//2 #frames of a piece
     if row<col:
         print("\n\n\nNO!\n\n\n")
         sys.exit("sth gone wrong with get_specgram in preprocess.py")
     else:
-        specgram=specgram[:col] # specgram is 1024x1024 matrix
+        specgram=specgram[:col] # specgram is 1024x1024 matrix (1024 x n_bins for mel/logfreq)
     #print(specgram.shape)
     return specgram
 
-def iterative_windower(win_size, st_size, wav, voice_rangetuples_list):
+def get_specgram_batch(rate, filtered_wavs, frontend=None, phase=False):
+    #same as get_specgram() but for a stack of pieces with shape=(n_pieces, n_samples)
+    #returns (n_pieces, 1024, 1024), (n_pieces, 1024, n_bins) for mel/logfreq
+    #phase: returns (specgrams, their uint8 phase (n_pieces, 1024, 1024)) instead
+    specgrams = w2s.pretty_spectrogram_batch(np.asarray(filtered_wavs, dtype='float32'), fft_size = w2s.fft_size,
+                                   step_size = w2s.step_size, log = True, thresh = w2s.spec_thresh, real = real_spec,
+                                   bank = frontend_bank(rate, frontend), phase = phase)
+    if phase: specgrams, angles = specgrams
+    row=specgrams.shape[1] #this corresponds to time
+    col=w2s.fft_size//2 #frames of a piece
+    if row<col:
+        print("\n\n\nNO!\n\n\n")
+        sys.exit("sth gone wrong with get_specgram_batch in preprocess.py")
+    if phase: return specgrams[:, :col], angles[:, :col]
+    return specgrams[:, :col] # each specgram is 1024x1024 matrix
+
+def open_wav(wav):
+    #memory mapped pcm, nothing is decoded until it gets sliced
+    try:
+        rate, pcm = wavfile.read(wav, mmap=True)
+    except ValueError:          #formats scipy cannot map (e.g. 24bit) are read as a whole
+        rate, pcm = wavfile.read(wav)
+    return rate, pcm
+
+def downmix(pcm_block):
+    #pcm block --> mono float32 (mean of the channels for stereo)
+    if pcm_block.ndim == 1: return pcm_block.astype(np.float32)
+    return pcm_block.mean(axis=1, dtype=np.float32)
+
+def read_filtered_span(rate, pcm, start, end, margin=filter_margin):
+    #decodes, downmixes and bandpass filters pcm[start:end] only, block by block.
+    #the filter warms up on margin secs before start, which are dropped afterwards
+    lead=min(int(margin*rate), start)
+    blocks=(downmix(pcm[pos:min(pos+filter_chunk_size, end)]) for pos in range(start-lead, end, filter_chunk_size))
+    filtered=np.empty(end-start+lead, dtype=np.float32)
+    pos=0
+    for block in w2s.butter_bandpass_filter_stream(blocks, w2s.lowcut, w2s.highcut, rate, order=1):
+        filtered[pos:pos+len(block)]=block
+        pos+=len(block)
+    return filtered[lead:]
+
+def range_windows(rate, n_samples, stpts, win_size):
+    #window sliding points stpts (secs, see tag_catalog.plan_per_range()) of a tagged voice range
+    # --> (start, end samples), windows running past the song end are dropped
+    starts=(stpts*rate).astype(np.int64)
+    ends=((stpts+win_size)*rate).astype(np.int64)
+    keep=(n_samples-starts) >= int(win_size*rate)
+    return starts[keep], ends[keep]
+
+def iterative_windower(win_size, st_size, wav, voice_rangetuples_list, stpts_list=None):
+    #only the tagged voice ranges are read from disk and filtered
+    #stpts_list: window plan of the ranges if already made (tag_catalog.TagCatalog.window_plan())
     print("iterative_windower")
-    rate, raw_wav = wavfile.read(wav)
-    filtered_wav = w2s.butter_bandpass_filter(raw_wav, w2s.lowcut, w2s.highcut, rate, order=1)
-    
-    #construct window slinding points from voice_rangetuples_list
-    rangelist_set=[]
-    for tups in voice_rangetuples_list:
-        v_starts=tups[0]
-        v_ends=tups[1]
-        one_range=np.arange(v_starts,v_ends,st_size)  
-        rangelist_set.append(one_range)
-    rangelist_set=np.array(rangelist_set)
-
-    #with rangelist_set, chop the filtered_wav
+    rate, pcm = open_wav(wav)
+    if stpts_list is None: stpts_list=tag_catalog.plan_per_range(voice_rangetuples_list, st_size)
+
     songpiece_list=[]
-    for one_range in rangelist_set:
-        for stpt in one_range:
-            start = int(stpt*rate)
-            end  =  int( (stpt+win_size)*rate )
-            length= int(win_size*rate)
-            if (filtered_wav.shape[0]-start) < length: continue
-            else: 
-                songpiece=filtered_wav[start:end]
-                songpiece_list.append(songpiece)
+    for stpts in stpts_list:
+        starts, ends = range_windows(rate, len(pcm), stpts, win_size)
+        if len(starts)==0: continue
+        voice_range=read_filtered_span(rate, pcm, starts[0], ends.max())
+        for start, end in zip(starts-starts[0], ends-starts[0]):
+            songpiece_list.append(voice_range[start:end])
     songpiece_array=np.array(songpiece_list)
     return rate, songpiece_array
 
-def get_spec_concat_npy(rate_v, rate_o, voice_crop_arry, orig_crop_arry, song_no, savedir):
+def range_span(rate, n_samples, voice_range, win_size):
+    #samples a tagged voice range needs for any st_size: its first window start up to
+    #the end of a window starting at the end of the range
+    return int(voice_range[0]*rate), min(int(voice_range[1]*rate)+int(win_size*rate), n_samples)
+
+def range_cache_keys(wav_hash, voice_range, win_size):
+    #prep_cache keys of the pcm/filtered/spec levels of one voice range
+    pcm_key=prep_cache.make_key("pcm", wav_hash, list(voice_range), win_size, filter_margin)
+    filtered_key=prep_cache.make_key("filtered", pcm_key, w2s.lowcut, w2s.highcut, 1)
+    spec_key=prep_cache.make_key("spec", filtered_key, w2s.fft_size, w2s.step_size, real_spec)
+    phase_key=prep_cache.make_key("phase", filtered_key, w2s.fft_size, w2s.step_size, real_spec)
+    return {"pcm": pcm_key, "filtered": filtered_key, "spec": spec_key, "phase": phase_key}
+
+def song_cache_keys(wav_hash_v, wav_hash_o, voice_rangetuples_list, song_no, win_size, st_size, frontend=None, save_phase="none"):
+    keys={"v": [range_cache_keys(wav_hash_v, tups, win_size) for tups in voice_rangetuples_list],
+          "o": [range_cache_keys(wav_hash_o, tups, win_size) for tups in voice_rangetuples_list]}
+    phase=(save_phase,) if save_phase!="none" else ()      #stores without phase keep their keys
+    keys["tiles"]=prep_cache.make_key("tiles", [k["spec"] for k in keys["v"]], [k["spec"] for k in keys["o"]],
+                                      song_no, win_size, st_size, w2s.spec_thresh, frontend, *phase)
+    return keys
+
+def song_specgrams(win_size, st_size, wav, voice_rangetuples_list, cache=None, range_keys=None, stpts_list=None, frontend=None,
+                   phase=False):
+    #song-level counterpart of iterative_windower(): every tagged voice range is
+    #transformed once instead of once per (heavily overlapping) piece
+    #with a prep_cache.PrepCache, each level (pcm, filtered, spec) is only computed when not cached
+    #frontend: mel/logfreq bands are made from the (cached, linear) spectrogram of each range
+    #phase: the uint8 phase of each range comes along (prep_cache phase level), from the same stft as its specgram
+    #returns rate, [(specgram of a range, frame offsets of its pieces), ...], [(specgram, offsets, phase), ...] with phase
+    print("song_specgrams")
+    rate, pcm = open_wav(wav)
+    if stpts_list is None: stpts_list=tag_catalog.plan_per_range(voice_rangetuples_list, st_size)
+    bank=frontend_bank(rate, frontend)
+
+    range_specs=[]
+    for i, (tups, stpts) in enumerate(zip(voice_rangetuples_list, stpts_list)):
+        starts, _ = range_windows(rate, len(pcm), stpts, win_size)      #same sliding points as iterative_windower()
+        if len(starts)==0: continue
+        span_start, span_end = range_span(rate, len(pcm), tups, win_size)
+        lead=min(int(filter_margin*rate), span_start)
+
+        if cache is None:
+            fetch=lambda level, compute: compute()
+            filtered=lambda: read_filtered_span(rate, pcm, span_start, span_end)
+        else:
+            fetch=lambda level, compute: cache.fetch(level, range_keys[i][level], compute)
+            pcm_span=lambda: fetch("pcm", lambda: downmix(pcm[span_start-lead:span_end]))
+            filtered=lambda: fetch("filtered", lambda: w2s.butter_bandpass_filter(pcm_span(), w2s.lowcut, w2s.highcut, rate,
+                                                                                  order=1, chunk_size=filter_chunk_size)[lead:])
+        transform=lambda: w2s.song_spectrogram(filtered(), fft_size = w2s.fft_size, step_size = w2s.step_size,
+                                               real = real_spec, phase = phase)
+        if phase:
+            both=[]         #one stft for whichever of spec/phase is not cached
+            def transformed(k):
+                if not both: both.append(transform())
+                return both[0][k]
+            specgram=fetch("spec", lambda: transformed(0))
+            angles=fetch("phase", lambda: transformed(1))
+        else:
+            specgram=fetch("spec", transform)
+        if bank is not None: specgram=fb.apply_filterbank(bank, specgram)
+        offsets=w2s.frame_offsets(starts-span_start, w2s.step_size)
+        range_specs.append((specgram, offsets, angles) if phase else (specgram, offsets))
+    return rate, range_specs
+
+def get_spec_concat_npy_song_level(rate, range_specs_v, range_specs_o, song_no, save, win_size=win_size, batch_size=spec_batch_size):
+    #same tiles as get_spec_concat_npy(), pieces are cut out of song_specgrams()
+    #a track made with its phase has the phase of every piece cut too, save() gets it as phases
+    print("get_spec_concat_npy_song_level")
+    col=w2s.fft_size//2                                                       #pieces stay 1024 frames long
+    norm_frames=(int(win_size*rate)-w2s.fft_size)//w2s.step_size+1          #frames a piece used to be normalized over
+    piece_no=0
+    tiles=[]
+    for range_v, range_o in zip(range_specs_v, range_specs_o):
+        spec_v, offsets, spec_o = range_v[0], range_v[1], range_o[0]
+        angles=range_v[2] if len(range_v)>2 else range_o[2] if len(range_o)>2 else None
+        for first in range(0, len(offsets), batch_size):
+            batch=offsets[first:first+batch_size]
+            tiles_v=w2s.cut_spectrogram_tiles(spec_v, batch, col, norm_frames=norm_frames, thresh=w2s.spec_thresh)
+            tiles_o=w2s.cut_spectrogram_tiles(spec_o, batch, col, norm_frames=norm_frames, thresh=w2s.spec_thresh)
+            phases=w2s.cut_phase_tiles(angles, batch, col) if angles is not None else None
+            save(piece_no, np.stack((tiles_v,tiles_o), axis=3), phases)
+            tiles.extend(range(song_no+piece_no, song_no+piece_no+len(batch)))
+            piece_no+=len(batch)
+    return tiles
+
+def get_spec_concat_npy(rate_v, rate_o, voice_crop_arry, orig_crop_arry, song_no, save, batch_size=spec_batch_size, frontend=None,
+                        save_phase=save_phase):
     print("get_spec_concat_npy")
-    for piece_no in range(len(voice_crop_arry)):
-        spec_v=get_specgram(rate_v, voice_crop_arry[piece_no])
-        spec_o=get_specgram(rate_o, orig_crop_arry[piece_no])
-        #print("spec_o shape={shape}".format(shape=spec_o.shape))
-        rs_spec_v=np.reshape(spec_v,(1024,1024,1))
-        rs_spec_o=np.reshape(spec_o,(1024,1024,1))
-        concat_piece=np.concatenate((rs_spec_v,rs_spec_o), axis=2)  #when feeding to the graph, axis=2 (see fin_model.build_model())
-        #print("saved array shape=")
-        #print(concat_piece.shape)
-        #concat_piece=np.concatenate((rs_spec_v,rs_spec_o), axis=1) #when need to visualize, axis=1 HOW WEIRD?!
-        save_data2npy(name_counter=song_no+piece_no, nparray=concat_piece, savedir=savedir)
-        # first piece of the first song will be named as 10000(song#)+1(piece#)==10001.npy
+    #voice and ensemble pieces are turned into specgrams together, batch_size pieces at a time
+    #save(first piece_no, pieces, phases) stores them (see process_song()), phases of the save_phase track or None
+    phases=None
+    for first in range(0, len(voice_crop_arry), batch_size):
+        last = min(first + batch_size, len(voice_crop_arry))
+        specs_v=get_specgram_batch(rate_v, voice_crop_arry[first:last], frontend, phase=save_phase=="voice")
+        specs_o=get_specgram_batch(rate_o, orig_crop_arry[first:last], frontend, phase=save_phase=="mix")
+        if save_phase=="voice": specs_v, phases = specs_v
+        elif save_phase=="mix": specs_o, phases = specs_o
+        concat_pieces=np.stack((specs_v,specs_o), axis=3)  #(n,1024,1024,2) when feeding to the graph, axis=2 of a piece (see fin_model.build_model())
+        save(first, concat_pieces, phases)
+        # first piece of the first song will be named as 10000(song#)+1(piece#)==10001
+    return [song_no+piece_no for piece_no in range(len(voice_crop_arry))]
 '''no need to pass the array itself. saved as npy'''
 #    spec_concat_array=np.array(spec_concat_list)
 #    print(spec_concat_array.shape)
@@ -167,17 +319,286 @@ def split2_indiv_spec(spec_concat,select):#if select ="voice" --> returns voice
     return res
 '''
 
-def generate_concat_npyfile(songdir, win_size=win_size,st_size=st_size,tagfilepath=tagfilepath):
+def list_songs(songdir):
+    #ensemble wavs of songdir in a fixed (sorted) order. song numbers, thus tile ids
+    #(song_no*10000+piece_no), follow this order whatever order the songs get processed in
+    return sorted(wav for wav in os.listdir(songdir) if wav[0:3]!="vo_" and wav[-4:]==".wav")
+
+def piece_offsets(wav, stpts_list, win_size):
+    #start (secs) of every piece a song is going to be cut into, without reading its samples
+    rate, pcm = open_wav(wav)
+    starts=[range_windows(rate, len(pcm), stpts, win_size)[0] for stpts in stpts_list]
+    return np.concatenate(starts+[np.zeros(0, dtype=np.int64)])/float(rate)
+
+def song_ranges(wav, voice_rangetuples_list, stpts_list, win_size):
+    #rows of the ranges table of a virtual store (see tile_store.create_virtual()) for the tagged ranges
+    #of a song that make pieces, from the wav header only. song and first_frame are up to the caller
+    rate, pcm = open_wav(wav)
+    rows=[]
+    for tups, stpts in zip(voice_rangetuples_list, stpts_list):
+        starts, _ = range_windows(rate, len(pcm), stpts, win_size)
+        if len(starts)==0: continue
+        span_start, span_end = range_span(rate, len(pcm), tups, win_size)
+        rows.append({"rate": rate, "start": tups[0], "end": tups[1], "span_start": span_start, "n_samples": len(pcm),
+                     "n_frames": w2s.song_frames(span_end-span_start, w2s.fft_size, w2s.step_size),
+                     "norm_frames": (int(win_size*rate)-w2s.fft_size)//w2s.step_size+1})
+    return rows
+
+def virtual_index(ranges, win_size, st_size):
+    #tiles of a virtual store: the windows every st_size secs of each range, exactly the ones
+    #song_specgrams() + get_spec_concat_npy_song_level() cut for the tiles layout
+    col=w2s.fft_size//2
+    index={"ids": [], "song": [], "offsets": [], "range": [], "frame": []}
+    piece_no={}
+    for r in range(len(ranges["song"])):
+        rate=int(ranges["rate"][r])
+        song_no=int(ranges["song"][r])
+        stpts=tag_catalog.plan_ranges([(ranges["start"][r], ranges["end"][r])], st_size)
+        starts, _ = range_windows(rate, ranges["n_samples"][r], stpts, win_size)
+        frames=w2s.frame_offsets(starts-ranges["span_start"][r], w2s.step_size)
+        if len(frames) and frames.max()+col > ranges["n_frames"][r]:
+            raise ValueError("tile runs past the end of the spectrogram of range {r}".format(r=r))
+        first=piece_no.get(song_no, 0)
+        piece_no[song_no]=first+len(starts)
+        index["ids"].append(song_no*10000+first+np.arange(len(starts)))
+        index["song"].append(np.full(len(starts), song_no))
+        index["offsets"].append(starts/float(rate))
+        index["range"].append(np.full(len(starts), r))
+        index["frame"].append(frames)
+    dtypes={"ids": np.int64, "song": np.int32, "offsets": np.float64, "range": np.int64, "frame": np.int64}
+    return dict((key, np.concatenate(index[key]+[np.zeros(0)]).astype(dtypes[key])) for key in index)
+
+def rehop_store(store, st_size):
+    #a virtual store (tile_store.VirtualTileStore) indexed for tiles every st_size secs, nothing is recomputed
+    store.set_index(virtual_index(store.ranges, store.win_size, st_size))
+    return store
+
+def process_song(job):
+    #one song of generate_concat_npyfile(): vocal and ensemble tracks are read/filtered/transformed
+    #concurrently (threads, numpy/scipy release the gil), then written to the store being built:
+    #its tiles to rows first.. (tiles layout), or its range spectrograms to ranges first.. (virtual layout)
+    #returns the song, its tile ids and the worst error quantizing them
+    song_no, wav, songdir, win_size, st_size, voice_rangetuples_list, stpts_list, song_level, cache_dir, keys, \
+        store_dir, tile_layout, frontend, save_phase, first, count = job
+    print(wav)
+    if song_level:
+        cache = prep_cache.PrepCache(cache_dir) if cache_dir else None
+        track_v = (song_specgrams, (win_size, st_size, os.path.join(songdir,"vo_"+wav), voice_rangetuples_list,
+                                    cache, keys and keys["v"], stpts_list, frontend, save_phase=="voice"))
+        track_o = (song_specgrams, (win_size, st_size, os.path.join(songdir,wav), voice_rangetuples_list,
+                                    cache, keys and keys["o"], stpts_list, frontend, save_phase=="mix"))
+    else:
+        track_v = (iterative_windower, (win_size, st_size, os.path.join(songdir,"vo_"+wav), voice_rangetuples_list, stpts_list))
+        track_o = (iterative_windower, (win_size, st_size, os.path.join(songdir,wav), voice_rangetuples_list, stpts_list))
+    tracks = ThreadPool(2)
+    try:
+        res_v=tracks.apply_async(*track_v)
+        res_o=tracks.apply_async(*track_o)
+        rate_v, v_track=res_v.get()
+        rate_o, o_track=res_o.get()
+    finally:
+        tracks.close()
+
+    store=tile_store.load_store(store_dir, mode="r+")
+    if tile_layout=="virtual":
+        if len(v_track)!=count:
+            raise RuntimeError("{wav} made {n} ranges, {planned} were planned".format(wav=wav, n=len(v_track), planned=count))
+        for r, (range_v, range_o) in enumerate(zip(v_track, o_track)):
+            angles=range_v[2] if len(range_v)>2 else range_o[2] if len(range_o)>2 else None
+            store.write_range(first+r, range_v[0], range_o[0], phase=angles)
+        store.close()
+        return wav, store.ids[store.song==song_no].tolist(), 0.0
+
+    errors=[0.0]
+    def save(piece_no, concat_pieces, phases=None):
+        if piece_no+len(concat_pieces)>count:     #never write over the rows of the next song
+            raise RuntimeError("{wav} makes more than the {n} pieces planned for it".format(wav=wav, n=count))
+        errors.append(store.write(first+piece_no, concat_pieces))
+        if phases is not None: store.write_phase(first+piece_no, phases)
+    if song_level:
+        tiles=get_spec_concat_npy_song_level(rate_v, v_track, o_track, song_no*10000, save, win_size=win_size)
+    else:
+        tiles=get_spec_concat_npy(rate_v, rate_o, v_track, o_track, song_no*10000, save, frontend=frontend, save_phase=save_phase)
+    store.close()
+    if len(tiles)!=count:
+        raise RuntimeError("{wav} made {n} pieces, {planned} were planned".format(wav=wav, n=len(tiles), planned=count))
+    return wav, tiles, max(errors)
+
+def legacy_tile_files(songdir):
+    #<id>.npy files in songdir, e.g. tiles of a dataset built before the tile store (save_data2npy) that nothing reads
+    #anymore. they are only listed, never removed: hand made or test tiles carry the same names
+    return sorted(os.path.join(songdir, name) for name in os.listdir(songdir)
+                  if name.endswith(".npy") and name[:-len(".npy")].isdigit())
+
+def store_is_current(store, ids, song_of, offsets, songs, tile_format, tile_codec, frontend, phase):
+    #True if store already is the (tiles layout) store planned by generate_concat_npyfile: same songs, same tiles in
+    #the same rows, same format, codec, front end and phase
+    return (not isinstance(store, tile_store.VirtualTileStore) and store.format==tile_format and store.codec==tile_codec
+            and store.frontend==frontend and store.phase_track==phase and list(store.songs)==list(songs)
+            and np.array_equal(store.ids, ids) and np.array_equal(store.song, song_of) and np.array_equal(store.offsets, offsets))
+
+def generate_concat_npyfile(songdir, win_size=win_size,st_size=st_size,tagfilepath=tagfilepath, song_level=song_level, n_workers=n_workers,
+                            cache_dir=None, store_dir=None, tile_format=tile_format, tile_codec=tile_codec, tile_layout=tile_layout,
+                            freq_frontend=freq_frontend, freq_bins=freq_bins, save_phase=save_phase):
     #windowsize and stepsize for chopping wavs. not for specgram
+    #songs are spread over n_workers processes
+    #tiles go to a tile_store at store_dir (default songdir/tiles): every piece's place is planned first,
+    #the songs are written straight into their rows of a new store, which then replaces the old one
+    #cache_dir: incremental build through prep_cache (song_level only). tiles of songs whose wavs, tags and
+    #parameters did not change since the last build are copied over from the old store, the others
+    #reuse whatever level they can
+    #tile_format: float32, or uint16/uint8 for a 2x/4x smaller store (worst error is reported)
+    #tile_codec: none, zlib or lzma. the store is built uncompressed, then compressed tile by tile
+    #tile_layout="virtual": the range spectrograms are stored instead of the tiles (~8x smaller at st_size=0.5,
+    #float32 and uncompressed only). every song is written again, from the cache where it can
+    #freq_frontend/freq_bins: frequency axis of the tiles (linear, or mel/logfreq bands), kept in the store header
+    #save_phase: voice or mix, the phase of that track is stored with the tiles (none: magnitudes only)
+    #<id>.npy files in songdir (tiles of builds before the tile store) are listed once its first store is published
     #print("generate_concat_npyfile")
-    for i, wav in enumerate(os.listdir(songdir)): #maybe, separated song should be located at lower hierarchy of wav dir
-        if wav[0:3]!="vo_" and wav[-4:]==".wav":
-            print(wav) 
-            voice_rangetuples_list=tag2range(wav,tagfilepath)
-            rate_v, v_crop_arry=iterative_windower(win_size, st_size, os.path.join(songdir,"vo_"+wav), voice_rangetuples_list)
-            rate_o, o_crop_arry=iterative_windower(win_size, st_size, os.path.join(songdir,wav), voice_rangetuples_list)
-            get_spec_concat_npy(rate_v, rate_o, v_crop_arry, o_crop_arry, i*10000, songdir)  
-        else: continue
+    frontend = frontend_info(freq_frontend, freq_bins)
+    phase = None if save_phase=="none" else save_phase
+    tile_store.check_phase_track(phase)
+    virtual = tile_layout=="virtual"
+    if virtual and not (song_level and tile_format=="float32" and tile_codec=="none"):
+        raise ValueError("the virtual layout is song_level, float32 and uncompressed only")
+    cache = prep_cache.PrepCache(cache_dir) if (cache_dir and song_level) else None
+    if store_dir is None: store_dir=os.path.join(songdir, "tiles")
+    old_store = tile_store.open_store(store_dir)
+    try:
+        if old_store is not None and (old_store.format!=tile_format or old_store.phase_track!=phase):    #format/phase changed: rebuild every song
+            old_store.close()
+            old_store=None
+        songs = list_songs(songdir) #maybe, separated song should be located at lower hierarchy of wav dir
+        catalog = tag_catalog.load_catalog(tagfilepath)     #tagfile is validated and compiled once
+        window_plan = catalog.window_plan(st_size)          #window sliding points of every song at once
+        untagged = [wav for wav in songs if wav not in catalog]
+        if untagged: print("no tags for {songs}, they make no pieces".format(songs=", ".join(untagged)))
+
+        #layout of the new store: song by song, in song order
+        ids, song_of, offsets = [], [], []
+        n_rows = 0
+        ranges = []     #virtual layout
+        jobs, kept = [], []
+        song_keys={}
+        for song_no, wav in enumerate(songs):
+            voice_rangetuples_list=catalog.ranges_of(wav)
+            keys=None
+            if cache is not None:
+                keys=song_cache_keys(cache.hash_of(os.path.join(songdir,"vo_"+wav)), cache.hash_of(os.path.join(songdir,wav)),
+                                     voice_rangetuples_list, song_no, win_size, st_size, frontend, save_phase)
+                song_keys[wav]=keys
+                if not virtual and cache.is_built(wav, keys, old_store):
+                    print("{wav} is up to date".format(wav=wav))
+                    old_rows=np.array([old_store.rows[tile] for tile in cache.manifest["songs"][wav]["tiles"]], dtype=np.int64)
+                    kept.append((n_rows, old_rows))
+                    ids.append(old_store.ids[old_rows])
+                    song_of.append(np.full(len(old_rows), song_no))
+                    offsets.append(old_store.offsets[old_rows])
+                    n_rows+=len(old_rows)
+                    continue
+            stpts_list=window_plan.get(wav, [])
+            if virtual:
+                song_rows=song_ranges(os.path.join(songdir,"vo_"+wav), voice_rangetuples_list, stpts_list, win_size)
+                jobs.append((song_no, wav, songdir, win_size, st_size, voice_rangetuples_list, stpts_list,
+                             song_level, cache and cache_dir, keys, store_dir+".building", tile_layout, frontend, save_phase,
+                             len(ranges), len(song_rows)))
+                for row in song_rows: row["song"]=song_no
+                ranges.extend(song_rows)
+                continue
+            song_offsets=piece_offsets(os.path.join(songdir,"vo_"+wav), stpts_list, win_size)
+            jobs.append((song_no, wav, songdir, win_size, st_size, voice_rangetuples_list, stpts_list,
+                         song_level, cache and cache_dir, keys, store_dir+".building", tile_layout, frontend, save_phase,
+                         n_rows, len(song_offsets)))
+            ids.append(song_no*10000+np.arange(len(song_offsets)))
+            song_of.append(np.full(len(song_offsets), song_no))
+            offsets.append(song_offsets)
+            n_rows+=len(song_offsets)
+
+        concat=lambda parts, dtype: np.concatenate(parts).astype(dtype) if parts else np.zeros(0, dtype=dtype)
+        if not jobs and old_store is not None and store_is_current(old_store, concat(ids, np.int64), concat(song_of, np.int32),
+                                                                   concat(offsets, np.float64), songs, tile_format, tile_codec,
+                                                                   frontend, phase):
+            #every song up to date and in its old rows: nothing to write, the store stays as it is
+            print("{n} tiles in {store_dir}, up to date".format(n=n_rows, store_dir=store_dir))
+            return
+
+        col=w2s.fft_size//2
+        tile_shape=(col, frontend["n_bins"], 2)
+        if virtual:
+            columns=("song", "rate", "start", "end", "span_start", "n_samples", "n_frames", "norm_frames")
+            ranges=dict((key, np.array([row[key] for row in ranges], dtype=np.float64 if key in ("start", "end") else np.int64))
+                        for key in columns)
+            ranges["first_frame"]=np.cumsum(ranges["n_frames"])-ranges["n_frames"]
+            index=virtual_index(ranges, win_size, st_size)
+            n_rows=len(index["ids"])
+            store=tile_store.create_virtual(store_dir+".building", index, ranges, songs, tile_shape=tile_shape,
+                                            thresh=w2s.spec_thresh, win_size=win_size, frontend=frontend, phase=phase)
+        else:
+            store=tile_store.create(store_dir+".building", concat(ids, np.int64), concat(song_of, np.int32), concat(offsets, np.float64),
+                                    songs, tile_shape=tile_shape, fmt=tile_format, value_range=(-w2s.spec_thresh, 0),
+                                    shard_size=shard_size, frontend=frontend, phase=phase)
+        max_error=old_store.max_error if kept else 0.0
+        for first_row, old_rows in kept:        #up to date songs: sequential copy, spec_batch_size tiles at a time
+            for first in range(0, len(old_rows), spec_batch_size):
+                store.write(first_row+first, old_store.tiles(old_rows[first:first+spec_batch_size]))
+                if phase is not None: store.write_phase(first_row+first, old_store.phases(old_rows[first:first+spec_batch_size]))
+        store.close()
+    finally:
+        #the old store is only read up to here, its memmaps are closed before publish() moves its directory
+        if old_store is not None: old_store.close()
+
+    if n_workers<=1:
+        done=map(process_song, jobs)
+        pool=None
+    else:
+        pool=Pool(min(n_workers, len(jobs)) or 1)
+        done=pool.imap_unordered(process_song, jobs)
+    built={}
+    try:
+        for count, (wav, tiles, error) in enumerate(done):
+            built[wav]=tiles
+            max_error=max(max_error, error)
+            print("[{count}/{total}] {wav} done".format(count=count+1, total=len(jobs), wav=wav))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    store.header["max_error"]=max_error
+    tile_store.write_header(store_dir+".building", store.header)
+    if tile_codec!="none":
+        built_store=tile_store.TileStore(store_dir+".building")
+        packed=tile_store.compress_store(built_store, store_dir+".packing", codec=tile_codec)
+        print("{codec}: {size:.1f}MB instead of {raw:.1f}MB".format(codec=tile_codec, size=packed.disk_size()/2.**20,
+                                                                    raw=built_store.disk_size()/2.**20))
+        built_store.close()
+        packed.close()
+        tile_store.publish(store_dir+".packing", store_dir+".building")
+    first_build = not os.path.exists(os.path.join(store_dir, "store.json"))
+    tile_store.publish(store_dir+".building", store_dir)
+    print("{n} tiles in {store_dir}".format(n=n_rows, store_dir=store_dir))
+    legacy = legacy_tile_files(songdir) if first_build else []
+    if legacy:
+        #a hint only, whether they are stale is up to the user
+        size = sum(os.path.getsize(path) for path in legacy)
+        print("{n} <id>.npy files in {songdir} ({size:.1f}MB), training reads the tile store only. if they are tiles of the old "
+              "per-tile layout they can be deleted: {names}{more}".format(
+            n=len(legacy), songdir=songdir, size=size/2.**20, names=", ".join(os.path.basename(path) for path in legacy[:5]),
+            more=", ..." if len(legacy)>5 else ""))
+    if virtual:
+        print("virtual: {size:.1f}MB of range spectrograms instead of {tiles:.1f}MB of float32 tiles".format(
+            size=tile_store.load_store(store_dir).disk_size()/2.**20, tiles=n_rows*np.prod(tile_shape)*4/2.**20))
+    if store.quantized:
+        print("{fmt} tiles, worst error {err:.3g} (bound {bound:.3g})".format(fmt=tile_format, err=max_error,
+                                                                          bound=store.header["error_bound"]))
+
+    if cache is not None:
+        #the manifest follows the published store only
+        for wav in list(cache.manifest["songs"]):
+            if wav not in songs: cache.forget_song(wav)
+        for wav, tiles in built.items():
+            cache.record_song(wav, song_keys[wav], tiles)
+        cache.save()
+        cache.prune()
 
 #            save_data2npy(name_counter=counter, nparray=spec_concat_array, save_dir=songdir)
 #            counter+=1 
@@ -211,11 +632,30 @@ def get_shuffled_tr_ex_array(songdir, win_size=win_size,st_size=st_size,tagfilep
 def generate_v_only_npyfile(songdir, win_size=win_size,st_size=st_size*2,tagfilepath=tagfilepath):
     #this function is almost twin with generate_concat_npyfile
     #songdir=testdir with only vo_somename.wav files 
+    #the start (secs into the song) of every tile goes to songdir/tile_offsets.npz (save_tile_offsets()),
+    #piece_no runs on over all voice ranges of a song so it cannot tell where a tile belongs
     print("generate_v_only_npyfile")
+    tile_ids, offsets = [], []
     for i, wav in enumerate(os.listdir(songdir)): #maybe, separated song should be located at lower hierarchy of wav dir
         voice_rangetuples_list=tag2range(wav,tagfilepath)
-        rate_v, v_crop_arry=iterative_windower(win_size, st_size, songdir+"vo_"+wav, voice_rangetuples_list)
+        stpts_list=tag_catalog.plan_per_range(voice_rangetuples_list, st_size)
+        rate_v, v_crop_arry=iterative_windower(win_size, st_size, songdir+"vo_"+wav, voice_rangetuples_list, stpts_list)
         get_spec_npy(rate_v, v_crop_arry,  song_no=i*10000, savedir=songdir)  
+        song_offsets=piece_offsets(songdir+"vo_"+wav, stpts_list, win_size)
+        tile_ids.append(i*10000+np.arange(len(song_offsets)))
+        offsets.append(song_offsets)
+    if tile_ids: save_tile_offsets(songdir, np.concatenate(tile_ids), np.concatenate(offsets))
+
+def save_tile_offsets(tile_dir, ids, offsets):
+    #start (secs into its song) of the <id>.npy tiles in tile_dir, the test tiles have no tile store to keep them
+    np.savez(os.path.join(tile_dir, "tile_offsets.npz"), ids=np.asarray(ids, dtype=np.int64), offsets=np.asarray(offsets, dtype=np.float64))
+
+def load_tile_offsets(tile_dir):
+    #{tile id: offset} saved by save_tile_offsets(), None if tile_dir has none
+    path=os.path.join(tile_dir, "tile_offsets.npz")
+    if not os.path.exists(path): return None
+    with np.load(path) as saved:
+        return dict(zip(saved["ids"].tolist(), saved["offsets"].tolist()))
 
 '''memory didnt allowed it!
 #when testing, just voice files to be tested in the directory
@@ -252,16 +692,27 @@ def write_specgram_img(specgram, imgname):   #jpgname with .png
 
 
 #takes too much time running. must be used only for testing
-def recover_audio(pathandwavname, specgram):
-    print("recover_audio")
-    print("similar to write_specgram_img")
-    print(specgram.shape)
-    rs_specgram=np.reshape(specgram, (1024,1024))
-    recovered=w2s.invert_pretty_spectrogram(rs_specgram, fft_size = w2s.fft_size,
-                                            step_size = w2s.step_size, log = True, n_iter = 10)
+#frontend: front end of the tiles (tile_store.TileStore.frontend), mel/logfreq tiles are taken back to linear bins first
+#rate: sample rate of the wav, dtype: int16 or float32 samples (scaled by w2s.audio_gain())
+#whole songs of consecutive tiles: stitch.render_song()
+def recover_audio(pathandwavname, specgram, frontend=None, rate=44100, dtype="float32", n_iter=10, verbose=True, phase=None):
+    #verbose=False: no prints (batch_recover.py runs many of these side by side)
+    #phase: phase of the tile (tile_store phases(), radians or uint8) to start from instead of zero phase,
+    #n_iter=0 then makes it a single istft
+    if verbose:
+        print("recover_audio")
+        print("similar to write_specgram_img")
+        print(specgram.shape)
+    rs_specgram=np.reshape(specgram, (w2s.fft_size//2,-1))
+    rs_specgram=to_linear_specgram(rs_specgram, frontend, rate=rate)
+    report=lambda i, conv: print("iter {i}: spectral convergence {conv:.4f}".format(i=i, conv=conv))
+    recovered=w2s.invert_pretty_spectrogram(rs_specgram, fft_size = w2s.fft_size, step_size = w2s.step_size,
+                                            log = True, n_iter = n_iter, callback = report if verbose else None,
+                                            phase = None if phase is None else np.reshape(phase, (w2s.fft_size//2, -1)))
     #recovered/=max(recovered_audio_orig)
     #recovered*=3                                       #normalize --> amplify.
-    wavfile.write(pathandwavname, 44100, recovered)
+    with WavWriter(pathandwavname, rate=rate, dtype=dtype) as out:
+        out.write(recovered*w2s.audio_gain(w2s.fft_size))
 
 
 #save processed array of shape (?,1024,1024,2) as npy binary file for calling it.
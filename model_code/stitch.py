@@ -0,0 +1,129 @@
+'''
+stitch.py
+
+whole songs out of tiles: consecutive tiles (1024 frames every st_size secs, at their tile_store
+offsets) are overlap-added with crossfades and streamed into one wav (wav_writer.WavWriter) chunk
+by chunk, so memory stays at a few tiles whatever the length of the song
+
+    stitch.render_song("song.wav", tiles, offsets, rate=44100, frontend=store.frontend, fade=0.1)
+
+tiles are log tiles (frames, bins) in offset order, any iterable (e.g. a generator running the
+model batch by batch), offsets their start in secs (tile_store index, TileStore.offsets).
+
+consecutive tiles hand over in the middle of their overlap, each tile keeps its center part
+(st_size long for tiles every st_size secs), through a raised cosine crossfade of fade secs
+    domain="time" : every tile is inverted (griffin-lim) on its own, their audio is crossfaded
+    domain="spec" : the linear magnitudes of the tiles are crossfaded into one song spectrogram,
+                    inverted in blocks of block_frames frames (overlapping by block_overlap) that
+                    are crossfaded in time again. phases are consistent over a block, not a tile
+tiles of separate voice ranges do not overlap, the gap between them is silence.
+with the phase of every tile (tile_store phases(), domain="time"), each tile is a single istft
+instead of griffin-lim from zero phase (n_iter=0, or a few iterations to refine it).
+
+'''
+
+import itertools
+import numpy as np
+import wav2spec as w2s
+import preprocess as pr
+from wav_writer import WavWriter
+
+domains = ("time", "spec")
+
+
+def fade_in(n):
+    #raised cosine ramp of n samples, fade_in(n) + fade_in(n)[::-1] == 1
+    return np.sin(0.5 * np.pi * (np.arange(n) + 0.5) / n) ** 2
+
+
+def crossfade_pieces(pieces, fade):
+    #overlap-adds pieces (start, array) sorted by start along their first axis (samples or frames).
+    #consecutive overlapping pieces hand over in the middle of their overlap through a fade_in()
+    #crossfade of at most fade. yields (start, chunk) of the result as soon as no later piece can
+    #change it, pieces that do not overlap leave a gap (start jumps)
+    pieces = iter(pieces)
+    piece = next(pieces, None)
+    pending, pending_start = None, 0
+    while piece is not None:
+        start, data = piece
+        following = next(pieces, None)
+        end = start + len(data)
+        lo = start if pending is None else pending_start
+        half_in = 0 if pending is None else len(pending) // 2
+        cut_out, half_out = end, 0
+        overlaps = following is not None and following[0] < end
+        if overlaps:
+            cut_out = (following[0] + end) // 2
+            #at most half the way to the next piece's start, so its own fade out (next handover) starts after this one
+            half_out = max(0, min(fade // 2, cut_out - following[0], end - cut_out, cut_out - lo - 2 * half_in,
+                                  (following[0] - start) // 2))
+        hi = cut_out + half_out
+        weights = np.ones(hi - lo)
+        if half_in:
+            weights[:2 * half_in] = fade_in(2 * half_in)
+        if half_out:
+            weights[-2 * half_out:] = fade_in(2 * half_out)[::-1]
+        part = data[lo - start:hi - start] * weights.reshape((-1,) + (1,) * (np.ndim(data) - 1))
+        if pending is not None:
+            part[:len(pending)] += pending
+        final = len(part) - 2 * half_out if overlaps else len(part)
+        if final > 0:
+            yield lo, part[:final]
+        pending, pending_start = (part[final:], lo + final) if overlaps else (None, 0)
+        piece = following
+
+
+def spec_blocks(chunks, block_frames, block_overlap):
+    #stitched frames (start, chunk) of crossfade_pieces() --> (start, block) of block_frames frames
+    #every block_frames-block_overlap frames. a gap ends the blocks before it with a shorter one
+    buf, buf_start, covered = None, 0, 0        #covered: frames of buf already in a block
+    for start, chunk in chunks:
+        if buf is not None and start != buf_start + len(buf):
+            if len(buf) > covered:
+                yield buf_start, buf
+            buf = None
+        if buf is None:
+            buf, buf_start, covered = chunk, start, 0
+        else:
+            buf = np.concatenate((buf, chunk))
+        while len(buf) >= block_frames:
+            yield buf_start, buf[:block_frames]
+            hop = block_frames - block_overlap
+            buf, buf_start, covered = buf[hop:], buf_start + hop, block_overlap
+    if buf is not None and len(buf) > covered:
+        yield buf_start, buf
+
+
+def render_song(path, tiles, offsets, rate=44100, frontend=None, fade=0.1, domain="time", dtype="int16",
+                gain=None, n_iter=10, block_frames=1024, block_overlap=128, from_song_start=False, phases=None):
+    #one wav of consecutive tiles, see the top of this file
+    #frontend: front end of the tiles (tile_store.TileStore.frontend), None for linear
+    #phases: phase of every tile, in the same order (radians or uint8), time domain only
+    #gain: sample scale (default w2s.audio_gain()), dtype: int16 or float32 samples
+    #from_song_start: silence up to the first tile, so the wav lines up with the song
+    #returns the number of samples written
+    if domain not in domains:
+        raise ValueError("unknown domain {domain}, choose from {names}".format(domain=domain, names=", ".join(domains)))
+    if phases is not None and domain != "time":
+        raise ValueError("tile phases only fit tiles inverted on their own, domain=time")
+    fft_size, step = w2s.fft_size, w2s.step_size
+    if gain is None:
+        gain = w2s.audio_gain(fft_size)
+    starts = np.round(np.asarray(offsets, dtype=np.float64) * rate).astype(np.int64)
+    magnitudes = (np.power(10., pr.to_linear_specgram(np.reshape(tile, (len(tile), -1)), frontend, rate=rate))
+                  for tile in tiles)
+    invert = lambda mags, phase=None: w2s.iterate_invert_spectrogram(mags, fft_size, step, n_iter=n_iter, phase=phase)
+    if domain == "time":
+        phases = itertools.repeat(None) if phases is None else phases
+        audio = crossfade_pieces(((start, invert(mags, phase)) for start, mags, phase in zip(starts, magnitudes, phases)),
+                                 int(fade * rate))
+    else:
+        stitched = crossfade_pieces(zip(w2s.frame_offsets(starts, step), magnitudes), int(fade * rate / step))
+        blocks = spec_blocks(stitched, block_frames, block_overlap)
+        audio = crossfade_pieces(((first * step, invert(block)) for first, block in blocks), int(fade * rate))
+
+    first = 0 if from_song_start or len(starts) == 0 else starts[0]
+    with WavWriter(path, rate=rate, dtype=dtype) as out:
+        for start, chunk in audio:
+            out.write_at(start - first, chunk * gain)
+        return out.n_samples
@@ -0,0 +1,140 @@
+'''
+tag_catalog.py
+
+tagfiles (tagforfitting.txt, tag_evalset_manual.txt, ...) compiled once into a catalog:
+exact song name --> (n_ranges, 2) int32 array of voice ranges in secs
+
+    --------------tagfile.txt----------------
+    wavname1.wav 10-11,20-50
+    wavname1_1.wav 0-50
+    -----------------------------------------
+
+the tagfile is validated while compiling (ValueError with file:line on bad lines),
+and the compiled catalog is cached next to it as <tagfile>.catalog.npz, rebuilt
+whenever the tagfile content changes.
+
+'''
+
+import os
+import hashlib
+import numpy as np
+
+
+class TagCatalog(object):
+    def __init__(self, names, bounds, ranges):
+        #ranges of song k are ranges[bounds[k]:bounds[k+1]]
+        self.names = list(names)
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        self.ranges = np.asarray(ranges, dtype=np.int32).reshape(-1, 2)
+        self.index = dict((name, k) for k, name in enumerate(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __getitem__(self, name):
+        k = self.index[name]
+        return self.ranges[self.bounds[k]:self.bounds[k + 1]]
+
+    def ranges_of(self, name):
+        #list of (start, end) tuples like preprocess.tag2range() always returned, [] for untagged songs
+        if name not in self.index:
+            return []
+        return [tuple(int(sec) for sec in voice_range) for voice_range in self[name]]
+
+    def window_plan(self, st_size):
+        #window start points (secs) of every song in one vectorized pass:
+        #name --> [starts of its 1st range, starts of its 2nd range, ...]
+        per_range = plan_per_range(self.ranges, st_size)
+        return dict((name, per_range[self.bounds[k]:self.bounds[k + 1]]) for k, name in enumerate(self.names))
+
+
+def range_counts(ranges, st_size):
+    #number of windows np.arange(start, end, st_size) gives for each range
+    ranges = np.asarray(ranges, dtype=np.float64).reshape(-1, 2)
+    return np.maximum(np.ceil((ranges[:, 1] - ranges[:, 0]) / st_size), 0).astype(np.int64)
+
+def plan_ranges(ranges, st_size):
+    #np.arange(start, end, st_size) of all ranges, concatenated
+    ranges = np.asarray(ranges, dtype=np.float64).reshape(-1, 2)
+    counts = range_counts(ranges, st_size)
+    first = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(ranges[:, 0], counts) + st_size * (np.arange(counts.sum()) - first)
+
+def plan_per_range(ranges, st_size):
+    #plan_ranges() split back into one array per range
+    if len(ranges) == 0:
+        return []
+    return np.split(plan_ranges(ranges, st_size), np.cumsum(range_counts(ranges, st_size))[:-1])
+
+
+def parse_tagfile(tagfilepath):
+    #validated {name: [(start, end), ...]}
+    songs = {}
+    with open(tagfilepath) as tagfile:
+        for line_no, line in enumerate(tagfile, 1):
+            line = line.strip()
+            if not line:
+                continue
+            where = "{path}:{line_no}".format(path=tagfilepath, line_no=line_no)
+            fields = line.split()
+            if len(fields) != 2:
+                raise ValueError("{where}: expected 'name.wav start-end,start-end,...', got {line!r}".format(where=where, line=line))
+            name, dash_sep_list = fields
+            if name in songs:
+                raise ValueError("{where}: {name} is tagged twice".format(where=where, name=name))
+            ranges = []
+            for dash_sep in dash_sep_list.rstrip(",").split(","):
+                try:
+                    start, end = [int(sec) for sec in dash_sep.split("-")]
+                except ValueError:
+                    raise ValueError("{where}: bad range {r!r}".format(where=where, r=dash_sep))
+                if not 0 <= start < end:
+                    raise ValueError("{where}: range {r!r} is empty or negative".format(where=where, r=dash_sep))
+                if ranges and start < ranges[-1][1]:
+                    raise ValueError("{where}: range {r!r} overlaps or precedes the one before".format(where=where, r=dash_sep))
+                ranges.append((start, end))
+            songs[name] = ranges
+    return songs
+
+def compile_tagfile(tagfilepath):
+    songs = parse_tagfile(tagfilepath)
+    names = sorted(songs)
+    counts = [len(songs[name]) for name in names]
+    ranges = [voice_range for name in names for voice_range in songs[name]]
+    return TagCatalog(names, np.concatenate(([0], np.cumsum(counts))), ranges)
+
+
+def tagfile_hash(tagfilepath):
+    with open(tagfilepath, "rb") as tagfile:
+        return hashlib.sha1(tagfile.read()).hexdigest()
+
+_loaded = {}
+
+def load_catalog(tagfilepath, cache_path=None):
+    #compiled catalog of tagfilepath: from memory while the tagfile is untouched, else from
+    #cache_path (default <tagfile>.catalog.npz) if it was compiled from the same content,
+    #else compiled (and cached) again
+    stat = os.stat(tagfilepath)
+    loaded = _loaded.get(tagfilepath)
+    if loaded is not None and loaded[0] == (stat.st_size, stat.st_mtime):
+        return loaded[1]
+
+    sha = tagfile_hash(tagfilepath)
+    if cache_path is None:
+        cache_path = tagfilepath + ".catalog.npz"
+    catalog = None
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as cached:
+            if str(cached["source_sha1"]) == sha:
+                catalog = TagCatalog(cached["names"], cached["bounds"], cached["ranges"])
+    if catalog is None:
+        catalog = compile_tagfile(tagfilepath)
+        with open(cache_path + ".tmp", "wb") as f:
+            np.savez(f, names=np.array(catalog.names, dtype=np.str_), bounds=catalog.bounds,
+                     ranges=catalog.ranges, source_sha1=np.array(sha))
+        os.replace(cache_path + ".tmp", cache_path)
+    _loaded[tagfilepath] = ((stat.st_size, stat.st_mtime), catalog)
+    return catalog
@@ -1,33 +1,35 @@
 ###### locate this script with its dependencies
-###### preprocess.py , wav2spec.py
+###### preprocess.py , wav2spec.py, tile_store.py
 ###### need to be at a parent dir of data
 
 # test generate_concat_npyfile()
 # autorun test_writespecgram.py to confirm
 import os
 import preprocess as pr
+import tile_store
 import numpy as np
-from glob import glob
 
 data_dir="bolbbalgan4_test/"
 tagname="tagforfitting.txt"
+n_images=4      #tiles written out as jpgs
 
-npyfiles_list=glob("{data_dir}/*npy".format(data_dir=data_dir))
-print("\nnum of npyfiles {}".format(len(npyfiles_list)))
+#tiles are in the tile store at data_dir/tiles now, not in one npy file per tile
+store_dir=os.path.join(data_dir, "tiles")
+store=tile_store.open_store(store_dir)
+print("\nnum of tiles {}".format(len(store) if store is not None else 0))
 
-if len(npyfiles_list) ==0: pr.generate_concat_npyfile( songdir = data_dir, 
+if store is None:
+    pr.generate_concat_npyfile( songdir = data_dir,
                             tagfilepath= os.path.join(data_dir,tagname) )
+    store=tile_store.load_store(store_dir)
 
-for file in npyfiles_list:
-    test_ndarray=np.load(file)
+for row in range(min(n_images, len(store))):
+    test_ndarray=store.tile(row)
     print(test_ndarray.shape)
-    test21=test_ndarray.reshape((2048,1024))
-    test12=test_ndarray.reshape((1024,2048))
-    test_vo=test_ndarray[:,:,0].reshape((1024,1024))
-    test_en=test_ndarray[:,:,1].reshape((1024,1024))
+    test_vo=test_ndarray[:,:,0]
+    test_en=test_ndarray[:,:,1]
 
-    pr.write_specgram_img(test_vo, "{filepath}_vo.jpg".format(filepath=file))
-    pr.write_specgram_img(test_en, "{filepath}_en.jpg".format(filepath=file))
-# failed below
-#    pr.write_specgram_img(test12, "{filepath}_both12_.jpg".format(filepath=file))
-#    pr.write_specgram_img(test21, "{filepath}_both21_.jpg".format(filepath=file))
\ No newline at end of file
+    name=os.path.join(data_dir, str(store.ids[row]))
+    pr.write_specgram_img(test_vo, "{filepath}_vo.jpg".format(filepath=name))
+    pr.write_specgram_img(test_en, "{filepath}_en.jpg".format(filepath=name))
+store.close()
@@ -0,0 +1,5 @@
+#the modules of model_code are flat and import each other by name (import wav2spec as w2s, ...)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
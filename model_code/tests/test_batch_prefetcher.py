@@ -0,0 +1,104 @@
+import threading
+import time
+import pytest
+from batch_prefetcher import BatchPrefetcher
+
+
+def wait_for(condition, timeout=5.0):
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_batches_in_order():
+    with BatchPrefetcher(lambda spec: spec * 2, range(20), depth=3, n_threads=4) as batches:
+        assert list(batches) == [2 * k for k in range(20)]
+        assert batches.stats()["batches"] == 20
+        with pytest.raises(StopIteration):
+            batches.get()
+
+
+def test_at_most_depth_batches_loaded():
+    loaded = []
+    batches = BatchPrefetcher(lambda spec: loaded.append(spec) or spec, range(10), depth=3, n_threads=2)
+    try:
+        assert wait_for(lambda: len(loaded) == 3)
+        time.sleep(0.3)
+        assert len(loaded) == 3         #nothing taken yet: depth batches, not one more
+        assert batches.get() == 0
+        assert wait_for(lambda: len(loaded) == 4)
+        time.sleep(0.3)
+        assert len(loaded) == 4
+    finally:
+        batches.close()
+
+
+def test_load_error_is_raised_by_get():
+    def load(spec):
+        if spec == 3:
+            raise KeyError(spec)
+        return spec
+    batches = BatchPrefetcher(load, range(10), depth=2)
+    assert [batches.get() for _ in range(3)] == [0, 1, 2]
+    with pytest.raises(KeyError):
+        batches.get()
+    with pytest.raises(StopIteration):     #loading stopped with the error
+        batches.get()
+    assert not batches._feeder.is_alive()
+
+
+def test_specs_error_is_raised_by_get():
+    def specs():
+        yield 0
+        raise ValueError("bad specs")
+    with BatchPrefetcher(lambda spec: spec, specs()) as batches:
+        assert batches.get() == 0
+        with pytest.raises(ValueError):
+            batches.get()
+
+
+def test_close_stops_loading():
+    n_threads = threading.active_count()
+    batches = BatchPrefetcher(lambda spec: spec, range(1000), depth=2, n_threads=2)
+    assert batches.get() == 0
+    batches.close()
+    batches.close()         #idempotent
+    assert not batches._feeder.is_alive()
+    assert wait_for(lambda: threading.active_count() <= n_threads)
+
+
+def test_with_block_closes_on_error():
+    with pytest.raises(RuntimeError):
+        with BatchPrefetcher(lambda spec: spec, range(1000), depth=2) as batches:
+            batches.get()
+            raise RuntimeError("training step failed")
+    assert not batches._feeder.is_alive()
+
+
+def test_bad_depth():
+    with pytest.raises(ValueError):
+        BatchPrefetcher(lambda spec: spec, [], depth=0)
+
+
+def test_get_after_close_stops():
+    batches = BatchPrefetcher(lambda spec: spec, range(1000), depth=2)
+    assert batches.get() == 0
+    batches.close()
+    with pytest.raises(StopIteration):
+        batches.get()
+    assert list(batches) == []
+
+
+def test_close_from_another_thread_wakes_get():
+    def load(spec):
+        if spec == 1:
+            time.sleep(2)       #the second batch takes long, get() waits for it
+        return spec
+    batches = BatchPrefetcher(load, range(5), depth=1, n_threads=1)
+    assert batches.get() == 0
+    threading.Timer(0.2, batches.close).start()
+    start = time.time()
+    with pytest.raises(StopIteration):
+        batches.get()
+    assert time.time() - start < 1.5
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import filterbank as fb
+
+
+def loop_mel_filterbank(nfilt, NFFT, sample_rate):
+    #the filter by filter, bin by bin loop of specgram_misc/specgram_gen.py
+    high_freq_mel = (2595 * np.log10(1 + (sample_rate / 2) / 700))
+    mel_points = np.linspace(0, high_freq_mel, nfilt + 2)
+    hz_points = (700 * (10**(mel_points / 2595) - 1))
+    bin = np.floor((NFFT + 1) * hz_points / sample_rate)
+    fbank = np.zeros((nfilt, int(np.floor(NFFT / 2 + 1))))
+    for m in range(1, nfilt + 1):
+        f_m_minus, f_m, f_m_plus = int(bin[m - 1]), int(bin[m]), int(bin[m + 1])
+        for k in range(f_m_minus, f_m):
+            fbank[m - 1, k] = (k - bin[m - 1]) / (bin[m] - bin[m - 1])
+        for k in range(f_m, f_m_plus):
+            fbank[m - 1, k] = (bin[m + 1] - k) / (bin[m + 1] - bin[m])
+    return fbank
+
+
+@pytest.mark.parametrize("nfilt, NFFT, sample_rate", [(40, 512, 16000), (256, 2048, 44100), (1024, 1024, 44100)])
+def test_mel_filterbank_matches_loop(nfilt, NFFT, sample_rate):
+    #(1024, 1024) has many filters narrower than a bin
+    bank = fb.mel_filterbank(nfilt, NFFT, sample_rate)
+    assert bank.shape == (nfilt, NFFT // 2 + 1)
+    np.testing.assert_allclose(bank.toarray(), loop_mel_filterbank(nfilt, NFFT, sample_rate), rtol=1e-12, atol=1e-12)
+    assert fb.mel_filterbank(nfilt, NFFT, sample_rate) is bank      #cached
+
+
+def test_apply_filterbank_drops_missing_bins():
+    bank = fb.mel_filterbank(40, 512, 16000)
+    spec = np.random.RandomState(0).rand(3, 5, 256)     #one-sided, no nyquist bin
+    np.testing.assert_allclose(fb.apply_filterbank(bank, spec), spec.dot(bank.toarray()[:, :256].T), rtol=1e-12)
+
+
+@pytest.mark.parametrize("kind", ["mel", "logfreq"])
+def test_frontend_banks(kind):
+    analysis, synthesis = fb.frontend_banks(kind, 64, 2048, 44100)
+    assert analysis.shape == (64, 1025) and synthesis.shape == (1025, 64)
+    np.testing.assert_allclose(np.asarray(analysis.sum(axis=1)).ravel(), 1, rtol=1e-5)   #band means, none empty
+    flat = np.full((2, 1024), 0.25, dtype=np.float32)
+    bands = fb.apply_filterbank(analysis, flat)
+    np.testing.assert_allclose(bands, 0.25, rtol=1e-4)
+    covered = np.asarray(synthesis.sum(axis=1)).ravel()[:1024] > 0
+    np.testing.assert_allclose(fb.apply_filterbank(synthesis, bands)[:, :1024][:, covered], 0.25, rtol=1e-4)
@@ -0,0 +1,71 @@
+import os
+import numpy as np
+import pytest
+from scipy.io import wavfile
+import prep_cache
+import tile_store
+
+
+def small_store(store_dir, ids):
+    store = tile_store.create(str(store_dir), ids=ids, song=np.zeros(len(ids)), offsets=np.zeros(len(ids)),
+                              songs=["a.wav"], tile_shape=(4, 3, 2))
+    store.close()
+    return tile_store.load_store(str(store_dir))
+
+
+def test_fetch_computes_once(tmp_path):
+    cache = prep_cache.PrepCache(str(tmp_path / "cache"))
+    calls = []
+    compute = lambda: calls.append(1) or np.arange(5)
+    np.testing.assert_array_equal(cache.fetch("pcm", "k", compute), np.arange(5))
+    np.testing.assert_array_equal(cache.fetch("pcm", "k", compute), np.arange(5))
+    assert len(calls) == 1
+
+
+def test_is_built_follows_manifest(tmp_path):
+    keys = {"tiles": "t1", "v": [{"pcm": "p1"}], "o": [{"pcm": "p2"}]}
+    store = small_store(tmp_path / "tiles", [0, 1, 2])
+    cache = prep_cache.PrepCache(str(tmp_path / "cache"))
+    assert not cache.is_built("a.wav", keys, store)         #never built
+    cache.record_song("a.wav", keys, [0, 1, 2])
+    cache.save()
+
+    cache = prep_cache.PrepCache(str(tmp_path / "cache"))  #manifest read back
+    assert cache.is_built("a.wav", keys, store)
+    assert not cache.is_built("a.wav", dict(keys, tiles="t2"), store)      #parameters changed
+    assert not cache.is_built("a.wav", keys, None)                          #no store
+    assert not cache.is_built("a.wav", keys, small_store(tmp_path / "other", [0, 1]))    #tile missing
+    cache.forget_song("a.wav")
+    assert not cache.is_built("a.wav", keys, store)
+
+
+def test_prune_keeps_used_levels(tmp_path):
+    cache = prep_cache.PrepCache(str(tmp_path / "cache"))
+    cache.store("pcm", "used", np.zeros(2))
+    cache.store("spec", "stale", np.zeros(2))
+    cache.record_song("a.wav", {"tiles": "t", "v": [{"pcm": "used"}], "o": []}, [0])
+    cache.prune()
+    assert os.path.exists(cache.path("pcm", "used"))
+    assert not os.path.exists(cache.path("spec", "stale"))
+
+
+def test_unchanged_rebuild_is_a_no_op(tmp_path):
+    pytest.importorskip("matplotlib")       #preprocess plots spectrograms
+    import preprocess as pr
+    rng = np.random.RandomState(0)
+    for name in ("vo_a.wav", "a.wav"):
+        wavfile.write(str(tmp_path / name), 44100, (rng.randn(44100 * 6) * 3000).astype(np.int16))
+    (tmp_path / "tag.txt").write_text(u"a.wav 0-5\n")
+    build = lambda: pr.generate_concat_npyfile(str(tmp_path), tagfilepath=str(tmp_path / "tag.txt"),
+                                               cache_dir=str(tmp_path / "cache"), n_workers=1)
+    build()
+    store_dir = str(tmp_path / "tiles")
+    shard = os.path.join(store_dir, "shard_00000.npy")
+    before = (os.stat(store_dir).st_ino, os.stat(shard).st_mtime_ns)
+    n_tiles = len(tile_store.load_store(store_dir))
+    assert n_tiles > 0
+
+    build()
+    assert (os.stat(store_dir).st_ino, os.stat(shard).st_mtime_ns) == before
+    assert not os.path.exists(store_dir + ".building")
+    assert len(tile_store.load_store(store_dir)) == n_tiles
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+stitch = pytest.importorskip("stitch", exc_type=ImportError)     #through preprocess, which needs matplotlib
+
+
+def stitched(pieces, fade):
+    #crossfade_pieces() output as {sample: value}, checking its chunks neither overlap nor go back
+    out, last_end = {}, None
+    for start, chunk in stitch.crossfade_pieces(pieces, fade):
+        assert last_end is None or start >= last_end
+        out.update((start + k, value) for k, value in enumerate(chunk))
+        last_end = start + len(chunk)
+    return out
+
+
+def test_fade_in_pairs_sum_to_one():
+    for n in (1, 2, 7, 64):
+        np.testing.assert_allclose(stitch.fade_in(n) + stitch.fade_in(n)[::-1], 1.0)
+
+
+@pytest.mark.parametrize("fade", [0, 10, 40, 1000])
+def test_crossfade_weights_sum_to_one(fade):
+    #pieces of ones every 50 samples, 200 long: the weights of every covered sample add up to 1
+    pieces = [(start, np.ones(200)) for start in range(0, 500, 50)]
+    out = stitched(pieces, fade)
+    assert sorted(out) == list(range(0, 650))
+    np.testing.assert_allclose([out[k] for k in range(650)], 1.0)
+
+
+def test_crossfade_leaves_gaps():
+    out = stitched([(0, np.ones(100)), (60, np.ones(100)), (300, np.ones(50))], 20)
+    assert sorted(out) == list(range(160)) + list(range(300, 350))
+    np.testing.assert_allclose(list(out.values()), 1.0)
+
+
+def test_crossfade_frames():
+    #2d pieces (frames, bins) are weighted per frame
+    pieces = [(start, np.ones((30, 4))) for start in (0, 10, 20)]
+    out = stitched(pieces, 8)
+    assert sorted(out) == list(range(50))
+    np.testing.assert_allclose(np.array([out[k] for k in range(50)]), 1.0)
+
+
+@pytest.mark.parametrize("fade", [16, 1000])
+def test_crossfade_irregular_starts(fade):
+    starts = [0, 37, 41, 120, 121, 200]
+    out = stitched([(start, np.ones(90)) for start in starts], fade)
+    assert sorted(out) == list(range(290))
+    np.testing.assert_allclose([out[k] for k in range(290)], 1.0)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+import tag_catalog
+
+
+def write_tagfile(tmp_path, text):
+    path = tmp_path / "tag.txt"
+    path.write_text(text)
+    return str(path)
+
+
+def test_parse_tagfile(tmp_path):
+    path = write_tagfile(tmp_path, "a.wav 0-6,9-15,\n\nb.wav 2-5\n")
+    assert tag_catalog.parse_tagfile(path) == {"a.wav": [(0, 6), (9, 15)], "b.wav": [(2, 5)]}
+
+
+@pytest.mark.parametrize("text, line_no, message", [
+    ("a.wav 0-6\nb.wav\n", 2, "expected"),
+    ("a.wav 0-6\na.wav 7-9\n", 2, "tagged twice"),
+    ("a.wav 0-x\n", 1, "bad range"),
+    ("a.wav 0-1-2\n", 1, "bad range"),
+    ("a.wav 6-6\n", 1, "empty or negative"),
+    ("a.wav 5-9,2-4\n", 1, "overlaps or precedes"),
+])
+def test_parse_tagfile_rejects(tmp_path, text, line_no, message):
+    path = write_tagfile(tmp_path, text)
+    with pytest.raises(ValueError) as error:
+        tag_catalog.parse_tagfile(path)
+    assert "{path}:{line_no}:".format(path=path, line_no=line_no) in str(error.value)
+    assert message in str(error.value)
+
+
+def test_catalog_lookup_and_plan(tmp_path):
+    catalog = tag_catalog.load_catalog(write_tagfile(tmp_path, "a.wav 0-6,9-15\nb.wav 2-5\n"))
+    assert len(catalog) == 2 and "a.wav" in catalog and "a" not in catalog
+    assert catalog.ranges_of("a.wav") == [(0, 6), (9, 15)] and catalog.ranges_of("c.wav") == []
+    plan = catalog.window_plan(3)
+    for name in ("a.wav", "b.wav"):
+        expected = [np.arange(start, end, 3) for start, end in catalog.ranges_of(name)]
+        assert len(plan[name]) == len(expected)
+        for got, want in zip(plan[name], expected):
+            np.testing.assert_array_equal(got, want)
@@ -0,0 +1,132 @@
+import numpy as np
+import pytest
+import tile_store
+import wav2spec as w2s
+
+tile_shape = (8, 6, 2)
+frontend = {"kind": "linear", "n_bins": 6, "fft_size": 16}     #phase of a tile: (8, fft_size//2)
+
+
+def make_store(store_dir, n=7, fmt="float32", phase=None, seed=0):
+    #n random tiles in [-4, 0] over shards of 3 --> (store, tiles, phases)
+    rng = np.random.RandomState(seed)
+    tiles = rng.uniform(-w2s.spec_thresh, 0, (n,) + tile_shape).astype(np.float32)
+    phases = rng.uniform(-np.pi, np.pi, (n,) + tile_store.phase_shape(tile_shape, frontend))
+    store = tile_store.create(str(store_dir), ids=np.arange(n) + 10000, song=np.ones(n), offsets=0.5 * np.arange(n),
+                              songs=["a.wav", "b.wav"], tile_shape=tile_shape, fmt=fmt, value_range=(-w2s.spec_thresh, 0),
+                              shard_size=3, frontend=frontend, phase=phase)
+    store.write(0, tiles[:4])       #spans two shards
+    store.write(4, tiles[4:])
+    if phase is not None:
+        store.write_phase(0, phases)
+    store.close()
+    return tile_store.load_store(str(store_dir)), tiles, phases
+
+
+def test_float32_round_trip(tmp_path):
+    store, tiles, _ = make_store(tmp_path / "tiles")
+    assert len(store) == 7 and store.n_shards() == 3
+    assert store.rows[10004] == 4
+    np.testing.assert_array_equal(store.tiles([5, 0, 3]), tiles[[5, 0, 3]])
+    np.testing.assert_array_equal(store.tile(6), tiles[6])
+    np.testing.assert_array_equal(store.offsets, 0.5 * np.arange(7))
+    assert store.frontend == frontend
+
+
+@pytest.mark.parametrize("fmt", ["uint16", "uint8"])
+def test_quantized_round_trip(tmp_path, fmt):
+    store, tiles, _ = make_store(tmp_path / "tiles", fmt=fmt)
+    back = store.tiles(range(7))
+    assert back.dtype == np.float32
+    error = np.abs(back - tiles).max()
+    assert error <= store.header["error_bound"] + 1e-6
+    assert store.raw_tile(0).dtype == np.dtype(fmt)
+
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma"])
+def test_compressed_round_trip(tmp_path, codec):
+    store, tiles, phases = make_store(tmp_path / "tiles", fmt="uint16", phase="mix")
+    packed = tile_store.compress_store(store, str(tmp_path / "packed"), codec=codec)
+    assert packed.compressed and packed.codec == codec
+    np.testing.assert_array_equal(packed.tiles([6, 2, 4]), store.tiles([6, 2, 4]))
+    np.testing.assert_array_equal(packed.phases([1, 5]), store.phases([1, 5]))
+    with pytest.raises(ValueError):
+        packed.write(0, tiles[:1])
+
+
+def test_phases(tmp_path):
+    store, _, phases = make_store(tmp_path / "tiles", phase="voice")
+    assert store.phase_track == "voice"
+    stored = store.phases([4, 1])
+    assert stored.dtype == np.uint8 and stored.shape == (2, 8, 8)
+    np.testing.assert_array_equal(stored, w2s.quantize_phase(phases[[4, 1]]))
+    #uint8 steps are 2pi/256, the error is at most half of one (on the circle)
+    diff = np.angle(np.exp(1j * (w2s.dequantize_phase(stored) - phases[[4, 1]])))
+    assert np.abs(diff).max() <= np.pi / 256 + 1e-6
+
+
+def test_no_phase(tmp_path):
+    store, _, _ = make_store(tmp_path / "tiles")
+    assert store.phase_track is None
+    with pytest.raises(ValueError):
+        store.phases([0])
+
+
+def test_open_store(tmp_path):
+    assert tile_store.open_store(str(tmp_path / "missing")) is None
+    make_store(tmp_path / "tiles")
+    assert isinstance(tile_store.open_store(str(tmp_path / "tiles")), tile_store.TileStore)
+
+
+def test_publish_replaces_store(tmp_path):
+    store_dir = str(tmp_path / "tiles")
+    old, _, _ = make_store(store_dir, n=4)
+    old.close()
+    new, tiles, _ = make_store(store_dir + ".building", n=7, seed=1)
+    new.close()
+    tile_store.publish(store_dir + ".building", store_dir)
+    store = tile_store.open_store(store_dir)
+    assert len(store) == 7
+    np.testing.assert_array_equal(store.tiles(np.arange(7)), tiles)
+    assert not (tmp_path / "tiles.old").exists() and not (tmp_path / "tiles.building").exists()
+
+
+def test_open_store_recovers_interrupted_publish(tmp_path):
+    #crash after the old store was renamed aside, before the new one was renamed in
+    old, tiles, _ = make_store(tmp_path / "tiles.old", n=4)
+    old.close()
+    store = tile_store.open_store(str(tmp_path / "tiles"))
+    assert len(store) == 4
+    np.testing.assert_array_equal(store.tiles(np.arange(4)), tiles)
+
+
+def test_virtual_tiles_match_cut_tiles(tmp_path):
+    #tiles cut at load time == the tiles cut_spectrogram_tiles() materializes out of each range spectrogram
+    rng = np.random.RandomState(2)
+    n_frames, norm_frames = [20, 14], [10, 10]      #tiles near the end of a range see fewer norm frames
+    frames = [np.array([0, 3, 12]), np.array([0, 2, 6])]
+    ranges = {"song": np.array([0, 1]), "rate": np.array([22050, 22050]), "start": np.array([0, 2]),
+              "end": np.array([6, 5]), "span_start": np.array([0, 0]), "n_samples": np.array([10**5, 10**5]),
+              "first_frame": np.array([0, n_frames[0]]), "n_frames": np.array(n_frames), "norm_frames": np.array(norm_frames)}
+    index = {"ids": np.array([0, 1, 2, 10000, 10001, 10002]), "song": np.array([0, 0, 0, 1, 1, 1]),
+             "offsets": np.zeros(6), "range": np.array([0, 0, 0, 1, 1, 1]), "frame": np.concatenate(frames)}
+    store = tile_store.create_virtual(str(tmp_path / "tiles"), index, ranges, ["a.wav", "b.wav"], tile_shape=tile_shape,
+                                      thresh=w2s.spec_thresh, win_size=4, frontend=frontend, phase="voice")
+    expected, expected_phase = [], []
+    for r in range(2):
+        specs = rng.uniform(1e-3, 10, (2, n_frames[r], tile_shape[1])).astype(np.float32)
+        phase = rng.randint(0, 256, (n_frames[r],) + tile_store.phase_shape(tile_shape, frontend)[1:]).astype(np.uint8)
+        store.write_range(r, specs[0], specs[1], phase=phase)
+        expected.append(np.stack([w2s.cut_spectrogram_tiles(spec, frames[r], tile_shape[0], norm_frames[r],
+                                                            thresh=w2s.spec_thresh) for spec in specs], axis=-1))
+        expected_phase.append(w2s.cut_phase_tiles(phase, frames[r], tile_shape[0]))
+    store.close()
+    expected, expected_phase = np.concatenate(expected), np.concatenate(expected_phase)
+
+    store = tile_store.load_store(str(tmp_path / "tiles"))
+    assert isinstance(store, tile_store.VirtualTileStore) and len(store) == 6
+    rows = np.array([4, 0, 5, 2, 1, 3])
+    np.testing.assert_allclose(store.tiles(rows), expected[rows], rtol=1e-6, atol=1e-6)
+    np.testing.assert_allclose(store.tile(2), expected[2], rtol=1e-6, atol=1e-6)
+    np.testing.assert_array_equal(store.phases(rows), expected_phase[rows])
+    store.close()
@@ -0,0 +1,51 @@
+import pytest
+from update_scheduler import UpdateScheduler
+
+
+def test_fixed_one_to_one_runs_both():
+    scheduler = UpdateScheduler("fixed")
+    assert [scheduler.plan() for _ in range(3)] == [("d", "g")] * 3
+
+
+def test_fixed_four_to_one():
+    scheduler = UpdateScheduler("fixed", n_d=4, n_g=1)
+    plans = [scheduler.plan() for _ in range(8)]
+    assert plans == [("d", "g"), ("d",), ("d",), ("d",)] * 2
+    assert scheduler.ran == {"d": 8, "g": 2}
+    assert scheduler.skipped == {"d": 0, "g": 0}
+
+
+def test_fixed_ignores_losses():
+    scheduler = UpdateScheduler("fixed", d_low=0.5, d_high=2.5)
+    scheduler.observe(0.1, 1.0)
+    assert scheduler.plan() == ("d", "g")
+
+
+def test_adaptive_skips_on_d_loss():
+    scheduler = UpdateScheduler("adaptive", d_low=0.5, d_high=2.5)
+    assert scheduler.plan() == ("d", "g")      #nothing observed yet
+    scheduler.observe(0.3, 1.0)                 #discriminator winning
+    assert scheduler.plan() == ("g",)
+    assert scheduler.log_line() == "D skipped (d_loss 0.30 < 0.50), G ran"
+    scheduler.observe(3.0, 1.0)                 #discriminator losing
+    assert scheduler.plan() == ("d",)
+    assert scheduler.log_line() == "D ran, G skipped (d_loss 3.00 > 2.50)"
+    scheduler.observe(1.4, 1.0)
+    assert scheduler.plan() == ("d", "g")
+    assert scheduler.ran == {"d": 3, "g": 3}
+    assert scheduler.skipped == {"d": 1, "g": 1}
+    assert "D 3 ran / 1 skipped" in scheduler.summary()
+
+
+def test_adaptive_skips_within_the_fixed_plan():
+    scheduler = UpdateScheduler("adaptive", n_d=1, n_g=2, d_low=0.5, d_high=2.5)
+    scheduler.observe(0.1, 1.0)
+    assert [scheduler.plan() for _ in range(2)] == [("g",), ("g",)]
+    assert scheduler.skipped == {"d": 1, "g": 0}
+
+
+@pytest.mark.parametrize("kwargs", [{"mode": "sometimes"}, {"n_d": 0}, {"n_g": 0},
+                                    {"mode": "adaptive", "d_low": 2.0, "d_high": 1.0}])
+def test_bad_settings(kwargs):
+    with pytest.raises(ValueError):
+        UpdateScheduler(**kwargs)
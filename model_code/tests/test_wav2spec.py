@@ -0,0 +1,135 @@
+import numpy as np
+import pytest
+import wav2spec as w2s
+
+
+def loop_stft(X, fftsize, step):
+    #the per-frame stft wav2spec had before the strided framing (zero pad, slice frame by frame, window, fft)
+    X = X - X.mean()
+    X = np.hstack((X, np.zeros(fftsize - len(X) % fftsize)))
+    n_frames = (len(X) - fftsize) // step
+    frames = np.ndarray((n_frames, fftsize), dtype=X.dtype)
+    for i in range(n_frames):
+        frames[i] = X[i * step:i * step + fftsize]
+    win = 0.54 - .46 * np.cos(2 * np.pi * np.arange(fftsize) / (fftsize - 1))
+    return np.fft.fft(frames * win[None])[:, :fftsize // 2]
+
+
+@pytest.mark.parametrize("n_samples", [1000, 1024, 1500])
+def test_stft_matches_frame_loop(n_samples):
+    X = np.random.RandomState(0).randn(n_samples)
+    np.testing.assert_allclose(w2s.stft(X, fftsize=128, step=32), loop_stft(X, 128, 32), rtol=1e-10, atol=1e-10)
+
+
+def test_stft_batch_matches_clip_by_clip():
+    clips = np.random.RandomState(1).randn(3, 1000)
+    batch = w2s.stft_batch(clips, fftsize=128, step=32)
+    assert batch.shape[0] == 3
+    for clip, spec in zip(clips, batch):
+        np.testing.assert_allclose(spec, loop_stft(clip, 128, 32), rtol=1e-10, atol=1e-10)
+
+
+def test_stft_leaves_input_untouched():
+    X = np.random.RandomState(2).randn(1000) + 3.0
+    before = X.copy()
+    w2s.stft(X, fftsize=128, step=32)
+    np.testing.assert_array_equal(X, before)
+
+
+def test_real_float32_path_tolerance():
+    #the documented bound of pretty_spectrogram(real=True): 1e-4 log10 units off the float64 path
+    rng = np.random.RandomState(3)
+    t = np.arange(22050) / 22050.0
+    d = np.sin(2 * np.pi * 440 * t) + 0.3 * np.sin(2 * np.pi * 3520 * t) + 1e-3 * rng.randn(len(t))
+    ref = w2s.pretty_spectrogram(d, fft_size=2048, step_size=128, thresh=4)
+    fast = w2s.pretty_spectrogram(d, fft_size=2048, step_size=128, thresh=4, real=True)
+    assert fast.dtype == np.float32 and fast.shape == ref.shape
+    assert np.abs(fast - ref).max() < 1e-4
+
+
+@pytest.mark.parametrize("shape", [(20000,), (20000, 2)])
+def test_chunked_bandpass_matches_one_shot(shape):
+    #chunks carry the sosfilt state (zi), so the seams do not show
+    from scipy.signal import sosfilt
+    data = np.random.RandomState(4).randn(*shape)
+    one_shot = w2s.butter_bandpass_filter(data, w2s.lowcut, w2s.highcut, 44100, order=3)
+    chunked = w2s.butter_bandpass_filter(data, w2s.lowcut, w2s.highcut, 44100, order=3, chunk_size=3001)
+    assert chunked.dtype == np.float32
+    np.testing.assert_array_equal(chunked, one_shot)
+    sos = w2s.butter_bandpass(w2s.lowcut, w2s.highcut, 44100, order=3, output='sos')
+    np.testing.assert_allclose(chunked, sosfilt(sos, data, axis=0), rtol=1e-3, atol=1e-3)
+
+
+def loop_invert_spectrogram(X_s, step, calculate_offset=True, set_zero_phase=True):
+    #frame by frame invert_spectrogram() of the MATLAB port, before the overlap-add was vectorized
+    size = int(X_s.shape[1] // 2)
+    wave = np.zeros((X_s.shape[0] * step + size))
+    total_windowing_sum = np.zeros((X_s.shape[0] * step + size))
+    win = 0.54 - .46 * np.cos(2 * np.pi * np.arange(size) / (size - 1))
+    est_start = int(size // 2) - 1
+    est_end = est_start + size
+    for i in range(X_s.shape[0]):
+        wave_start = int(step * i)
+        wave_end = wave_start + size
+        spectral_slice = X_s[i].real + 0j if set_zero_phase else X_s[i]
+        wave_est = np.real(np.fft.ifft(spectral_slice))[::-1]
+        offset = 0
+        if calculate_offset and i > 0:
+            offset_size = size - step
+            offset = w2s.xcorr_offset(wave[wave_start:wave_start + offset_size], wave_est[est_start:est_start + offset_size])
+        wave[wave_start:wave_end] += win * wave_est[est_start - offset:est_end - offset]
+        total_windowing_sum[wave_start:wave_end] += win
+    return np.real(wave) / (total_windowing_sum + 1E-6)
+
+
+@pytest.mark.parametrize("step", [32, 48])       #48 does not divide the frame size: scatter-add path
+@pytest.mark.parametrize("calculate_offset", [True, False])
+@pytest.mark.parametrize("set_zero_phase", [True, False])
+def test_invert_spectrogram_matches_loop(step, calculate_offset, set_zero_phase):
+    X = np.random.RandomState(5).randn(3000)
+    X_s = w2s.stft(X, fftsize=256, step=step, compute_onesided=False)
+    np.testing.assert_allclose(w2s.invert_spectrogram(X_s, step, calculate_offset, set_zero_phase),
+                               loop_invert_spectrogram(X_s, step, calculate_offset, set_zero_phase), rtol=1e-8, atol=1e-8)
+
+
+def chirp_magnitudes():
+    #a tone and a chirp, 1s at 8kHz --> (signal, full mirrored magnitudes, one-sided stft)
+    t = np.arange(8000) / 8000.
+    x = np.sin(2 * np.pi * 440 * t) + 0.5 * np.sin(2 * np.pi * 1230 * t * (1 + t))
+    X_s = np.abs(w2s.stft(x, fftsize=256, step=64, compute_onesided=False, mean_normalize=False))
+    return x, X_s, w2s.stft(x, fftsize=256, step=64, real=True, mean_normalize=False)
+
+
+def run_griffin_lim(X_s, **kwargs):
+    #spectral convergence of every iteration, through the callback
+    convs = []
+    w2s.iterate_invert_spectrogram(X_s, 256, 64, callback=lambda i, conv: convs.append((i, conv)), **kwargs)
+    assert [i for i, _ in convs] == list(range(len(convs)))
+    return [conv for _, conv in convs]
+
+
+def test_griffin_lim_momentum_converges_faster():
+    _, X_s, _ = chirp_magnitudes()
+    plain = run_griffin_lim(X_s, n_iter=30, momentum=0, tol=0)
+    fast = run_griffin_lim(X_s, n_iter=30, momentum=0.99, tol=0)
+    assert len(plain) == len(fast) == 30        #tol=0 always runs n_iter
+    assert fast[-1] < 0.75 * plain[-1]
+
+
+def test_griffin_lim_early_stop():
+    _, X_s, _ = chirp_magnitudes()
+    convs = run_griffin_lim(X_s, n_iter=100, tol=1e-2)
+    assert 2 <= len(convs) < 100
+    assert abs(convs[-2] - convs[-1]) < 1e-2 * convs[-2]
+    assert all(abs(a - b) >= 1e-2 * a for a, b in zip(convs[:-2], convs[1:-1]))
+
+
+def test_griffin_lim_initial_phase():
+    #with the phase the magnitudes were made with, one istft() gives the signal back (away from the ends)
+    x, X_s, X = chirp_magnitudes()
+    for phase, atol in ((np.angle(X), 1e-3), (w2s.quantize_phase(np.angle(X)), 2e-2)):
+        y = w2s.iterate_invert_spectrogram(X_s, 256, 64, n_iter=0, phase=phase)
+        n = min(len(x), len(y))
+        np.testing.assert_allclose(y[256:n - 256], x[256:n - 256], atol=atol)
+    with pytest.raises(ValueError):
+        w2s.iterate_invert_spectrogram(X_s, 256, 64, legacy=True, phase=np.angle(X))
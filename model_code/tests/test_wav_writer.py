@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+from wav_writer import WavWriter
+
+
+@pytest.mark.parametrize("dtype", ["int16", "float32"])
+def test_chunks_and_gaps(tmp_path, dtype):
+    path = str(tmp_path / "out.wav")
+    with WavWriter(path, rate=22050, dtype=dtype) as out:
+        out.write(np.full(100, 0.5))
+        out.write_at(150, np.full(10, -0.25))
+        with pytest.raises(ValueError):
+            out.write_at(100, np.zeros(1))
+    rate, samples = wavfile.read(path)
+    assert rate == 22050 and samples.dtype == np.dtype(dtype) and len(samples) == 160
+    scale = 32767 if dtype == "int16" else 1.0
+    np.testing.assert_allclose(samples[:100], 0.5 * scale, atol=1)
+    np.testing.assert_array_equal(samples[100:150], 0)
+    np.testing.assert_allclose(samples[150:], -0.25 * scale, atol=1)
+
+
+def test_int16_clips(tmp_path):
+    path = str(tmp_path / "out.wav")
+    with WavWriter(path, dtype="int16") as out:
+        out.write([2.0, -2.0])
+    np.testing.assert_array_equal(wavfile.read(path)[1], [32767, -32767])
@@ -0,0 +1,581 @@
+'''
+tile_store.py
+
+training tiles (voice/ensemble spectrogram pairs of shape (1024,1024,2)) of a dataset kept in
+a few big shard files instead of one 16MB .npy file per tile
+
+    <store_dir>/store.json          header: tile shape, format, scale/offset, shard size, song names, number of tiles,
+                                    frequency front end of the tiles (preprocess.frontend_info())
+    <store_dir>/index.npz           per tile: id (song_no*10000+piece_no), song, offset (secs into the song)
+    <store_dir>/shard_00000.npy     [shard_size,1024,1024,2] float32 (or uint8/uint16), tiles in index order
+    <store_dir>/shard_00001.npy     ...  (the last shard holds the remainder)
+
+a tile is [frames, frequency bins, voice/ensemble]: 1024x1024 for the linear front end,
+1024xN for N mel/logfreq bands. tile k is row k%shard_size of shard k//shard_size. shards are plain .npy files, so
+np.load(shard, mmap_mode='r') (utils.load_npy(shard, mmap=True)) maps them and a tile is a
+zero-copy view, e.g.
+
+    store = TileStore("bolbbalgan4/tiles")
+    tile = store.tile(0)                    # view into shard_00000.npy
+    batch = store.tiles([3, 17, 256])       # (3,1024,1024,2) float32 copy
+
+a store is laid out at once (create()) with every tile's place known in advance, filled by
+any number of processes writing their own rows, then swapped in (publish()).
+
+formats
+    float32 : tiles as they are (4 bytes per value)
+    uint16  : value = q*scale + offset, q in 0..65535 (2 bytes), error <= scale/2
+    uint8   : value = q*scale + offset, q in 0..255 (1 byte), error <= scale/2
+the quantized formats spread value_range (for our log spectrograms (-spec_thresh, 0)) over
+the integer range, values outside of it are clipped. tile()/tiles() always hand out float32
+(dequantized in one vectorized step per batch), the header keeps the worst error actually
+made while writing (max_error) next to the bound (error_bound).
+
+codecs (any format)
+    none : shards are .npy files as above
+    zlib : shard_00000.bin, ... hold one compressed chunk per tile, chunks.npz keeps the
+    lzma   byte offset/length of every tile's chunk, so one tile is read and decompressed
+           without touching its neighbours. the bytes of a tile are shuffled (all first
+           bytes of its values, then all second bytes, ...) before compressing, which
+           squeezes float32 tiles a lot better.
+compressed stores are made from a filled one (compress_store()). tiles() decompresses on a
+thread pool (zlib/lzma release the gil) and prefetch() does it in the background, e.g.
+
+    next_batch = store.prefetch(rows_1)
+    batch = next_batch.get()                # (waits if it is not there yet)
+    next_batch = store.prefetch(rows_2)     # decompressed while batch is trained on
+
+or several batches ahead on several threads, batches() (see batch_prefetcher.py)
+
+    with store.batches([rows_1, rows_2, ...], depth=4, n_threads=2) as batches:
+        for batch in batches: ...
+
+layout="virtual" (VirtualTileStore) keeps no tiles at all but the song_spectrogram() of every
+tagged voice range of both tracks, each spectrogram column once instead of ~8 times (4s tiles
+every 0.5s). a tile is a (range, frame offset) record of the index, cut out and normalized
+(wav2spec.cut_spectrogram_tiles() numerics) when it is loaded
+
+    <store_dir>/spec_v.npy, spec_o.npy      [total frames, n_bins] float32 magnitudes, range after range
+    <store_dir>/peaks_v.npy, peaks_o.npy    [total frames] max magnitude of every frame
+    <store_dir>/ranges.npz                  per range: song, rate, tag start/end (secs), span start and song length
+                                            (samples), first frame, frames, frames a tile is normalized over
+    <store_dir>/index.npz                   + range and frame offset of every tile
+
+since the tiles are cut at load time, the index can be remade for any other hop
+(preprocess.rehop_store()) without touching the spectrograms.
+use load_store() to open either layout.
+
+phase (optional, preprocess.save_phase): the stft phase of one track (voice or mix) of every tile,
+over the linear fft bins whatever the front end, quantized to uint8 (wav2spec.quantize_phase())
+and never compressed (phase is noise to zlib/lzma)
+
+    <store_dir>/phase_00000.npy     [shard_size,1024,fft_size//2] uint8, next to shard_00000 (tiles layout)
+    <store_dir>/phase.npy           [total frames, fft_size//2] uint8, next to spec_v/spec_o (virtual layout)
+
+    phase = store.phases([3, 17])           # (2,1024,1024) uint8, invert_pretty_spectrogram(phase=) takes it as is
+
+'''
+
+import os
+import json
+import zlib
+import lzma
+import shutil
+import numpy as np
+from multiprocessing.pool import ThreadPool
+import wav2spec as w2s # tile normalization of virtual stores
+from batch_prefetcher import BatchPrefetcher
+
+default_shard_size = 64         #tiles per shard (64 float32 tiles = 512MB)
+
+formats = {"float32": np.float32, "uint16": np.uint16, "uint8": np.uint8}
+
+#codec: (compress(data, level), decompress(data))
+codecs = {"zlib": (lambda data, level: zlib.compress(data, 6 if level is None else level), zlib.decompress),
+          "lzma": (lambda data, level: lzma.compress(data, preset=level), lzma.decompress)}
+
+
+def quantization(fmt, value_range=None):
+    #(scale, offset) mapping value_range onto the integer range of fmt
+    if fmt == "float32":
+        return 1.0, 0.0
+    if fmt not in formats:
+        raise ValueError("unknown tile format {fmt}, choose from {names}".format(fmt=fmt, names=sorted(formats)))
+    if value_range is None:
+        raise ValueError("{fmt} tiles need the value_range they are quantized over".format(fmt=fmt))
+    lo, hi = value_range
+    return float(hi - lo) / np.iinfo(formats[fmt]).max, float(lo)
+
+
+phase_tracks = ("voice", "mix")    #track whose phase a store can keep, channel 0 / 1 of the tiles
+
+
+def shard_path(store_dir, shard_no, codec="none"):
+    ext = "npy" if codec == "none" else "bin"
+    return os.path.join(store_dir, "shard_{no:05d}.{ext}".format(no=shard_no, ext=ext))
+
+def phase_path(store_dir, shard_no):
+    return os.path.join(store_dir, "phase_{no:05d}.npy".format(no=shard_no))
+
+def phase_shape(tile_shape, frontend=None):
+    #(frames, fft bins) of the phase of a tile
+    fft_size = frontend["fft_size"] if frontend is not None else 2 * tile_shape[0]
+    return (tile_shape[0], fft_size // 2)
+
+def check_phase_track(phase):
+    if phase is not None and phase not in phase_tracks:
+        raise ValueError("unknown phase track {phase}, choose from {names}".format(phase=phase, names=", ".join(phase_tracks)))
+
+
+def shuffle_bytes(tile):
+    #bytes of a tile regrouped by their position within a value
+    raw = np.ascontiguousarray(tile).view(np.uint8).reshape(-1, tile.dtype.itemsize)
+    return np.ascontiguousarray(raw.T)
+
+def unshuffle_bytes(data, out):
+    #shuffle_bytes() undone straight into out (a contiguous tile)
+    itemsize = out.dtype.itemsize
+    out.view(np.uint8).reshape(-1, itemsize)[...] = np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T
+
+
+class _Store(object):
+    #header, index and thread pools, common to both layouts
+    def __init__(self, store_dir, mode="r", n_threads=None):
+        self.store_dir = store_dir
+        self.mode = mode
+        with open(os.path.join(store_dir, "store.json")) as f:
+            self.header = json.load(f)
+        self.tile_shape = tuple(self.header["tile_shape"])
+        self.songs = self.header["songs"]
+        #stores from before the front ends were made are linear
+        self.frontend = self.header.get("frontend", {"kind": "linear", "n_bins": self.tile_shape[1],
+                                                     "fft_size": 2 * self.tile_shape[0]})
+        self.phase_track = self.header.get("phase")     #voice, mix or None (no phase kept)
+        with np.load(os.path.join(store_dir, "index.npz")) as index:
+            self.index = dict(index.items())
+        self.set_index(self.index)
+        self.n_threads = n_threads or os.cpu_count() or 1
+        self._pool = None
+        self._prefetcher = None
+
+    def set_index(self, index):
+        self.index = index
+        self.ids = index["ids"]
+        self.song = index["song"]
+        self.offsets = index["offsets"]
+        self._rows = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, tile_id):
+        return tile_id in self.rows
+
+    @property
+    def rows(self):
+        #tile id --> row (position in the store)
+        if self._rows is None:
+            self._rows = dict((int(tile_id), row) for row, tile_id in enumerate(self.ids))
+        return self._rows
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPool(self.n_threads)
+        return self._pool
+
+    def prefetch(self, rows):
+        #tiles(rows) in the background, .get() returns them
+        if self._prefetcher is None:
+            self._prefetcher = ThreadPool(1)
+        return self._prefetcher.apply_async(self.tiles, (rows,))
+
+    def batches(self, row_batches, depth=2, n_threads=2):
+        #tiles of every rows of row_batches, depth batches loaded ahead on n_threads threads
+        #(batch_prefetcher.BatchPrefetcher: iterate it, close() it)
+        return BatchPrefetcher(self.tiles, row_batches, depth=depth, n_threads=n_threads)
+
+    @property
+    def max_error(self):
+        #worst absolute error against the float tiles, made while writing this store
+        return self.header.get("max_error", 0.0)
+
+    def check_phase(self):
+        if self.phase_track is None:
+            raise ValueError("{store_dir} keeps no phase (preprocess.save_phase)".format(store_dir=self.store_dir))
+
+    def close(self):
+        for pool in (self._pool, self._prefetcher):
+            if pool is not None:
+                pool.close()
+        self._pool = self._prefetcher = None
+
+
+class TileStore(_Store):
+    def __init__(self, store_dir, mode="r", n_threads=None):
+        #mode="r+" for the processes filling a store made by create()
+        #n_threads: decompressing threads of compressed stores (default: all cores)
+        _Store.__init__(self, store_dir, mode=mode, n_threads=n_threads)
+        self.format = self.header.get("format", "float32")     #stores made before formats existed are float32
+        self.dtype = np.dtype(formats[self.format])            #as stored
+        self.scale = self.header.get("scale", 1.0)
+        self.offset = self.header.get("offset", 0.0)
+        self.shard_size = self.header["shard_size"]
+        self.codec = self.header.get("codec", "none")
+        if self.compressed:
+            with np.load(os.path.join(store_dir, "chunks.npz")) as chunks:
+                self.chunk_offsets = chunks["offsets"]
+                self.chunk_lengths = chunks["lengths"]
+        self._shards = {}
+        self._phase_shards = {}
+
+    def shard(self, shard_no):
+        #memory mapped shard: the tiles of an uncompressed store, the chunk bytes of a compressed one
+        shard = self._shards.get(shard_no)
+        if shard is None:
+            if self.compressed:
+                shard = np.memmap(shard_path(self.store_dir, shard_no, self.codec), dtype=np.uint8, mode="r")
+            else:
+                shard = np.load(shard_path(self.store_dir, shard_no), mmap_mode=self.mode)
+            self._shards[shard_no] = shard
+        return shard
+
+    def phase_shard(self, shard_no):
+        shard = self._phase_shards.get(shard_no)
+        if shard is None:
+            self.check_phase()
+            shard = np.load(phase_path(self.store_dir, shard_no), mmap_mode=self.mode)
+            self._phase_shards[shard_no] = shard
+        return shard
+
+    @property
+    def quantized(self):
+        return self.format != "float32"
+
+    @property
+    def compressed(self):
+        return self.codec != "none"
+
+    def chunk(self, row):
+        #compressed bytes of a tile (a view of its shard)
+        start = self.chunk_offsets[row]
+        return self.shard(row // self.shard_size)[start:start + self.chunk_lengths[row]]
+
+    def decompress_into(self, row, out):
+        unshuffle_bytes(codecs[self.codec][1](self.chunk(row)), out)
+        return out
+
+    def raw_tile(self, row):
+        #one tile as stored, a zero-copy view for uncompressed stores
+        if self.compressed:
+            return self.decompress_into(row, np.empty(self.tile_shape, dtype=self.dtype))
+        return self.shard(row // self.shard_size)[row % self.shard_size]
+
+    def tile(self, row):
+        #one float32 tile, a zero-copy view for uncompressed float32 stores
+        if not self.quantized:
+            return self.raw_tile(row)
+        return self.dequantize(self.raw_tile(row))
+
+    def tiles(self, rows, out=None):
+        #rows gathered into one float32 (len(rows),)+tile_shape array, read in shard order
+        rows = np.asarray(rows, dtype=np.int64)
+        if out is None:
+            out = np.empty((len(rows),) + self.tile_shape, dtype=np.float32)
+        raw = out if not self.quantized else np.empty(out.shape, dtype=self.dtype)
+        order = np.argsort(rows, kind="stable")
+        if self.compressed:
+            self.pool.map(lambda k: self.decompress_into(rows[k], raw[k]), order)
+        else:
+            for k in order:
+                raw[k] = self.raw_tile(rows[k])
+        if self.quantized:
+            self.dequantize(raw, out=out)
+        return out
+
+    def dequantize(self, raw, out=None):
+        #q*scale+offset of a whole batch at once
+        out = np.multiply(raw, np.float32(self.scale), out=out, dtype=np.float32)
+        out += np.float32(self.offset)
+        return out
+
+    def quantize(self, tiles):
+        #returns the tiles as stored and the worst absolute error made
+        if not self.quantized:
+            return tiles, 0.0
+        tiles = np.asarray(tiles, dtype=np.float32)
+        q = np.rint((tiles - np.float32(self.offset)) / np.float32(self.scale))
+        np.clip(q, 0, np.iinfo(self.dtype).max, out=q)
+        q = q.astype(self.dtype)
+        error = np.abs(self.dequantize(q) - tiles).max() if q.size else 0.0
+        return q, float(error)
+
+    def write(self, first_row, tiles):
+        #tiles go to rows first_row, first_row+1, ... (may span several shards)
+        #returns the worst absolute error quantizing them (0.0 for float32 stores)
+        if self.compressed:
+            raise ValueError("compressed stores are read only, see compress_store()")
+        stored, error = self.quantize(tiles)
+        row, pos = first_row, 0
+        while pos < len(stored):
+            shard_no, shard_row = divmod(row, self.shard_size)
+            shard = self.shard(shard_no)
+            n = min(len(stored) - pos, len(shard) - shard_row)
+            shard[shard_row:shard_row + n] = stored[pos:pos + n]
+            pos += n
+            row += n
+        return error
+
+    def phases(self, rows):
+        #uint8 phase of rows, one (len(rows), frames, fft bins) array
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((len(rows),) + self.phase_shard(0).shape[1:], dtype=np.uint8)
+        for k in np.argsort(rows, kind="stable"):
+            out[k] = self.phase_shard(rows[k] // self.shard_size)[rows[k] % self.shard_size]
+        return out
+
+    def write_phase(self, first_row, phases):
+        #phase of the tiles written to rows first_row, ... (radians, or already quantized to uint8)
+        if phases.dtype != np.uint8:
+            phases = w2s.quantize_phase(phases)
+        row, pos = first_row, 0
+        while pos < len(phases):
+            shard_no, shard_row = divmod(row, self.shard_size)
+            shard = self.phase_shard(shard_no)
+            n = min(len(phases) - pos, len(shard) - shard_row)
+            shard[shard_row:shard_row + n] = phases[pos:pos + n]
+            pos += n
+            row += n
+
+    def n_shards(self):
+        return (len(self) + self.shard_size - 1) // self.shard_size
+
+    def flush(self):
+        for shard in list(self._shards.values()) + list(self._phase_shards.values()):
+            if isinstance(shard, np.memmap):
+                shard.flush()
+
+    def close(self):
+        self.flush()
+        self._shards = {}
+        self._phase_shards = {}
+        _Store.close(self)
+
+    def disk_size(self):
+        #bytes of all shards (phase shards included)
+        size = sum(os.path.getsize(shard_path(self.store_dir, shard_no, self.codec)) for shard_no in range(self.n_shards()))
+        if self.phase_track is not None:
+            size += sum(os.path.getsize(phase_path(self.store_dir, shard_no)) for shard_no in range(self.n_shards()))
+        return size
+
+
+class VirtualTileStore(_Store):
+    #layout="virtual", see the top of this file
+    format = "float32"
+    codec = "none"
+    quantized = False
+    compressed = False
+
+    def __init__(self, store_dir, mode="r", n_threads=None):
+        #mode="r+" for the processes filling a store made by create_virtual()
+        _Store.__init__(self, store_dir, mode=mode, n_threads=n_threads)
+        self.thresh = self.header["thresh"]
+        self.win_size = self.header["win_size"]
+        with np.load(os.path.join(store_dir, "ranges.npz")) as ranges:
+            self.ranges = dict(ranges.items())
+        self.specs = [np.load(os.path.join(store_dir, "spec_{t}.npy".format(t=t)), mmap_mode=mode) for t in ("v", "o")]
+        self.peaks = [np.load(os.path.join(store_dir, "peaks_{t}.npy".format(t=t)), mmap_mode=mode) for t in ("v", "o")]
+        self.phase = None
+        if self.phase_track is not None:
+            self.phase = np.load(os.path.join(store_dir, "phase.npy"), mmap_mode=mode)
+
+    def set_index(self, index):
+        _Store.set_index(self, index)
+        self.range_no = index["range"]
+        self.frame = index["frame"]
+
+    def tile(self, row):
+        return self.tiles([row])[0]
+
+    def tiles(self, rows, out=None):
+        #tiles cut out of the range spectrograms (views of the memory mapped specs) and
+        #normalized all at once, as wav2spec.cut_spectrogram_tiles() would have
+        rows = np.asarray(rows, dtype=np.int64)
+        n_frames = self.tile_shape[0]
+        if out is None:
+            out = np.empty((len(rows),) + self.tile_shape, dtype=np.float32)
+        peaks = np.empty((len(rows), len(self.specs)), dtype=np.float32)
+        for k in np.argsort(rows, kind="stable"):
+            r = self.range_no[rows[k]]
+            start = self.ranges["first_frame"][r] + self.frame[rows[k]]
+            end = min(start + self.ranges["norm_frames"][r], self.ranges["first_frame"][r] + self.ranges["n_frames"][r])
+            for track, (spec, frame_peaks) in enumerate(zip(self.specs, self.peaks)):
+                out[k, :, :, track] = spec[start:start + n_frames]
+                peaks[k, track] = frame_peaks[start:end].max()
+        return w2s.normalize_tiles(out, peaks[:, None, None, :], log=True, thresh=self.thresh)
+
+    def phases(self, rows):
+        #uint8 phase of rows, cut out of the range phase like the tiles are
+        self.check_phase()
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.ranges["first_frame"][self.range_no[rows]] + self.frame[rows]
+        return w2s.cut_phase_tiles(self.phase, starts, self.tile_shape[0])
+
+    def write_range(self, range_no, spec_v, spec_o, phase=None):
+        #song_spectrogram()s of a range of both tracks go to its frames
+        #phase: the (quantized) phase of the phase track, if the store keeps one
+        first, n_frames = self.ranges["first_frame"][range_no], self.ranges["n_frames"][range_no]
+        if self.phase is not None:
+            if phase is None or len(phase) < n_frames:
+                raise ValueError("range {r}: the store keeps the {t} phase, {n} frames of it are needed".format(
+                    r=range_no, t=self.phase_track, n=n_frames))
+            self.phase[first:first + n_frames] = phase[:n_frames]
+        for spec, frame_peaks, track_spec in zip(self.specs, self.peaks, (spec_v, spec_o)):
+            if len(track_spec) < n_frames:
+                raise ValueError("range {r}: {n} frames planned, the spectrogram has {m}".format(r=range_no, n=n_frames, m=len(track_spec)))
+            spec[first:first + n_frames] = track_spec[:n_frames]
+            frame_peaks[first:first + n_frames] = track_spec[:n_frames].max(axis=1)
+        return 0.0
+
+    def flush(self):
+        for array in self.specs + self.peaks + [self.phase]:
+            if isinstance(array, np.memmap):
+                array.flush()
+
+    def close(self):
+        self.flush()
+        _Store.close(self)
+
+    def disk_size(self):
+        size = sum(os.path.getsize(os.path.join(self.store_dir, "{a}_{t}.npy".format(a=a, t=t)))
+                   for a in ("spec", "peaks") for t in ("v", "o"))
+        if self.phase is not None:
+            size += os.path.getsize(os.path.join(self.store_dir, "phase.npy"))
+        return size
+
+
+def create(store_dir, ids, song, offsets, songs, tile_shape, fmt="float32", value_range=None, shard_size=default_shard_size,
+           frontend=None, phase=None):
+    #lays out an empty store for the given index (shards are allocated, not written)
+    #and returns it opened for writing
+    #fmt: float32, uint16 or uint8 (quantized over value_range)
+    #frontend: how the tiles were made (preprocess.frontend_info()), kept in the header
+    #phase: voice or mix, phase shards of that track are laid out next to the tile shards
+    check_phase_track(phase)
+    scale, offset = quantization(fmt, value_range)
+    dtype = formats[fmt]
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.makedirs(store_dir)
+    n_tiles = len(ids)
+    for shard_no, first in enumerate(range(0, n_tiles, shard_size)):
+        shape = (min(shard_size, n_tiles - first),) + tuple(tile_shape)
+        np.lib.format.open_memmap(shard_path(store_dir, shard_no), mode="w+", dtype=dtype, shape=shape).flush()
+        if phase is not None:
+            np.lib.format.open_memmap(phase_path(store_dir, shard_no), mode="w+", dtype=np.uint8,
+                                      shape=shape[:1] + phase_shape(tile_shape, frontend)).flush()
+    np.savez(os.path.join(store_dir, "index.npz"), ids=np.asarray(ids, dtype=np.int64),
+             song=np.asarray(song, dtype=np.int32), offsets=np.asarray(offsets, dtype=np.float64))
+    header = {"tile_shape": list(tile_shape), "format": fmt, "scale": scale, "offset": offset,
+              "error_bound": scale / 2 if fmt != "float32" else 0.0, "max_error": 0.0,
+              "shard_size": shard_size, "songs": list(songs), "n_tiles": n_tiles}
+    if frontend is not None:
+        header["frontend"] = frontend
+    if phase is not None:
+        header["phase"] = phase
+    write_header(store_dir, header)
+    return TileStore(store_dir, mode="r+")
+
+
+def create_virtual(store_dir, index, ranges, songs, tile_shape, thresh, win_size, frontend=None, phase=None):
+    #lays out an empty virtual store (spectrograms are allocated, not written) and returns it opened for writing
+    #index: ids, song, offsets, range, frame of every tile. ranges: song, rate, start, end, span_start,
+    #n_samples, first_frame, n_frames, norm_frames of every range (see the top of this file)
+    #phase: voice or mix, the phase of that track is laid out next to the spectrograms
+    check_phase_track(phase)
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.makedirs(store_dir)
+    total_frames = int(np.sum(ranges["n_frames"]))
+    for t in ("v", "o"):
+        np.lib.format.open_memmap(os.path.join(store_dir, "spec_{t}.npy".format(t=t)), mode="w+", dtype=np.float32,
+                                  shape=(total_frames, tile_shape[1])).flush()
+        np.lib.format.open_memmap(os.path.join(store_dir, "peaks_{t}.npy".format(t=t)), mode="w+", dtype=np.float32,
+                                  shape=(total_frames,)).flush()
+    if phase is not None:
+        np.lib.format.open_memmap(os.path.join(store_dir, "phase.npy"), mode="w+", dtype=np.uint8,
+                                  shape=(total_frames,) + phase_shape(tile_shape, frontend)[1:]).flush()
+    np.savez(os.path.join(store_dir, "index.npz"), **index)
+    np.savez(os.path.join(store_dir, "ranges.npz"), **ranges)
+    header = {"layout": "virtual", "tile_shape": list(tile_shape), "format": "float32", "thresh": thresh,
+              "win_size": win_size, "songs": list(songs), "n_tiles": len(index["ids"])}
+    if frontend is not None:
+        header["frontend"] = frontend
+    if phase is not None:
+        header["phase"] = phase
+    write_header(store_dir, header)
+    return VirtualTileStore(store_dir, mode="r+")
+
+
+def compress_store(store, store_dir, codec="zlib", level=None):
+    #compressed copy of a filled (uncompressed) store, tiles are compressed shard by shard on store.pool
+    if codec not in codecs:
+        raise ValueError("unknown codec {codec}, choose from {names}".format(codec=codec, names=sorted(codecs)))
+    if os.path.exists(store_dir):
+        shutil.rmtree(store_dir)
+    os.makedirs(store_dir)
+    compress = codecs[codec][0]
+    chunk_offsets = np.zeros(len(store), dtype=np.int64)
+    chunk_lengths = np.zeros(len(store), dtype=np.int64)
+    for shard_no, first in enumerate(range(0, len(store), store.shard_size)):
+        rows = range(first, min(first + store.shard_size, len(store)))
+        chunks = store.pool.map(lambda row: compress(shuffle_bytes(store.raw_tile(row)), level), rows)
+        pos = 0
+        with open(shard_path(store_dir, shard_no, codec), "wb") as f:
+            for row, chunk in zip(rows, chunks):
+                f.write(chunk)
+                chunk_offsets[row], chunk_lengths[row] = pos, len(chunk)
+                pos += len(chunk)
+        if store.phase_track is not None:
+            shutil.copyfile(phase_path(store.store_dir, shard_no), phase_path(store_dir, shard_no))
+    np.savez(os.path.join(store_dir, "index.npz"), ids=store.ids, song=store.song, offsets=store.offsets)
+    np.savez(os.path.join(store_dir, "chunks.npz"), offsets=chunk_offsets, lengths=chunk_lengths)
+    write_header(store_dir, dict(store.header, codec=codec, level=level))
+    return TileStore(store_dir)
+
+
+def write_header(store_dir, header):
+    with open(os.path.join(store_dir, "store.json") + ".tmp", "w") as f:
+        json.dump(header, f)
+    os.replace(os.path.join(store_dir, "store.json") + ".tmp", os.path.join(store_dir, "store.json"))
+
+
+def publish(building_dir, store_dir):
+    #a filled store replaces the one at store_dir
+    #the old store is renamed aside first and only deleted once the new one is in place,
+    #so a crash in between leaves it at store_dir+".old" (open_store puts it back)
+    old_dir = store_dir + ".old"
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+    if os.path.exists(store_dir):
+        os.rename(store_dir, old_dir)
+    os.rename(building_dir, store_dir)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+
+def load_store(store_dir, mode="r", n_threads=None):
+    #TileStore or VirtualTileStore, whichever layout the store at store_dir has
+    with open(os.path.join(store_dir, "store.json")) as f:
+        layout = json.load(f).get("layout", "tiles")
+    return (VirtualTileStore if layout == "virtual" else TileStore)(store_dir, mode=mode, n_threads=n_threads)
+
+
+def open_store(store_dir):
+    #the store at store_dir, None if there is none (yet)
+    old_dir = store_dir + ".old"
+    if not os.path.exists(store_dir) and os.path.exists(os.path.join(old_dir, "store.json")):
+        os.rename(old_dir, store_dir)       #publish() was interrupted after renaming the old store aside
+    if not os.path.exists(os.path.join(store_dir, "store.json")):
+        return None
+    return load_store(store_dir)
@@ -0,0 +1,89 @@
+'''
+update_scheduler.py
+
+which of the discriminator (d) and generator (g) updates a training step runs (fin_model.pix2pix.train)
+
+    scheduler = UpdateScheduler("adaptive", n_d=1, n_g=1, d_low=0.5, d_high=2.5)
+    for step ...:
+        for update in scheduler.plan():             # ("d", "g"), ("g",), ...
+            ... run d_optim / g_optim ...
+        scheduler.observe(d_loss, g_loss)           # losses of this step, for the next plan()
+        print(scheduler.log_line())                 # D ran, G skipped (d_loss 2.71 > 2.50)
+    print(scheduler.summary())
+
+fixed   : n_d d updates for every n_g g updates, over cycles of max(n_d, n_g) steps (one batch each):
+          step k of a cycle runs d if k < n_d, g if k < n_g. 1:1 runs both every step, 4:1 runs d
+          every step and g every 4th
+adaptive: the fixed plan, minus the d update while the last d_loss (real + fake) is below d_low
+          (the discriminator is winning) and minus the g update while it is above d_high (the
+          discriminator is losing). d_low < d_high, so a step never skips both for that reason
+every skipped update is a forward/backward pass of the models saved.
+
+'''
+
+modes = ("fixed", "adaptive")
+
+
+class UpdateScheduler(object):
+    def __init__(self, mode="fixed", n_d=1, n_g=1, d_low=0.5, d_high=2.5):
+        if mode not in modes:
+            raise ValueError("unknown schedule {mode}, choose from {names}".format(mode=mode, names=", ".join(modes)))
+        if n_d < 1 or n_g < 1:
+            raise ValueError("n_d and n_g must be >= 1, got {n_d}:{n_g}".format(n_d=n_d, n_g=n_g))
+        if mode == "adaptive" and not d_low < d_high:
+            raise ValueError("d_low ({lo}) must be below d_high ({hi})".format(lo=d_low, hi=d_high))
+        self.mode = mode
+        self.n_d, self.n_g = n_d, n_g
+        self.d_low, self.d_high = d_low, d_high
+        self.step = 0
+        self.d_loss = None      #last observed
+        self.g_loss = None
+        self.ran = {"d": 0, "g": 0}
+        self.skipped = {"d": 0, "g": 0}
+        self.last = []          #(update, ran, reason) of the last plan()
+
+    def plan(self):
+        #updates of the next step, in order
+        k = self.step % max(self.n_d, self.n_g)
+        self.step += 1
+        self.last = []
+        updates = []
+        for update, due in (("d", k < self.n_d), ("g", k < self.n_g)):
+            if not due:
+                continue
+            reason = self.skip_reason(update)
+            self.last.append((update, reason is None, reason))
+            if reason is None:
+                updates.append(update)
+                self.ran[update] += 1
+            else:
+                self.skipped[update] += 1
+        return tuple(updates)
+
+    def skip_reason(self, update):
+        #why update should be skipped now, None to run it
+        if self.mode != "adaptive" or self.d_loss is None:
+            return None
+        if update == "d" and self.d_loss < self.d_low:
+            return "d_loss {loss:.2f} < {lo:.2f}".format(loss=self.d_loss, lo=self.d_low)
+        if update == "g" and self.d_loss > self.d_high:
+            return "d_loss {loss:.2f} > {hi:.2f}".format(loss=self.d_loss, hi=self.d_high)
+        return None
+
+    def observe(self, d_loss, g_loss):
+        self.d_loss, self.g_loss = float(d_loss), float(g_loss)
+
+    def log_line(self):
+        #what the last plan() ran and skipped
+        parts = []
+        for update, ran, reason in self.last:
+            if ran:
+                parts.append("{u} ran".format(u=update.upper()))
+            else:
+                parts.append("{u} skipped ({reason})".format(u=update.upper(), reason=reason))
+        return ", ".join(parts) if parts else "nothing due"
+
+    def summary(self):
+        return "schedule {mode} {n_d}:{n_g}, D {d_ran} ran / {d_skip} skipped, G {g_ran} ran / {g_skip} skipped".format(
+            mode=self.mode, n_d=self.n_d, n_g=self.n_g, d_ran=self.ran["d"], d_skip=self.skipped["d"],
+            g_ran=self.ran["g"], g_skip=self.skipped["g"])
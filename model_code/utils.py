@@ -16,8 +16,9 @@ get_stddev = lambda x, k_h, k_w: 1/math.sqrt(k_w*k_h*x.get_shape()[-1])
 
 # -----------------------------
 # new added functions for pix2pix
-def load_npy(npypath):
-    res=np.load(npypath)
+def load_npy(npypath, mmap=False):
+    #mmap=True: memory mapped (read only), slicing gives zero-copy views (e.g. tile_store shards)
+    res=np.load(npypath, mmap_mode="r" if mmap else None)
     return res
 
 '''
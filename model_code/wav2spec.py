@@ -21,6 +21,8 @@ Xinglei Zhu, G. Beauregard, L. Wyse. Real-Time Signal
 Estimation from Modified Short-Time Fourier Transform
 Magnitude Spectra. IEEE Transactions on Audio Speech and
 Language Processing, 08/2007.
+N. Perraudin, P. Balazs, P. L. Sondergaard. A fast Griffin-Lim
+algorithm. IEEE WASPAA, 2013. (momentum of iterate_invert_spectrogram())
 """
 
 
@@ -37,9 +39,10 @@ by
 
 # Packages we're using
 import numpy as np
-import copy
 from scipy.io import wavfile
-from scipy.signal import butter, lfilter
+from scipy.signal import butter, sosfilt
+import fft_backend as fftb # numpy / scipy (multithreaded) / pyfftw, see fft_backend.set_backend()
+import filterbank as fb # mel / logfreq front ends, see filterbank.frontend_banks()
 
 ### Parameters ###
 fft_size = 2048 # window size for the FFT (resolution for freq bin)
@@ -49,17 +52,112 @@ lowcut = 50 # Hz # Low cut for our butter bandpass filter
 highcut = 17000 # Hz # High cut for our butter bandpass filter
 
 
-def butter_bandpass(lowcut, highcut, fs, order=5):
-    nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    return b, a
+_filter_cache = {}
 
-def butter_bandpass_filter(data, lowcut, highcut, fs, order=5):
-    b, a = butter_bandpass(lowcut, highcut, fs, order=order)
-    y = lfilter(b, a, data)
-    return y
+def butter_bandpass(lowcut, highcut, fs, order=5, output='ba'):
+    #designed once per (lowcut, highcut, fs, order, output), output='sos' for second-order sections
+    key = (lowcut, highcut, fs, order, output)
+    coefs = _filter_cache.get(key)
+    if coefs is None:
+        nyq = 0.5 * fs
+        low = lowcut / nyq
+        high = highcut / nyq
+        coefs = butter(order, [low, high], btype='band', output=output)
+        _filter_cache[key] = coefs
+    return coefs
+
+def butter_bandpass_filter_stream(blocks, lowcut, highcut, fs, order=5, dtype=np.float32):
+    """
+    filters an iterable of consecutive blocks (along axis 0) of one long signal,
+    carrying the filter state from block to block: the concatenated output is
+    the same as filtering the whole signal at once, in memory bounded by a block
+    yields the filtered blocks as dtype
+    """
+    sos = butter_bandpass(lowcut, highcut, fs, order=order, output='sos').astype(dtype)
+    zi = None
+    for block in blocks:
+        block = np.asarray(block, dtype=dtype)
+        if zi is None:
+            zi = np.zeros((sos.shape[0], 2) + block.shape[1:], dtype=dtype) # at rest, as lfilter starts
+        filtered, zi = sosfilt(sos, block, axis=0, zi=zi)
+        yield filtered
+
+def butter_bandpass_filter(data, lowcut, highcut, fs, order=5, dtype=np.float32, chunk_size=None):
+    """
+    second-order-section butterworth bandpass along axis 0, computed in dtype
+    (no float64 copy of the song). chunk_size: filter that many samples at a time,
+    only one converted chunk is held besides the output
+    """
+    if chunk_size is None:
+        chunk_size = max(len(data), 1)
+    filtered = np.empty(np.shape(data), dtype=dtype)
+    blocks = (data[start:start + chunk_size] for start in range(0, len(data), chunk_size))
+    start = 0
+    for block in butter_bandpass_filter_stream(blocks, lowcut, highcut, fs, order=order, dtype=dtype):
+        filtered[start:start + len(block)] = block
+        start += len(block)
+    return filtered
+
+_window_cache = {}
+
+def hamming_window(size, dtype=np.float64):
+    """
+    hamming window used by stft() and invert_spectrogram(), cached per (size, dtype)
+    returned array is shared, do not write into it
+    """
+    key = (int(size), np.dtype(dtype).str)
+    win = _window_cache.get(key)
+    if win is None:
+        win = 0.54 - .46 * np.cos(2 * np.pi * np.arange(size) / (size - 1))
+        win = win.astype(dtype)
+        win.flags.writeable = False
+        _window_cache[key] = win
+    return win
+
+def n_overlap_windows(n_samples, window_size, window_step):
+    """
+    number of windows overlap() makes out of n_samples
+    (the signal is zero padded up to the next multiple of window_size first)
+    """
+    padded = n_samples + window_size - n_samples % window_size
+    return int((padded - window_size) // window_step)
+
+def overlap_view(X, window_size, window_step, n_windows=None):
+    """
+    Strided (zero-copy) version of overlap(), works along the last axis
+    Parameters
+    ----------
+    X : ndarray, shape=(..., n_samples)
+        Input signal(s) to window and overlap
+    window_size : int
+        Size of windows to take
+    window_step : int
+        Step size between windows
+    n_windows : int, optional
+        Number of windows to take. Defaults to the same count as overlap()
+    Returns
+    -------
+    X_strided : shape=(..., n_windows, window_size)
+        read-only view on X. X is only copied (once, not per window) when
+        the requested windows run past its end and zeros must be appended
+    """
+    if window_size % 2 != 0:
+        raise ValueError("Window size must be even!")
+    X = np.asarray(X)
+    n_samples = X.shape[-1]
+    if n_windows is None:
+        n_windows = n_overlap_windows(n_samples, window_size, window_step)
+    n_windows = max(int(n_windows), 0)
+
+    needed = (n_windows - 1) * window_step + window_size
+    if needed > n_samples:
+        pad = [(0, 0)] * (X.ndim - 1) + [(0, needed - n_samples)]
+        X = np.pad(X, pad, mode='constant')
+
+    shape = X.shape[:-1] + (n_windows, window_size)
+    strides = X.strides[:-1] + (X.strides[-1] * window_step, X.strides[-1])
+    return np.lib.stride_tricks.as_strided(X, shape=shape, strides=strides,
+                                           writeable=False)
 
 def overlap(X, window_size, window_step):
     """
@@ -77,71 +175,190 @@ def overlap(X, window_size, window_step):
     X_strided : shape=(n_windows, window_size)
         2D array of overlapped X
     """
-    if window_size % 2 != 0:
-        raise ValueError("Window size must be even!")
-    # Make sure there are an even number of windows before stridetricks
-    append = np.zeros((window_size - len(X) % window_size))
-    X = np.hstack((X, append))
-
-    ws = window_size
-    ss = window_step
-    a = X
-
-    valid = len(a) - ws
-    nw = int((valid) // ss)
-    out = np.ndarray((nw,ws),dtype = a.dtype)
+    return np.array(overlap_view(X, window_size, window_step))
 
-    for i in range(nw):
-        # "slide" the window along the samples
-        start = i * ss
-        stop = start + ws
-        out[i] = a[start : stop]
 
-    return out
-
-
-def stft(X, fftsize=128, step=65, mean_normalize=True, real=False,
-         compute_onesided=True):
+def stft_batch(X, fftsize=128, step=65, mean_normalize=True, real=False,
+               compute_onesided=True, n_frames=None, dtype=None):
     """
-    Compute STFT for 1D real valued input X
+    Compute STFT for a stack of 1D real valued clips in one vectorized call
+    X : ndarray, shape=(n_clips, n_samples) (or (n_samples,))
+    n_frames : number of frames to take, defaults to what overlap() gives
+    dtype : float precision of the framing/windowing (e.g. np.float32),
+            defaults to float64 through numpy promotion as before
+    returns shape=(n_clips, n_frames, n_bins) (or (n_frames, n_bins))
     """
     if real:
-        local_fft = np.fft.rfft
+        local_fft = fftb.get_backend().rfft
         cut = -1
     else:
-        local_fft = np.fft.fft
+        local_fft = fftb.get_backend().fft
         cut = None
     if compute_onesided:
         cut = fftsize // 2
+    X = np.asarray(X, dtype=dtype)
     if mean_normalize:
-        X -= X.mean()
+        X = X - X.mean(axis=-1, keepdims=True)     # one copy per clip, input is left untouched
 
-    X = overlap(X, fftsize, step)
-    
-    size = fftsize
-    win = 0.54 - .46 * np.cos(2 * np.pi * np.arange(size) / (size - 1))
-    X = X * win[None]
-    X = local_fft(X)[:, :cut]
-    return X
+    frames = overlap_view(X, fftsize, step, n_windows=n_frames)
 
+    win = hamming_window(fftsize, dtype=np.float64 if dtype is None else dtype)
+    frames = frames * win       # the only per-frame copy, needed by the fft anyway
+    return local_fft(frames)[..., :cut]
 
-def pretty_spectrogram(d,log = True, thresh= 5, fft_size = 512, step_size = 64):
+def stft(X, fftsize=128, step=65, mean_normalize=True, real=False,
+         compute_onesided=True, n_frames=None, dtype=None):
+    """
+    Compute STFT for 1D real valued input X
+    """
+    return stft_batch(X, fftsize=fftsize, step=step, mean_normalize=mean_normalize,
+                      real=real, compute_onesided=compute_onesided, n_frames=n_frames,
+                      dtype=dtype)
+
+
+def _magnitude(X, real):
+    #|X|, as float32 on the real path (written straight into the float32 buffer)
+    if not real:
+        return np.abs(X)
+    specgram = np.empty(X.shape, dtype=np.float32)
+    np.abs(X, out=specgram)
+    return specgram
+
+def _log_threshold(specgram, log, thresh, norm_axis=None):
+    #volume normalize, log and threshold in place
+    if log == True:
+        specgram /= specgram.max(axis=norm_axis, keepdims=True) # volume normalize to max 1
+        np.log10(specgram, out=specgram) # take log
+        np.maximum(specgram, -thresh, out=specgram) # set anything less than the threshold as the threshold
+    else:
+        np.maximum(specgram, thresh, out=specgram) # set anything less than the threshold as the threshold
+    return specgram
+
+def _apply_bank(specgram, bank):
+    #magnitudes --> front end bands (filterbank.frontend_banks() analysis bank), before any normalization
+    if bank is None:
+        return specgram
+    return fb.apply_filterbank(bank, specgram)
+
+def pretty_spectrogram(d,log = True, thresh= 5, fft_size = 512, step_size = 64, real = False, bank = None):
     """
     creates a spectrogram
     log: take the log of the spectrgram
     thresh: threshold minimum power for log spectrogram
+    real: one-sided real fft in float32, returns float32
+          (full complex fft in float64 otherwise, as it always was)
+          for log spectrograms (fft_size=2048, step_size=128, thresh=4) it
+          stays within 1e-4 (log10 units) of the float64 path; ~2e-5 was
+          the worst case measured on music, tones and noise with 100dB range
+    bank: mel/logfreq analysis bank, the bins become its bands (linear bins if None)
+    """
+    specgram = _magnitude(stft(d, fftsize=fft_size, step=step_size, real=real,
+        compute_onesided=True, dtype=np.float32 if real else None), real)
+
+    return _log_threshold(_apply_bank(specgram, bank), log, thresh)
+
+def pretty_spectrogram_batch(d, log = True, thresh= 5, fft_size = 512, step_size = 64, real = False, bank = None,
+                             phase = False):
+    """
+    pretty_spectrogram() for a stack of clips d with shape=(n_clips, n_samples)
+    every clip is volume normalized to its own max, as pretty_spectrogram() does
+    returns shape=(n_clips, n_frames, fft_size//2), or (n_clips, n_frames, bands of bank)
+    phase: returns (spectrograms, quantize_phase() of the linear bins) instead
+    """
+    X = stft_batch(d, fftsize=fft_size, step=step_size, real=real,
+        compute_onesided=True, dtype=np.float32 if real else None)
+    specgram = _log_threshold(_apply_bank(_magnitude(X, real), bank), log, thresh, norm_axis=(-2, -1))
+    if phase:
+        return specgram, quantize_phase(np.angle(X))
+    return specgram
+
+def song_spectrogram(d, fft_size = 512, step_size = 64, real = False, phase = False):
+    """
+    magnitude spectrogram of a whole song (or voice range) with no normalization,
+    made of full frames only. tiles are cut out of it by cut_spectrogram_tiles()
+    returns shape=(n_frames, fft_size//2)
+    phase: returns (magnitudes, quantize_phase() of the same frames) instead
+    """
+    n_frames = song_frames(len(d), fft_size, step_size)
+    X = stft(d, fftsize=fft_size, step=step_size, real=real,
+        compute_onesided=True, n_frames=n_frames, dtype=np.float32 if real else None)
+    if phase:
+        return _magnitude(X, real), quantize_phase(np.angle(X))
+    return _magnitude(X, real)
+
+def quantize_phase(angles):
+    """
+    phase (radians) --> uint8, 256 steps around the circle (error <= pi/256, ~0.7 degrees)
+    """
+    q = np.rint(np.asarray(angles, dtype=np.float32) * np.float32(128 / np.pi))
+    return (q.astype(np.int64) % 256).astype(np.uint8)
+
+def dequantize_phase(q):
+    """
+    quantize_phase() undone, float32 radians in [0, 2pi)
+    """
+    return np.asarray(q, dtype=np.float32) * np.float32(np.pi / 128)
+
+def song_frames(n_samples, fft_size = 512, step_size = 64):
+    """
+    number of frames song_spectrogram() makes of n_samples
+    """
+    return (n_samples - fft_size) // step_size + 1
+
+def frame_offsets(starts, step_size):
+    """
+    sample offsets --> nearest frame offsets of a song_spectrogram() (off by step_size/2 at most)
+    """
+    return np.round(np.asarray(starts, dtype=np.float64) / step_size).astype(np.int64)
+
+def cut_spectrogram_tiles(specgram, offsets, n_frames, norm_frames=None, log = True, thresh = 5):
+    """
+    cuts tiles of n_frames out of a song_spectrogram() at the given frame offsets
+    and makes each of them look like pretty_spectrogram() of its own clip:
+    every tile is volume normalized to the max of the norm_frames (default n_frames)
+    frames from its offset on, i.e. the frames its clip would have had
+    returns shape=(len(offsets), n_frames, n_bins), same dtype as specgram
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if norm_frames is None:
+        norm_frames = n_frames
+    if len(offsets) and offsets.max() + n_frames > specgram.shape[0]:
+        raise ValueError("tile runs past the end of the spectrogram")
+
+    # windowed max over frames, clips at the end of the song see fewer frames
+    frame_max = np.concatenate((specgram.max(axis=1), np.zeros(norm_frames, dtype=specgram.dtype)))
+    frame_max = np.lib.stride_tricks.as_strided(frame_max, shape=(specgram.shape[0], norm_frames),
+                                                strides=frame_max.strides * 2, writeable=False)
+    peaks = frame_max[offsets].max(axis=1)
+
+    tiles = np.lib.stride_tricks.as_strided(specgram,
+                                            shape=(specgram.shape[0] - n_frames + 1, n_frames, specgram.shape[1]),
+                                            strides=(specgram.strides[0],) + specgram.strides, writeable=False)
+    tiles = tiles[offsets]      # the only copy: the output tiles
+    return normalize_tiles(tiles, peaks[:, None, None], log=log, thresh=thresh)
+
+def cut_phase_tiles(phase, offsets, n_frames):
+    """
+    the phase of the tiles cut_spectrogram_tiles() cuts at the same frame offsets (nothing to normalize)
+    returns shape=(len(offsets), n_frames, n_bins), same dtype as phase
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if len(offsets) and offsets.max() + n_frames > phase.shape[0]:
+        raise ValueError("tile runs past the end of the phase")
+    return phase[offsets[:, None] + np.arange(n_frames)]
+
+def normalize_tiles(tiles, peaks, log = True, thresh = 5):
+    """
+    per tile volume normalization + log threshold of cut_spectrogram_tiles(), in place
+    peaks: max magnitude of every tile, broadcastable against tiles
     """
-    specgram = np.abs(stft(d, fftsize=fft_size, step=step_size, real=False,
-        compute_onesided=True))
-  
     if log == True:
-        specgram /= specgram.max() # volume normalize to max 1
-        specgram = np.log10(specgram) # take log
-        specgram[specgram < -thresh] = -thresh # set anything less than the threshold as the threshold
+        tiles /= peaks # volume normalize to max 1, per tile
+        np.log10(tiles, out=tiles) # take log
+        np.maximum(tiles, -thresh, out=tiles) # set anything less than the threshold as the threshold
     else:
-        specgram[specgram < thresh] = thresh # set anything less than the threshold as the threshold
-    
-    return specgram
+        np.maximum(tiles, thresh, out=tiles)
+    return tiles
 
 #from here, matlab ported codes of inverting spectrograms
 
@@ -156,73 +373,192 @@ def xcorr_offset(x1, x2):
     offset = corrs.argmax() - len(x1)
     return offset
 
+def xcorr_spectra(x2s, nfft):
+    """
+    rfft of every (mean removed, reversed) row of x2s, the x2 side of xcorr_offset_fft(),
+    made for all frames at once
+    """
+    x2s = x2s - x2s.mean(axis=-1, keepdims=True)
+    return fftb.get_backend().rfft(x2s[..., ::-1], n=nfft)
+
+def xcorr_offset_fft(x1, x2_spectrum, frame_size, nfft):
+    """
+    xcorr_offset() with the correlation made by one rfft/irfft pair instead of np.convolve
+    x2_spectrum: row of xcorr_spectra() of the x2 with len(x2)==frame_size, nfft >= len(x1)+frame_size-1
+    """
+    backend = fftb.get_backend()
+    x1 = x1 - x1.mean()
+    corrs = backend.irfft(backend.rfft(x1, n=nfft) * x2_spectrum, n=nfft)[:len(x1) + frame_size - 1]
+    half = frame_size // 2
+    corrs[:half] = -1E30
+    corrs[-half:] = -1E30
+    return corrs.argmax() - len(x1)
+
+def frame_estimates(X_s, set_zero_phase=True):
+    """
+    np.real(ifft(X_s[i]))[::-1] of every frame, as one batched irfft of the hermitian part of X_s
+    (the real part of an ifft only sees (X[k] + conj(X[-k]))/2)
+    """
+    n = X_s.shape[1]
+    X = X_s.real if set_zero_phase else X_s
+    hermitian = np.empty((X.shape[0], n // 2 + 1), dtype=X.dtype)
+    np.conjugate(X[:, :n // 2 - 1:-1], out=hermitian[:, 1:])     # conj(X[-k]) of k=1..n/2
+    hermitian[:, 0] = np.conjugate(X[:, 0])
+    hermitian += X[:, :n // 2 + 1]
+    hermitian *= 0.5
+    return fftb.get_backend().irfft(hermitian, n=n)[:, ::-1]
+
+def overlap_add(frames, step, length):
+    """
+    sum of frames[i] placed at i*step into a signal of length samples, vectorized:
+    when step divides the frame size, frames are added as size//step blocks of step samples
+    (8 adds for our fft_size/step_size), a scatter-add (bincount) otherwise
+    """
+    n_frames, size = frames.shape
+    if step == int(step) and size % int(step) == 0:
+        step = int(step)
+        blocks = np.zeros((n_frames + size // step, step), dtype=frames.dtype)
+        parts = frames.reshape(n_frames, size // step, step)
+        for r in range(size // step):
+            blocks[r:r + n_frames] += parts[:, r]
+        return blocks.ravel()[:length]
+    positions = (step * np.arange(n_frames)).astype(np.int64)[:, None] + np.arange(size)
+    return np.bincount(positions.ravel(), weights=np.ravel(frames), minlength=length)[:length]
+
 def invert_spectrogram(X_s, step, calculate_offset=True, set_zero_phase=True):
     size = int(X_s.shape[1] // 2)
-    wave = np.zeros((X_s.shape[0] * step + size))
-    # Getting overflow warnings with 32 bit...
-    wave = wave.astype('float64')
-    total_windowing_sum = np.zeros((X_s.shape[0] * step + size))
-    win = 0.54 - .46 * np.cos(2 * np.pi * np.arange(size) / (size - 1))
+    n_frames = X_s.shape[0]
+    length = int(n_frames * step + size)
+    win = hamming_window(size)
+    starts = (step * np.arange(n_frames)).astype(np.int64)
 
     est_start = int(size // 2) - 1
-    est_end = est_start + size
-    for i in range(X_s.shape[0]):
-        wave_start = int(step * i)
-        wave_end = wave_start + size
-        if set_zero_phase:
-            spectral_slice = X_s[i].real + 0j
-        else:
-            # already complex
-            spectral_slice = X_s[i]
-
-        # Don't need fftshift due to different impl.
-        wave_est = np.real(np.fft.ifft(spectral_slice))[::-1]
-        if calculate_offset and i > 0:
-            offset_size = size - step
-            if offset_size <= 0:
-                print("WARNING: Large step size >50\% detected! "
-                      "This code works best with high overlap - try "
-                      "with 75% or greater")
-                offset_size = step
-            offset = xcorr_offset(wave[wave_start:wave_start + offset_size],
-                                  wave_est[est_start:est_start + offset_size])
-        else:
+    # every frame's estimate at once, float64 (getting overflow warnings with 32 bit...)
+    wave_est = frame_estimates(X_s, set_zero_phase)
+    if calculate_offset and n_frames > 1:
+        offset_size = size - step
+        if offset_size <= 0:
+            print("WARNING: Large step size >50\% detected! "
+                  "This code works best with high overlap - try "
+                  "with 75% or greater")
+            offset_size = step
+        offset_size = int(offset_size)
+        # the x2 side of every offset is known upfront, the x1 side (the wave so far) is not:
+        # frames are still added one by one, each offset costs one rfft/irfft pair
+        nfft = 2 ** int(np.ceil(np.log2(2 * offset_size - 1)))
+        spectra = xcorr_spectra(wave_est[:, est_start:est_start + offset_size], nfft)
+        wave = np.zeros(length)
+        for i in range(n_frames):
+            wave_start = starts[i]
             offset = 0
-        wave[wave_start:wave_end] += win * wave_est[
-            est_start - offset:est_end - offset]
-        total_windowing_sum[wave_start:wave_end] += win
-    wave = np.real(wave) / (total_windowing_sum + 1E-6)
+            if i > 0:
+                offset = xcorr_offset_fft(wave[wave_start:wave_start + offset_size], spectra[i], offset_size, nfft)
+            wave[wave_start:wave_start + size] += win * wave_est[i, est_start - offset:est_start + size - offset]
+    else:
+        wave = overlap_add(win * wave_est[:, est_start:est_start + size], step, length)
+    total_windowing_sum = overlap_add(np.broadcast_to(win, (n_frames, size)), step, length)
+    wave = wave / (total_windowing_sum + 1E-6)
     return wave
 
-def iterate_invert_spectrogram(X_s, fftsize, step, n_iter=10, verbose=True):
-    reg = np.max(X_s) / 1E8
-    X_best = copy.deepcopy(X_s)
+def spectral_convergence(est, X_s):
+    """
+    || |est| - X_s || / || X_s || (frobenius norms): how far the magnitudes of a (consistent)
+    estimate are from the target magnitudes X_s, 0 is a perfect match
+    """
+    return np.linalg.norm(np.abs(est) - X_s) / np.linalg.norm(X_s)
+
+istft_floor = 0.1 # istft() divides by no less than this fraction of the peak overlap-added squared window
+
+def istft(X, fftsize=128, step=65):
+    """
+    least squares inverse of stft(real=True) (Griffin & Lim 1984): every frame is irfft'd,
+    windowed again and overlap-added, then divided by the overlap-added squared window
+    X : shape=(n_frames, n_bins), missing top bins (e.g. the nyquist bin stft() drops) are zeros
+    returns shape=((n_frames-1)*step+fftsize,)
+    the squared window adds up to ~0.1% of its maximum at the first and last samples (hamming), dividing by
+    that blows them up to clipping. it is floored at istft_floor of its maximum, so the ~fftsize/4 samples at
+    either end fade in/out instead (the interior, where frames overlap fully, is untouched)
+    """
+    n_frames = X.shape[0]
+    length = int((n_frames - 1) * step + fftsize)
+    win = hamming_window(fftsize)
+    frames = fftb.get_backend().irfft(X, n=fftsize) * win
+    wave = overlap_add(frames, step, length)
+    norm = overlap_add(np.broadcast_to(win * win, frames.shape), step, length)
+    return wave / np.maximum(norm, istft_floor * norm.max())
+
+def iterate_invert_spectrogram(X_s, fftsize, step, n_iter=10, momentum=0.99, tol=1e-3, callback=None, legacy=False,
+                               phase=None):
+    """
+    griffin-lim phase retrieval of the magnitudes X_s (mirrored to fftsize bins as
+    invert_pretty_spectrogram() does), through istft()/stft(real=True) of its one-sided half
+    momentum: fast griffin-lim (Perraudin, Balazs, Sondergaard 2013), each new phase is taken
+              from the consistent estimate pushed further along its last step. 0: plain griffin-lim
+    n_iter: iteration cap. tol: stops early once the spectral convergence changes by less than
+            tol (relative) in one iteration, 0 always runs n_iter
+    callback(i, spectral_convergence) is called after every iteration
+    legacy: synthesis of the MATLAB port instead of istft(), invert_spectrogram() with its offset
+            search on the full mirrored spectrum. its half size frames are no inverse of stft(),
+            the spectral convergence stalls around 0.65 where istft() keeps going down
+    phase: initial phase (radians, or quantize_phase()d) of the one-sided half, shape=(n_frames, fftsize//2),
+           instead of zero phase, e.g. the stft phase of the track the magnitudes were made of. with a good
+           one n_iter=0 (a single istft()) already sounds right, a few iterations make it consistent
+    """
+    if legacy and phase is not None:
+        raise ValueError("an initial phase needs the istft() synthesis, not legacy")
+    if phase is not None and phase.dtype == np.uint8:
+        phase = dequantize_phase(phase)
+    if legacy:
+        target = X_s
+        # Calculate offset was False in the MATLAB version
+        # but in mine it massively improves the result
+        # Possible bug in my impl?
+        synthesize = lambda X, first: invert_spectrogram(X, step, calculate_offset=True, set_zero_phase=first)
+        analyze = lambda x: stft(x, fftsize=fftsize, step=step, compute_onesided=False)[:len(X_s)]
+    else:
+        target = X_s[:, :fftsize // 2]
+        synthesize = lambda X, first: istft(X, fftsize, step)
+        analyze = lambda x: stft(x, fftsize=fftsize, step=step, real=True, mean_normalize=False, n_frames=len(target))
+    reg = np.max(target) / 1E8
+    X_best = target
+    if phase is not None:
+        X_best = target * np.exp(1j * phase[:len(target), :target.shape[1]])
+    prev_est = None
+    prev_conv = None
     for i in range(n_iter):
-        if verbose:
-            print(("Runnning iter %i" % i))
-        if i == 0:
-            X_t = invert_spectrogram(X_best, step, calculate_offset=True,
-                                     set_zero_phase=True)
-        else:
-            # Calculate offset was False in the MATLAB version
-            # but in mine it massively improves the result
-            # Possible bug in my impl?
-            X_t = invert_spectrogram(X_best, step, calculate_offset=True,
-                                     set_zero_phase=False)
-        est = stft(X_t, fftsize=fftsize, step=step, compute_onesided=False)
-        phase = est / np.maximum(reg, np.abs(est))
-        X_best = X_s * phase[:len(X_s)]
-    X_t = invert_spectrogram(X_best, step, calculate_offset=True,
-                             set_zero_phase=False)
-    return np.real(X_t)
-
-def invert_pretty_spectrogram(X_s, log = True, fft_size = 512, step_size = 512/4, n_iter = 10):
-    
+        est = analyze(synthesize(X_best, i == 0))
+        conv = spectral_convergence(est, target)
+        if callback is not None:
+            callback(i, conv)
+        accel = est
+        if momentum and prev_est is not None:
+            accel = est + momentum * (est - prev_est)
+        prev_est = est
+        X_best = target * (accel / np.maximum(reg, np.abs(accel)))
+        if tol and prev_conv is not None and abs(prev_conv - conv) < tol * prev_conv:
+            break
+        prev_conv = conv
+    return np.real(synthesize(X_best, False))
+
+def audio_gain(fft_size = 512):
+    """
+    scale for the output of invert_pretty_spectrogram(): pretty spectrograms are volume normalized
+    to 1, a sinusoid at that level comes back with an amplitude of 2/sum(window), this puts it at
+    half full scale
+    """
+    return 0.25 * hamming_window(fft_size).sum()
+
+def invert_pretty_spectrogram(X_s, log = True, fft_size = 512, step_size = 512/4, n_iter = 10,
+                              momentum = 0.99, tol = 1e-3, callback = None, legacy = False, phase = None):
+    """
+    audio of a pretty_spectrogram(), see iterate_invert_spectrogram() for n_iter, momentum, tol, callback, legacy, phase
+    """
     if log == True:
         X_s = np.power(10, X_s)
 
     X_s = np.concatenate([X_s, X_s[:, ::-1]], axis=1)
-    X_t = iterate_invert_spectrogram(X_s, fft_size, step_size, n_iter=n_iter)
+    X_t = iterate_invert_spectrogram(X_s, fft_size, step_size, n_iter=n_iter, momentum=momentum,
+                                     tol=tol, callback=callback, legacy=legacy, phase=phase)
     return X_t
 
 
@@ -0,0 +1,69 @@
+'''
+wav_writer.py
+
+wav files written chunk by chunk, for audio too long to hold in memory at once
+(stitch.py streams whole songs through it)
+
+    with WavWriter("song.wav", rate=44100, dtype="int16") as out:
+        out.write(chunk)                # float samples, [-1, 1] is full scale
+        out.write_at(start, chunk)      # at sample start, the gap is filled with silence
+
+int16 samples are clipped to full scale, float32 ones are written as they are.
+the RIFF/data sizes in the header are only known at the end, close() patches them in.
+
+'''
+
+import struct
+import numpy as np
+
+wav_formats = {"int16": (1, np.dtype("<i2")), "float32": (3, np.dtype("<f4"))}   #WAVE_FORMAT_PCM / _IEEE_FLOAT
+
+silence_chunk = 2**16   #samples of silence written at a time
+
+
+class WavWriter(object):
+    def __init__(self, path, rate=44100, dtype="int16"):
+        if dtype not in wav_formats:
+            raise ValueError("unknown wav dtype {dtype}, choose from {names}".format(dtype=dtype, names=sorted(wav_formats)))
+        self.path = path
+        self.rate = int(rate)
+        self.format_tag, self.dtype = wav_formats[dtype]
+        self.n_samples = 0
+        self.f = open(path, "wb")
+        self._write_header()
+
+    def _write_header(self):
+        size = self.n_samples * self.dtype.itemsize
+        block_align = self.dtype.itemsize          #mono
+        self.f.write(b"RIFF" + struct.pack("<I", 36 + size) + b"WAVE")
+        self.f.write(b"fmt " + struct.pack("<IHHIIHH", 16, self.format_tag, 1, self.rate,
+                                           self.rate * block_align, block_align, 8 * self.dtype.itemsize))
+        self.f.write(b"data" + struct.pack("<I", size))
+
+    def write(self, samples):
+        samples = np.asarray(samples, dtype=np.float64).ravel()
+        if self.dtype.kind == "i":
+            samples = np.rint(np.clip(samples, -1.0, 1.0) * 32767)
+        self.f.write(samples.astype(self.dtype).tobytes())
+        self.n_samples += len(samples)
+
+    def write_at(self, start, samples):
+        #samples starting at sample start (>= what is written so far), silence up to there
+        if start < self.n_samples:
+            raise ValueError("sample {start} is already written ({n} so far)".format(start=start, n=self.n_samples))
+        while self.n_samples < start:
+            self.write(np.zeros(min(silence_chunk, start - self.n_samples)))
+        self.write(samples)
+
+    def close(self):
+        if self.f.closed:
+            return
+        self.f.seek(0)
+        self._write_header()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
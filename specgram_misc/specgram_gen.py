@@ -3,9 +3,13 @@ thanks to original author delivering core concepts of doing this
 
 http://haythamfayek.com/2016/04/21/speech-processing-for-machine-learning.html 
 '''
+import os
+import sys
 import numpy
 import scipy.io.wavfile
 from scipy.fftpack import dct
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "model_code"))
+import filterbank as fb # cached sparse mel filterbanks
 
 #set specgram stats (units in seconds)
 frame_size=4.0
@@ -41,38 +45,25 @@ pad_signal = numpy.append(emphasized_signal, z) # Pad Signal to make sure that a
 
 '''
 
-indices = numpy.tile(numpy.arange(0, frame_length), (num_frames, 1)) + numpy.tile(numpy.arange(0, num_frames * frame_step, frame_step), (frame_length, 1)).T
-frames = test10sec[indices.astype(numpy.int32, copy=False)]
+#frames are strided views of the signal (no index matrix, no copy), only full frames
+num_frames = min(num_frames, (signal_length - frame_length) // frame_step + 1)
+frames = numpy.lib.stride_tricks.as_strided(test10sec, shape=(num_frames, frame_length),
+                                            strides=(frame_step * test10sec.strides[0], test10sec.strides[0]), writeable=False)
 print("\temp sig shape")
 print(test10sec.shape)
-print("\tindices shape")
-print("\t", indices.shape)
+print("\tframes shape")
+print("\t", frames.shape)
 
 #windowing: hamming window is popular
 NFFT=1024
-frames *= numpy.hamming(frame_length) # frames *= 0.54 - 0.46 * numpy.cos((2 * numpy.pi * n) / (frame_length - 1))  # Explicit Implementation **
+frames = frames * numpy.hamming(frame_length) # frames *= 0.54 - 0.46 * numpy.cos((2 * numpy.pi * n) / (frame_length - 1))  # Explicit Implementation **
 mag_frames = numpy.absolute(numpy.fft.rfft(frames, NFFT))  # Magnitude of the FFT
 pow_frames = ((1.0 / NFFT) * ((mag_frames) ** 2))  # Power Spectrum
 
-#Filter Bank
+#Filter Bank: filters equally spaced in mel from 0 to sample_rate/2, built once (vectorized, sparse)
 nfilt = 1024
-low_freq_mel = 0
-high_freq_mel = (2595 * numpy.log10(1 + (sample_rate / 2) / 700))  # Convert Hz to Mel
-mel_points = numpy.linspace(low_freq_mel, high_freq_mel, nfilt + 2)  # Equally spaced in Mel scale
-hz_points = (700 * (10**(mel_points / 2595) - 1))  # Convert Mel to Hz
-bin = numpy.floor((NFFT + 1) * hz_points / sample_rate)
-
-fbank = numpy.zeros((nfilt, int(numpy.floor(NFFT / 2 + 1))))
-for m in range(1, nfilt + 1):
-    f_m_minus = int(bin[m - 1])   # left
-    f_m = int(bin[m])             # center
-    f_m_plus = int(bin[m + 1])    # right
-
-    for k in range(f_m_minus, f_m):
-        fbank[m - 1, k] = (k - bin[m - 1]) / (bin[m] - bin[m - 1])
-    for k in range(f_m, f_m_plus):
-        fbank[m - 1, k] = (bin[m + 1] - k) / (bin[m + 1] - bin[m])
-filter_banks = numpy.dot(pow_frames, fbank.T)
+fbank = fb.mel_filterbank(nfilt, NFFT, sample_rate)
+filter_banks = fb.apply_filterbank(fbank, pow_frames)
 filter_banks = numpy.where(filter_banks == 0, numpy.finfo(float).eps, filter_banks)  # Numerical Stability
 filter_banks = 20 * numpy.log10(filter_banks)  # dB
 